@@ -0,0 +1,364 @@
+"""
+This module keeps device sessions open between runs of the command line.
+
+Opening a session takes seconds: the SSH handshake, the NETCONF hello, the
+wait after connecting and setting the basic mode. The agent is a local
+daemon which opens a session per device on its first request and keeps it
+open for the following ones, until it is idle for a while. The command line
+and other tools send their requests over a Unix domain socket, one JSON
+object per line, e.g.
+
+ {"action": "diff", "hostname": "switch1", "candidate_file_path": "/srv/candidate.xml"}
+
+and get one JSON object per line back, {"output": ...} or
+{"error": "OCNOSConnectionError", "message": "..."}. Actions are
+'connection', 'get_config', 'diff' and 'commit'. The requests of a device are
+run one after the other, those of different devices concurrently.
+
+Usage:
+ > from pyocnos.agent import AgentDevice
+ > with AgentDevice('switch1') as device:
+ >     device.load_candidate_config(filename='candidate.xml')
+ >     print(device.compare_config())
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+import time
+
+from future.utils import raise_from
+
+from pyocnos import LOGGER_NAME
+from pyocnos.exceptions import OCNOSAgentError
+from pyocnos.exceptions import OCNOSError
+
+# Socket the agent listens on by default
+DEFAULT_SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), 'pyocnos-agent.sock')
+
+# Seconds after which an unused session is closed by default
+DEFAULT_IDLE_TIMEOUT = 300
+
+ACTIONS = ('connection', 'get_config', 'diff', 'commit')
+
+
+class Session:
+    """
+    Session of a device, its lock held while a request uses it and the time
+    it was used last.
+    """
+
+    __slots__ = ('device', 'lock', 'last_used')
+
+    def __init__(self, device):
+        """
+        Args:
+            device: pyocnos.ocnos.OCNOS
+        """
+        self.device = device
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+
+class SessionPool:
+    """
+    Open sessions by hostname. A session is opened by the first request of a
+    device, and opened again if it is found closed.
+    """
+
+    def __init__(self, factory, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Args:
+            factory: callable creating a pyocnos.ocnos.OCNOS from a hostname
+            idle_timeout: (float) Seconds after which an unused session is closed
+        """
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.log = logging.getLogger(LOGGER_NAME)
+
+    def run(self, hostname, func):
+        """
+        Call a function with the open device, no other request of the device
+        running meanwhile. A session failing with an OCNOSError is closed if
+        it is not alive anymore.
+
+        Args:
+            hostname: (String) hostname of the device
+            func: callable taking a pyocnos.ocnos.OCNOS
+
+        Returns: the result of func
+        """
+        with self.lock:
+            session = self.sessions.get(hostname)
+            if session is None:
+                session = self.sessions[hostname] = Session(self.factory(hostname))
+        with session.lock:
+            if not session.device.is_alive():
+                self.log.info('Opening a session to %s', hostname)
+                session.device.open()
+            try:
+                return func(session.device)
+            except OCNOSError:
+                if not session.device.is_alive():
+                    self.discard(hostname, session)
+                raise
+            finally:
+                session.last_used = time.monotonic()
+
+    def discard(self, hostname, session):
+        """
+        Forget a session, so the next request opens a new one.
+        """
+        with self.lock:
+            if self.sessions.get(hostname) is session:
+                del self.sessions[hostname]
+
+    def close_idle(self, now=None):
+        """
+        Close the sessions not used for longer than the idle timeout. Sessions
+        in use are left alone.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            idle = [(hostname, session) for hostname, session in self.sessions.items()
+                    if now - session.last_used > self.idle_timeout]
+        for hostname, session in idle:
+            if session.lock.acquire(blocking=False):
+                try:
+                    self.discard(hostname, session)
+                    self.close_session(hostname, session)
+                finally:
+                    session.lock.release()
+
+    def close(self):
+        """ Close all sessions, e.g. when the agent stops """
+        with self.lock:
+            sessions = list(self.sessions.items())
+            self.sessions.clear()
+        for hostname, session in sessions:
+            with session.lock:
+                self.close_session(hostname, session)
+
+    def close_session(self, hostname, session):
+        """
+        Close a session, logging rather than raising failures.
+        """
+        if not session.device.is_alive():
+            return
+        self.log.info('Closing the session to %s', hostname)
+        try:
+            session.device.close()
+        except OCNOSError:
+            self.log.warning('Closing the session to %s failed', hostname, exc_info=True)
+
+
+def run_request(device, request):
+    """
+    Run a request on an open device.
+
+    Args:
+        device: pyocnos.ocnos.OCNOS
+        request: (dict) the request, see the module docstring
+
+    Returns: output of the request, which JSON can encode
+    """
+    action = request['action']
+    if action == 'connection':
+        return device.is_alive()
+    if action == 'get_config':
+        return device.get_config(request.get('retrieve', 'all'), subtree=request.get('subtree'))
+    device.load_candidate_config(filename=request.get('candidate_file_path'), config=request.get('candidate_config'))
+    if action == 'diff':
+        return device.compare_config(running=request.get('running_config'))
+    device.commit_config(replace_config=bool(request.get('replace')))
+    return None
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """ Answer the requests of one client connection, one per line """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.respond(line)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serve requests on a Unix domain socket, each client connection in a
+    thread of its own. The socket is only accessible by its owner, as the
+    agent uses the credentials of its config.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, pool):
+        """
+        Args:
+            socket_path: (String) path of the socket to create
+            pool: SessionPool of the devices
+        """
+        self.pool = pool
+        self.log = logging.getLogger(LOGGER_NAME)
+        remove_stale_socket(socket_path)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, AgentRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def respond(self, line):
+        """
+        Run one request.
+
+        Args:
+            line: (bytes) JSON of the request
+
+        Returns: (dict) the response
+        """
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if request.get('action') not in ACTIONS or not request.get('hostname'):
+                raise ValueError('A request needs a hostname and an action of {}.'.format(', '.join(ACTIONS)))
+            return {'output': self.pool.run(request['hostname'], lambda device: run_request(device, request))}
+        except (OCNOSError, ValueError) as exception:
+            self.log.warning('Request failed: %s', exception)
+            return {'error': type(exception).__name__, 'message': str(exception)}
+        except Exception as exception:  # pylint: disable=broad-except
+            # The client gets an answer, and the agent carries on
+            self.log.error('Request failed', exc_info=True)
+            return {'error': type(exception).__name__, 'message': str(exception)}
+
+    def service_actions(self):
+        self.pool.close_idle()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def remove_stale_socket(socket_path):
+    """
+    Remove the socket of an agent which did not stop cleanly.
+
+    Raises: OCNOSAgentError if an agent is listening on the socket, or the
+            path is not a socket
+    """
+    if not os.path.exists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise OCNOSAgentError('{} is not a socket.'.format(socket_path))
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        os.remove(socket_path)
+    else:
+        raise OCNOSAgentError('An agent is already listening on {}.'.format(socket_path))
+    finally:
+        client.close()
+
+
+def send_request(request, socket_path=DEFAULT_SOCKET_PATH, timeout=None):
+    """
+    Send a request to the agent and wait for its response.
+
+    Args:
+        request: (dict) the request, see the module docstring
+        socket_path: (String) path of the socket of the agent
+        timeout: (float) Seconds to wait for the response, unlimited if None
+
+    Returns: output of the request
+    Raises: OCNOSAgentError
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with client.makefile('rb') as response_file:
+                line = response_file.readline()
+    except OSError as os_error:
+        raise_from(OCNOSAgentError('Unable to reach the agent on {}: {}'.format(socket_path, os_error)), os_error)
+    if not line:
+        raise OCNOSAgentError('The agent on {} closed the connection.'.format(socket_path))
+    response = json.loads(line.decode('utf-8'))
+    if 'error' in response:
+        raise OCNOSAgentError(
+            'Request {} of {} failed in the agent: {}: {}'.format(
+                request.get('action'), request.get('hostname'), response['error'], response['message']
+            ),
+            error=response['error']
+        )
+    return response['output']
+
+
+class AgentDevice:
+    """
+    Device served by the agent, with the methods of pyocnos.ocnos.OCNOS the
+    command line uses. Opening and closing it leaves the session of the agent
+    open.
+    """
+
+    def __init__(self, hostname, socket_path=DEFAULT_SOCKET_PATH, timeout=None):
+        """
+        Args:
+            hostname: (String) hostname of the device
+            socket_path: (String) path of the socket of the agent
+            timeout: (float) Seconds to wait for a response, unlimited if None
+        """
+        self.hostname = hostname
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.candidate = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def request(self, action, **params):
+        """
+        Send a request of the device to the agent, see send_request().
+        """
+        params.update(action=action, hostname=self.hostname)
+        return send_request(params, self.socket_path, self.timeout)
+
+    def is_alive(self):
+        """ Whether the agent has an open session to the device """
+        return self.request('connection')
+
+    def get_config(self, retrieve='all', subtree=None):
+        """ See OCNOS.get_config """
+        return self.request('get_config', retrieve=retrieve, subtree=subtree)
+
+    def load_candidate_config(self, filename=None, config=None):
+        """
+        Keep the candidate config to send with the following diff and commit
+        requests. A file is read by the agent, from its cache of parsed
+        candidate files.
+        """
+        if filename is not None:
+            self.candidate = {'candidate_file_path': os.path.abspath(str(filename))}
+        else:
+            self.candidate = {'candidate_config': config}
+
+    def compare_config(self, running=None):
+        """ See OCNOS.compare_config """
+        return self.request('diff', running_config=running, **self.candidate)
+
+    def commit_config(self, replace_config=False):
+        """ See OCNOS.commit_config """
+        self.request('commit', replace=replace_config, **self.candidate)
@@ -0,0 +1,207 @@
+"""
+This module audits devices against a golden config template, i.e. it diffs the
+running config of every device with the same candidate config.
+
+The template is parsed and prepared once, see pyocnos.diff.DiffSession. The
+running configs are retrieved by a pool of threads, whilst the diffs are done
+one by one as the configs arrive. At most one running config per thread is held
+at any time, no matter how many devices are audited. The number of devices
+retrieved at once can adapt to their latencies and failures, see
+pyocnos.concurrency.ConcurrencyLimiter.
+
+Usage:
+ > from pyocnos.audit import audit, load_template
+ > template = load_template('golden.xml')
+ > for result in audit(['switch1', 'switch2'], template, 'username', 'password'):
+ >     print(result.hostname, result.compliant)
+"""
+from collections import namedtuple
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import functools
+import itertools
+import logging
+
+from pyocnos import LOGGER_NAME
+from pyocnos import tracing
+from pyocnos.candidate import load_candidate
+from pyocnos.concurrency import ConcurrencyLimiter
+from pyocnos.diff import DiffSession
+from pyocnos.metrics import CONNECT
+from pyocnos.metrics import DIFF
+from pyocnos.metrics import FETCH
+from pyocnos.metrics import Metrics
+from pyocnos.ocnos import OCNOS
+
+# Number of devices retrieved concurrently by default
+DEFAULT_WORKERS = 8
+
+
+class AuditResult(namedtuple('AuditResult', ['hostname', 'diff', 'error'])):
+    """
+    Outcome of the audit of one device: the diff of its running config with
+    the template, or the error which prevented the audit.
+    """
+
+    __slots__ = ()
+
+    @property
+    def compliant(self):
+        """ Whether the running config is the same as the template """
+        return self.error is None and not self.diff
+
+
+def load_template(filename):
+    """
+    Read a template like OCNOS.load_candidate_config does, from the cache of
+    parsed candidate files, and prepare it for the diffs.
+
+    Args:
+        filename: (String) path to the template
+
+    Returns: pyocnos.diff.PreparedTree
+    Raises: OCNOSLoadCandidateConfigFileReadError
+    """
+    return load_candidate(filename).prepared
+
+
+def fetch_running_config(hostname, username, password, timeout, *, metrics, retry=None, limiter=None):
+    """
+    Connect to a device and retrieve its running config.
+
+    Args:
+        hostname: (String) hostname of the device
+        username: (String) Username
+        password: (String) Password
+        timeout: (int) Timeout in seconds
+        metrics: pyocnos.metrics.Metrics to time connect and fetch with
+        retry: retry policies of the device, see pyocnos.ocnos.OCNOS
+        limiter: pyocnos.concurrency.ConcurrencyLimiter to hold a session of and to observe connect and fetch with,
+                 a fixed limit of one session if None
+
+    Returns: (String) running config xml
+    """
+    # pylint: disable=too-many-arguments
+    limiter = ConcurrencyLimiter(1) if limiter is None else limiter
+    device = OCNOS(hostname=hostname, username=username, password=password, timeout=timeout, retry=retry,
+                   metrics=metrics)
+    # The span includes the wait for a session, which is not in its nested spans
+    with tracing.span('audit.fetch_running_config', {'device.hostname': hostname}), limiter.slot(hostname):
+        with metrics.time(CONNECT, hostname), limiter.time(CONNECT):
+            device.open()
+        try:
+            with metrics.time(FETCH, hostname), limiter.time(FETCH) as operation:
+                config = device.get_config('running')['running']
+                operation['size'] = len(config.encode('utf-8'))
+        finally:
+            device.close()
+    metrics.config_bytes.set(operation['size'], host=hostname, source='running')
+    return config
+
+
+def fetch_running_configs(hostnames, username, password, timeout, *, metrics, retry=None, limiter=None,
+                          ordered=True):
+    """
+    Retrieve the running configs of devices in a pool of threads. Devices
+    are submitted only as the results are taken, so no more than one running
+    config per thread is retrieved ahead, no matter how many devices there
+    are.
+
+    Args:
+        hostnames: iterable of hostnames
+        ordered: (bool) whether to take the results in order of hostnames,
+                 or as they are retrieved
+        See fetch_running_config for the other arguments.
+
+    Returns: a generator of tuples of the hostname and the
+             concurrent.futures.Future of its running config
+    """
+    # pylint: disable=too-many-arguments
+    limiter = ConcurrencyLimiter(1) if limiter is None else limiter
+    fetch = functools.partial(fetch_running_config, username=username, password=password, timeout=timeout,
+                              metrics=metrics, retry=retry, limiter=limiter)
+    hostnames = iter(hostnames)
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+        pending = OrderedDict(
+            (executor.submit(fetch, hostname), hostname) for hostname in itertools.islice(hostnames, limiter.max_limit)
+        )
+        while pending:
+            if ordered:
+                done = list(pending)[:1]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            taken = [(pending.pop(future), future) for future in done]
+            for next_hostname in itertools.islice(hostnames, len(taken)):
+                pending[executor.submit(fetch, next_hostname)] = next_hostname
+            yield from taken
+
+
+def audit(hostnames, template, username, password, timeout=60, *, workers=DEFAULT_WORKERS, keys=None, metrics=None,
+          retry=None, limiter=None):
+    """
+    Diff the running config of every device with the template. A device
+    failing with any exception, e.g. an OCNOSError or a running config which
+    can't be parsed or diffed, is reported in its result, the audit carries on
+    with the other devices.
+
+    Args:
+        hostnames: iterable of hostnames
+        template: pyocnos.diff.PreparedTree or serialised xml
+        username: (String) Username
+        password: (String) Password
+        timeout: (int) Timeout in seconds
+        workers: (int) number of devices retrieved concurrently, unless a
+                 limiter is given
+        keys: mapping of xml elements to their key elements, see
+              pyocnos.diff.build_xml_diff
+        metrics: pyocnos.metrics.Metrics to record the audit in
+        retry: retry policies of the devices, see pyocnos.ocnos.OCNOS
+        limiter: pyocnos.concurrency.ConcurrencyLimiter adjusting the number
+                 of devices retrieved concurrently up to its max_limit
+
+    Returns: a generator of AuditResult in order of hostnames
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    log = logging.getLogger(LOGGER_NAME)
+    metrics = Metrics() if metrics is None else metrics
+    limiter = ConcurrencyLimiter(workers, min_limit=workers) if limiter is None else limiter
+    # The session keeps the least recently used similarities and subtree diffs only up to its bounds, so it does not
+    # grow with the fleet
+    session = DiffSession(right=template, keys=keys)
+    for hostname, future in fetch_running_configs(hostnames, username, password, timeout, metrics=metrics, retry=retry,
+                                                  limiter=limiter):
+        try:
+            running_config = future.result()
+            with metrics.time(DIFF, hostname):
+                diff = session.diff(running_config)
+        except Exception as exception:  # pylint: disable=broad-except
+            log.warning('Audit of %s failed', hostname, exc_info=True)
+            metrics.record_exception(hostname, exception)
+            yield AuditResult(hostname, None, exception)
+        else:
+            yield AuditResult(hostname, diff, None)
+
+
+def render_report(results):
+    """
+    Render audit results as a report for the command line.
+
+    Args:
+        results: iterable of AuditResult
+
+    Returns: a generator of lines, ending with a summary
+    """
+    total = compliant = 0
+    for result in results:
+        total += 1
+        if result.error is not None:
+            yield '{}: error: {}'.format(result.hostname, result.error)
+        elif result.compliant:
+            compliant += 1
+            yield '{}: compliant'.format(result.hostname)
+        else:
+            yield '{}: not compliant'.format(result.hostname)
+            yield result.diff
+    yield '{} of {} devices compliant'.format(compliant, total)
@@ -0,0 +1,228 @@
+"""
+This module backs up the running configs of many devices into one tar
+archive.
+
+The running configs are retrieved by a pool of threads, see
+pyocnos.audit.fetch_running_configs, and each one is written to the archive
+as soon as it arrives, whichever device it is from. At most one running
+config per thread is held at any time, and the archive is written in one
+sequential stream, compressed on the fly. The last member of the archive is a
+manifest with the size and the SHA-256 hash of every config, and the devices
+which failed.
+
+Archives are compressed by the suffix of their path: .tar.gz or .tgz with
+gzip, .tar.zst with Zstandard, which needs the zstandard package, or .tar
+not at all.
+
+Usage:
+ > from pyocnos.backup import backup
+ > entries = backup(['switch1', 'switch2'], 'running-configs.tar.gz', 'username', 'password')
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import time
+
+from future.utils import raise_from
+
+from pyocnos import LOGGER_NAME
+from pyocnos.audit import DEFAULT_WORKERS
+from pyocnos.audit import fetch_running_configs
+from pyocnos.concurrency import ConcurrencyLimiter
+from pyocnos.metrics import Metrics
+
+# Archive path written by the command line by default
+DEFAULT_ARCHIVE_PATH = 'running-configs.tar.gz'
+
+# Name of the last member of the archive
+MANIFEST_NAME = 'MANIFEST.json'
+
+# Suffixes of archive paths to their compression, see tarfile.open
+COMPRESSIONS = (
+    ('.tar.gz', 'gz'),
+    ('.tgz', 'gz'),
+    ('.tar.zst', 'zst'),
+    ('.tar', ''),
+)
+
+
+class BackupEntry(namedtuple('BackupEntry', ['hostname', 'name', 'size', 'sha256', 'error'])):
+    """
+    Backup of one device: the name of its running config in the archive,
+    its size in bytes and its SHA-256 hash, or the error which prevented the
+    backup.
+    """
+
+    __slots__ = ()
+
+
+def archive_compression(path):
+    """
+    Tell the compression of an archive by the suffix of its path.
+
+    Args:
+        path: (String) path of the archive
+
+    Returns: (String) 'gz', 'zst' or '' for no compression
+    Raises: ValueError if the suffix is none of COMPRESSIONS
+    """
+    for suffix, compression in COMPRESSIONS:
+        if str(path).endswith(suffix):
+            return compression
+    raise ValueError('The archive path must end with one of {}.'.format(', '.join(dict(COMPRESSIONS))))
+
+
+@contextmanager
+def open_archive(fileobj, compression):
+    """
+    Context manager of a tar archive written as a stream, without seeking.
+
+    Args:
+        fileobj: binary file object to write to
+        compression: (String) see archive_compression
+
+    Returns: tarfile.TarFile
+    """
+    if compression != 'zst':
+        with tarfile.open(fileobj=fileobj, mode='w|' + compression) as archive:
+            yield archive
+        return
+    try:
+        # Imported here as it is optional
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError as import_error:
+        raise_from(ValueError('Writing .tar.zst archives needs the zstandard package.'), import_error)
+    with zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False) as writer:
+        with tarfile.open(fileobj=writer, mode='w|') as archive:
+            yield archive
+
+
+def add_member(archive, name, data, mtime):
+    """
+    Add a file to the archive.
+
+    Args:
+        archive: tarfile.TarFile
+        name: (String) name of the file
+        data: (bytes) content of the file
+        mtime: (int) modification time of the file
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = 0o644
+    archive.addfile(info, io.BytesIO(data))
+
+
+def archive_mode():
+    """
+    Mode of a new archive: tempfile.mkstemp creates its file readable by its
+    owner only, which would otherwise be kept by the archive after the
+    rename, unlike any other file written by the command line.
+
+    Returns: (int) 0o666 without the bits of the umask of the process
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def render_manifest(entries, created):
+    """
+    Render the manifest of the archive.
+
+    Args:
+        entries: list of BackupEntry
+        created: (int) time of the backup
+
+    Returns: (bytes) JSON of the manifest
+    """
+    manifest = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(created)),
+        'devices': [
+            {'hostname': entry.hostname, 'name': entry.name, 'size': entry.size, 'sha256': entry.sha256}
+            for entry in entries if entry.error is None
+        ],
+        'failed': [{'hostname': entry.hostname, 'error': entry.error} for entry in entries if entry.error is not None],
+    }
+    return json.dumps(manifest, indent=2).encode('utf-8')
+
+
+def backup(hostnames, path, username, password, timeout=60, *, workers=DEFAULT_WORKERS, metrics=None, retry=None,
+           limiter=None):
+    """
+    Back up the running configs of devices into a tar archive. A device
+    failing with any exception is listed in the manifest, the backup carries
+    on with the other devices. The archive replaces the file at path once it
+    is complete, with the mode of a file created by open, see archive_mode.
+
+    Args:
+        hostnames: iterable of hostnames
+        path: (String) path of the archive, see archive_compression
+        username: (String) Username
+        password: (String) Password
+        timeout: (int) Timeout in seconds
+        workers: (int) number of devices retrieved concurrently, unless a
+                 limiter is given
+        metrics: pyocnos.metrics.Metrics to record the backup in
+        retry: retry policies of the devices, see pyocnos.ocnos.OCNOS
+        limiter: pyocnos.concurrency.ConcurrencyLimiter adjusting the number
+                 of devices retrieved concurrently up to its max_limit
+
+    Returns: list of BackupEntry in the order of the archive
+    Raises: ValueError if the compression of the path is unknown or unavailable
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    log = logging.getLogger(LOGGER_NAME)
+    compression = archive_compression(path)
+    metrics = Metrics() if metrics is None else metrics
+    limiter = ConcurrencyLimiter(workers, min_limit=workers) if limiter is None else limiter
+    created = int(time.time())
+    entries = []
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with io.open(file_descriptor, 'wb') as archive_file, open_archive(archive_file, compression) as archive:
+            for hostname, future in fetch_running_configs(hostnames, username, password, timeout, metrics=metrics,
+                                                          retry=retry, limiter=limiter, ordered=False):
+                try:
+                    data = future.result().encode('utf-8')
+                except Exception as exception:  # pylint: disable=broad-except
+                    log.warning('Backup of %s failed', hostname, exc_info=True)
+                    metrics.record_exception(hostname, exception)
+                    entries.append(BackupEntry(hostname, None, None, None, str(exception)))
+                    continue
+                name = '{}-running.xml'.format(hostname)
+                add_member(archive, name, data, created)
+                entries.append(BackupEntry(hostname, name, len(data), hashlib.sha256(data).hexdigest(), None))
+            add_member(archive, MANIFEST_NAME, render_manifest(entries, created), created)
+        os.chmod(tmp_path, archive_mode())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return entries
+
+
+def render_report(entries, path):
+    """
+    Render backup entries as a report for the command line.
+
+    Args:
+        entries: list of BackupEntry
+        path: (String) path of the archive
+
+    Returns: a generator of lines
+    """
+    for entry in entries:
+        if entry.error is not None:
+            yield '{}: failed'.format(entry.hostname)
+            yield entry.error
+    yield 'Running configs of {} of {} devices stored in {}'.format(
+        len([entry for entry in entries if entry.error is None]), len(entries), path
+    )
@@ -0,0 +1,209 @@
+"""
+This module parses candidate configs and caches the parsed candidate files.
+
+A fleet run loads the same candidate file to many devices, and each action of
+a run loads it again. The parsed file is kept in a process wide cache by its
+path, modification time and size, so loading it again only takes a stat call.
+A changed file is read again, and if its content is the same as a cached
+file's, identified by a hash of the content, that one is reused.
+
+Cached candidates are shared by all devices they are loaded to, so they must
+not be changed. Each device gets its own copy of the tree when it needs one,
+see CandidateConfig.copy().
+
+Files are hashed and parsed as streams, so a large file is never held in
+memory as a whole besides its tree, see pyocnos.parsing.
+
+Usage:
+ > from pyocnos.candidate import load_candidate
+ > candidate = load_candidate('candidate.xml')
+ > candidate.xml
+ b'<config>...</config>'
+"""
+from collections import OrderedDict
+from copy import deepcopy
+import hashlib
+import os
+import threading
+
+from future.utils import raise_from
+from lxml import etree
+
+from pyocnos.diff import PreparedTree
+from pyocnos.exceptions import OCNOSLoadCandidateConfigFileReadError
+from pyocnos.exceptions import OCNOSNoCandidateConfigError
+from pyocnos.parsing import log_parsed
+from pyocnos.parsing import parse_xml
+
+# Number of different candidate files kept in the cache by default
+DEFAULT_CACHE_SIZE = 16
+
+# Bytes read at once to hash a candidate file
+CHUNK_SIZE = 2 ** 20
+
+
+def parse_candidate_config(filename=None, config=None, huge_tree=None):
+    """
+    Parse a candidate config from a string or file like object, see
+    OCNOS.load_candidate_config.
+    Args:
+        filename:       Path to the file containing the desired
+                        configuration, parsed as a stream. Default: None.
+        config:         String containing the desired configuration.
+                        Default: None.
+        huge_tree:      see pyocnos.parsing.xml_parser
+
+    Returns:            lxml.etree.Element with the tag 'config'
+    Raises:             OCNOSNoCandidateConfigError,
+                        OCNOSLoadCandidateConfigFileReadError
+    """
+    if filename is None and config is None:
+        raise OCNOSNoCandidateConfigError
+    if filename:
+        try:
+            with open(str(filename), 'rb') as candidate_file:
+                candidate_config = parse_xml(candidate_file, huge_tree)
+                size = candidate_file.tell()
+        except IOError as io_error:
+            raise_from(OCNOSLoadCandidateConfigFileReadError, io_error)
+    else:
+        # napalm_install_config passess config as string to the driver,
+        # which is parsed from bytes, so it works with xml encoding declaration
+        candidate_config = parse_xml(config, huge_tree)
+        size = len(config)
+    candidate_config.tag = 'config'
+    log_parsed('candidate config {}'.format(filename or ''), size, candidate_config)
+    return candidate_config
+
+
+class CandidateConfig:
+    """
+    Parsed candidate config, which is never changed. It is serialised once,
+    and prepared for the diff once on first use.
+    """
+
+    __slots__ = ('tree', 'xml', 'lock', '_prepared')
+
+    def __init__(self, tree):
+        """
+        Args:
+            tree: lxml.etree.Element, see parse_candidate_config
+        """
+        self.tree = tree
+        self.xml = etree.tostring(tree, encoding='UTF-8')
+        self.lock = threading.Lock()
+        self._prepared = None
+
+    def copy(self):
+        """
+        Copy the tree, e.g. to send it to a device, which moves it into a rpc.
+
+        Returns: lxml.etree.Element
+        """
+        return deepcopy(self.tree)
+
+    @property
+    def prepared(self):
+        """ The candidate prepared for the diff, see pyocnos.diff.PreparedTree """
+        with self.lock:
+            if self._prepared is None:
+                # A copy of the parsed tree, cheaper than parsing it again
+                self._prepared = PreparedTree(self.copy())
+            return self._prepared
+
+
+class CandidateCache:
+    """
+    Parsed candidate files by their path, modification time and size, and by
+    the hash of their content. The least recently loaded files are dropped.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Args:
+            max_size: (int) Number of different candidate files to keep
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # Paths to tuples of the modification time, the size and the hash of the content
+        self.files = OrderedDict()
+        # Hashes of the content to CandidateConfig
+        self.candidates = OrderedDict()
+
+    def load(self, filename, huge_tree=None):
+        """
+        Get the parsed candidate file, parsing it unless cached.
+
+        Args:
+            filename: Path to the candidate file
+            huge_tree: see pyocnos.parsing.xml_parser
+
+        Returns: CandidateConfig
+        Raises: OCNOSLoadCandidateConfigFileReadError
+        """
+        path = os.path.abspath(str(filename))
+        try:
+            stat = os.stat(path)
+        except OSError as os_error:
+            raise_from(OCNOSLoadCandidateConfigFileReadError, os_error)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            known = self.files.get(path)
+            if known is not None and known[:2] == stamp and known[2] in self.candidates:
+                return self.keep(path, known)
+
+        try:
+            content_hash = hashlib.sha256()
+            with open(path, 'rb') as candidate_file:
+                for chunk in iter(lambda: candidate_file.read(CHUNK_SIZE), b''):
+                    content_hash.update(chunk)
+        except IOError as io_error:
+            raise_from(OCNOSLoadCandidateConfigFileReadError, io_error)
+        digest = content_hash.digest()
+        with self.lock:
+            candidate = self.candidates.get(digest)
+        if candidate is None:
+            candidate = CandidateConfig(parse_candidate_config(filename=path, huge_tree=huge_tree))
+        with self.lock:
+            self.candidates.setdefault(digest, candidate)
+            return self.keep(path, stamp + (digest,))
+
+    def keep(self, path, known):
+        """
+        Mark a file as loaded last and drop the least recently loaded ones.
+        Called with the lock held.
+
+        Args:
+            path: (String) absolute path of the file
+            known: tuple of the modification time, the size and the hash of the content
+
+        Returns: CandidateConfig of the file
+        """
+        self.files[path] = known
+        self.files.move_to_end(path)
+        self.candidates.move_to_end(known[2])
+        while len(self.candidates) > self.max_size:
+            self.candidates.popitem(last=False)
+        while len(self.files) > self.max_size:
+            self.files.popitem(last=False)
+        return self.candidates[known[2]]
+
+    def clear(self):
+        """ Drop all cached files """
+        with self.lock:
+            self.files.clear()
+            self.candidates.clear()
+
+
+# Cache shared by all devices of the process
+CANDIDATE_CACHE = CandidateCache()
+
+
+def load_candidate(filename, huge_tree=None):
+    """
+    Get a parsed candidate file from the process wide cache, see
+    CandidateCache.load.
+
+    Returns: CandidateConfig
+    """
+    return CANDIDATE_CACHE.load(filename, huge_tree)
@@ -4,39 +4,79 @@ Command to expose pyocnos functionality
 from __future__ import print_function
 
 import argparse
+from contextlib import contextmanager
+from contextlib import ExitStack
+import functools
 import io
+import json
 import logging
+import os
 import sys
 import textwrap
 
-import yaml
-
 from pyocnos import LOGGER_NAME
+from pyocnos import parsing
+from pyocnos import tracing
+from pyocnos.agent import AgentDevice
+from pyocnos.agent import AgentServer
+from pyocnos.agent import DEFAULT_IDLE_TIMEOUT
+from pyocnos.agent import DEFAULT_SOCKET_PATH
+from pyocnos.agent import SessionPool
+from pyocnos.audit import audit
+from pyocnos.audit import DEFAULT_WORKERS
+from pyocnos.audit import load_template
+from pyocnos.audit import render_report
+from pyocnos.backup import backup
+from pyocnos.backup import DEFAULT_ARCHIVE_PATH
+from pyocnos.backup import render_report as render_backup_report
+from pyocnos.concurrency import ConcurrencyLimiter
+from pyocnos.concurrency import parse_sites
+from pyocnos.diffstats import DiffStats
+from pyocnos.exceptions import OCNOSError
+from pyocnos.keys import load_keys
+from pyocnos.metrics import COMMIT
+from pyocnos.metrics import CONNECT
+from pyocnos.metrics import DIFF
+from pyocnos.metrics import FETCH
+from pyocnos.metrics import Metrics
 from pyocnos.ocnos import OCNOS
+from pyocnos.ocnos import PERSIST_IMMEDIATE
+from pyocnos.ocnos import PERSIST_MODES
+from pyocnos.render import iter_xml_diff
+from pyocnos.render import RENDERERS
+from pyocnos.retry import retry_policies
 
+# Name of the command diffing local files without a device, e.g. pyocnos diff-files running.xml candidate.xml
+DIFF_FILES_COMMAND = 'diff-files'
 
-# pylint: disable=too-many-locals,too-many-arguments
-def process(config_file_path, hostname, actions, save_config_file_path, candidate_file_path, verbose=0):
+# Actions run on many devices, given as comma separated hostnames
+FLEET_ACTIONS = ('audit', 'backup')
+
+# Name of the command running the agent keeping device sessions open, e.g. pyocnos agent user-details.yml
+AGENT_COMMAND = 'agent'
+
+
+def load_user_details(config_file_path):
     """
-    Initialize device and call the actions passed in
+    Read the yaml config file with username, password and timeout.
     Args:
         config_file_path: (String) Path to the yaml file
-         with username password and timeout
-        hostname: (String) hostname of the device
-        actions: (List) of strings e.g ['replace', 'merge', 'diff']
-        save_config_file_path: (String) Where to store the running or startup config xml from device
-        candidate_file_path: (String) Path to the candidate file
-
-    Returns: (List) of Strings showing user what actions were taken
 
+    Returns: (dict) the config
     """
+    # Imported here to keep 'pyocnos --help' quick
+    import yaml  # pylint: disable=import-outside-toplevel
+
     with open(config_file_path, 'r', encoding='utf-8') as yml_file:
-        config = yaml.safe_load(yml_file)
+        return yaml.safe_load(yml_file)
 
-    username = config['config']['username']
-    password = config['config']['password']
-    timeout = config['config']['timeout']
 
+def setup_logging(verbose):
+    """
+    Log to stdout, the messages of ncclient too if verbose is above 1.
+    Args:
+        verbose: (int) verbosity, nothing is logged if 0
+    """
     if verbose > 0:
         console_handler = logging.StreamHandler(sys.stdout)
         formatter = logging.Formatter('%(name)s | %(levelname)s | %(filename)s/%(funcName)s:%(lineno)d | %(message)s')
@@ -48,7 +88,112 @@ def process(config_file_path, hostname, actions, save_config_file_path, candidat
             logging.getLogger('ncclient').setLevel(logging.DEBUG)
             logging.getLogger('ncclient').addHandler(console_handler)
 
-    with OCNOS(hostname=hostname, username=username, password=password, timeout=timeout) as device:
+
+@contextmanager
+def trace_to_file(trace_file_path):
+    """
+    Context manager tracing into a file, see pyocnos.tracing. Nothing is
+    traced if the path is None.
+    Args:
+        trace_file_path: (String) Path of the file the spans are appended to
+    """
+    if trace_file_path is None:
+        yield
+        return
+    exporter = tracing.FileExporter(trace_file_path)
+    tracing.set_tracer(tracing.Tracer(exporter))
+    try:
+        yield
+    finally:
+        tracing.set_tracer(tracing.NoopTracer())
+        exporter.close()
+
+
+# pylint: disable=too-many-locals,too-many-arguments
+def process(config_file_path, hostname, actions, save_config_file_path, candidate_file_path, verbose=0, *,
+            metrics_file_path=None, workers=DEFAULT_WORKERS, persist=PERSIST_IMMEDIATE, retries=1, retry_deadline=None,
+            max_workers=None, agent_socket_path=None, keys=None):
+    """
+    Initialize device and call the actions passed in
+    Args:
+        config_file_path: (String) Path to the yaml file
+         with username password and timeout, and optionally the sites of
+         the devices with their limits of concurrent sessions
+        hostname: (String) hostname of the device, comma separated hostnames of the devices for the 'audit' and
+                  'backup' actions
+        actions: (List) of strings e.g ['replace', 'merge', 'diff']
+        save_config_file_path: (String) Where to store the running or startup config xml from device, or the
+                               archive of the 'backup' action
+        candidate_file_path: (String) Path to the candidate file
+        metrics_file_path: (String) Where to write Prometheus metrics of this run, no metrics are written if None
+        workers: (int) Number of devices retrieved concurrently by the 'audit' and 'backup' actions
+        max_workers: (int) Number of devices these actions adapt up to from workers, depending on their
+                     latencies and failures. Fixed at workers if None
+        agent_socket_path: (String) Socket of the agent to run the actions in, see pyocnos.agent. The actions
+                           connect to the device themselves if None
+        persist: (String) When the 'replace' and 'merge' actions save the running config as startup config, see
+                 pyocnos.ocnos.OCNOS
+        retries: (int) Maximum number of attempts of each operation on a device failing for a transient reason
+        retry_deadline: (float) Seconds after which no operation is tried again, unlimited if None
+        keys: (dict) Keys of lists to diff configs by, see pyocnos.keys.load_keys. The keys known to pyocnos if None
+
+    Returns: (List) of Strings showing user what actions were taken
+
+    """
+    config = load_user_details(config_file_path)
+    username = config['config']['username']
+    password = config['config']['password']
+    timeout = config['config']['timeout']
+
+    setup_logging(verbose)
+
+    metrics = Metrics()
+    retry = retry_policies(retries, deadline=retry_deadline)
+    try:
+        sites, site_limits = parse_sites(config)
+        limiter = ConcurrencyLimiter(workers, min_limit=1 if max_workers else workers, max_limit=max_workers,
+                                     sites=sites, site_limits=site_limits)
+        if 'audit' in actions:
+            results = audit(hostname.split(','), load_template(candidate_file_path), username, password, timeout,
+                            workers=workers, keys=keys, metrics=metrics, retry=retry, limiter=limiter)
+            return list(render_report(results))
+        if 'backup' in actions:
+            archive_path = save_config_file_path or DEFAULT_ARCHIVE_PATH
+            entries = backup(hostname.split(','), archive_path, username, password, timeout, workers=workers,
+                             metrics=metrics, retry=retry, limiter=limiter)
+            return list(render_backup_report(entries, archive_path))
+        return run_actions(hostname, username, password, timeout, actions,
+                           save_config_file_path=save_config_file_path, candidate_file_path=candidate_file_path,
+                           metrics=metrics, persist=persist, retry=retry, agent_socket_path=agent_socket_path,
+                           keys=keys)
+    except OCNOSError as exception:
+        metrics.record_exception(hostname, exception)
+        raise
+    finally:
+        if metrics_file_path:
+            metrics.write_textfile(metrics_file_path)
+
+
+def run_actions(hostname, username, password, timeout, actions, *, save_config_file_path, candidate_file_path, metrics,
+                persist=PERSIST_IMMEDIATE, retry=None, agent_socket_path=None, keys=None):
+    """
+    Connect to the device and run the actions in order, timing each of them.
+    Commits saved deferred are saved when the connection is closed. With an
+    agent, the actions run in its session of the device, with the persist,
+    retry and keys the agent was started with.
+    See process() for the arguments.
+
+    Returns: (List) of Strings showing user what actions were taken
+    """
+    with ExitStack() as stack:
+        if agent_socket_path is not None:
+            device = AgentDevice(hostname, agent_socket_path)
+        else:
+            with metrics.time(CONNECT, hostname):
+                device = stack.enter_context(
+                    OCNOS(hostname=hostname, username=username, password=password, timeout=timeout, persist=persist,
+                          retry=retry, metrics=metrics, keys=keys)
+                )
         output = []
         for action in actions:
             if action == 'connection':
@@ -56,22 +201,425 @@ def process(config_file_path, hostname, actions, save_config_file_path, candidat
 
             elif action in ['running', 'startup']:
                 save_config_file_path = save_config_file_path or '{}-{}.xml'.format(hostname, action)
+                config_xml = fetch_config(device, hostname, action, metrics)
                 with io.open(save_config_file_path, 'w', encoding='utf-8') as xml_file:
-                    xml_file.write(device.get_config(action)[action])
+                    xml_file.write(config_xml)
                 output.append('Devices {} config xml stored in {}'.format(action.capitalize(), save_config_file_path))
 
             else:
                 device.load_candidate_config(filename=candidate_file_path)
                 if action == 'diff':
-                    output.append(device.compare_config())
+                    # Retrieved first, so the diff is timed without the time on the network and the device
+                    running_xml = fetch_config(device, hostname, 'running', metrics)
+                    with metrics.time(DIFF, hostname):
+                        output.append(device.compare_config(running=running_xml))
                 else:
-                    device.commit_config(
-                        replace_config=bool(action == 'replace')
-                    )
+                    with metrics.time(COMMIT, hostname):
+                        device.commit_config(
+                            replace_config=bool(action == 'replace')
+                        )
                     output.append('Config %sd to device' % action)
         return output
 
 
+def fetch_config(device, hostname, source, metrics):
+    """
+    Retrieve a config of a device, timed and measured in the metrics.
+    Args:
+        device: pyocnos.ocnos.OCNOS or pyocnos.agent.AgentDevice
+        hostname: (String) hostname of the device
+        source: (String) 'running' or 'startup'
+        metrics: pyocnos.metrics.Metrics
+
+    Returns: (String) the config xml
+    """
+    with metrics.time(FETCH, hostname):
+        config_xml = device.get_config(source)[source]
+    metrics.config_bytes.set(len(config_xml.encode('utf-8')), host=hostname, source=source)
+    return config_xml
+
+
+def parse_xml_file(path):
+    """
+    Parse an xml file as a stream, keeping its root tag, see pyocnos.parsing.parse_xml.
+
+    Returns: lxml.etree.Element, the root
+    """
+    with open(path, 'rb') as xml_file:
+        return parsing.parse_xml(xml_file)
+
+
+def diff_file_pair(paths, workers=None, output_format='text', stats=None, keys=None):
+    """
+    Diff two xml files the same way pyocnos.diff.build_xml_diff diffs their
+    contents, root tags included.
+    Args:
+        paths: (Tuple) of the left and the right file path
+        workers: (int) Number of processes to diff the top level containers in
+        output_format: (String) Output format, see pyocnos.render.RENDERERS
+        stats: pyocnos.diffstats.DiffStats to count the work of the diff in
+        keys: (dict) Keys of lists to diff by, see pyocnos.keys.load_keys
+
+    Returns: (Iterator) of Strings with the lines of the diff, empty if there are no differences
+    Raises: ValueError if the root tags of the files are different
+    """
+    # pylint: disable=too-many-arguments
+    left, right = (parse_xml_file(path) for path in paths)
+    return iter_xml_diff(left, right, keys=keys, workers=workers, output_format=output_format, labels=paths,
+                         stats=stats)
+
+
+def diff_file_pair_lines(paths, output_format='text', keys=None):
+    """
+    Diff two xml files in a worker process, see diff_file_pair().
+
+    Returns: (List) of Strings with the lines of the diff
+    """
+    return list(diff_file_pair(paths, output_format=output_format, keys=keys))
+
+
+def find_file_pairs(left_path, right_path):
+    """
+    Pair the xml files of the same name in two directories.
+    Args:
+        left_path: (String) Path to the left directory
+        right_path: (String) Path to the right directory
+
+    Returns: (Tuple) of
+        (List) of tuples of the left and the right file path, sorted by name
+        (List) of tuples of the directory and the name of files found in one directory only
+    """
+    names_left, names_right = (
+        {name for name in os.listdir(path) if name.endswith('.xml') and os.path.isfile(os.path.join(path, name))}
+        for path in (left_path, right_path)
+    )
+    pairs = [(os.path.join(left_path, name), os.path.join(right_path, name))
+             for name in sorted(names_left & names_right)]
+    unpaired = [(path, name)
+                for path, names in ((left_path, names_left - names_right), (right_path, names_right - names_left))
+                for name in sorted(names)]
+    return pairs, unpaired
+
+
+def process_diff_files(left_path, right_path, jobs=1, *, output_format='text', stats=None, keys=None):
+    """
+    Diff local xml files without connecting to any device, either two files
+    or all files of the same name in two directories. The lines are yielded
+    as soon as they are rendered, so a diff of any size can be piped.
+    Args:
+        left_path: (String) Path to the left file or directory, e.g. with saved running configs
+        right_path: (String) Path to the right file or directory, e.g. with candidate configs
+        jobs: (int) Number of processes to diff in, file pairs of directories are spread over them,
+              otherwise the top level containers of the two files
+        output_format: (String) Output format, see pyocnos.render.RENDERERS. The headers of the
+                       file pairs of directories are JSON objects as well in the jsonl format.
+        stats: pyocnos.diffstats.DiffStats to count the work of the diffs in, of the diffs in this
+               process only
+        keys: (dict) Keys of lists to diff by, see pyocnos.keys.load_keys. The keys known to pyocnos if None
+
+    Returns: (Generator) of Strings with the lines of the diffs
+    """
+    # pylint: disable=too-many-arguments
+    if not os.path.isdir(left_path):
+        yield from diff_file_pair((left_path, right_path), workers=jobs, output_format=output_format, stats=stats,
+                                  keys=keys)
+        return
+
+    jsonl = output_format == 'jsonl'
+    pairs, unpaired = find_file_pairs(left_path, right_path)
+    for path, name in unpaired:
+        yield json.dumps({'only_in': path, 'name': name}) if jsonl else 'Only in {}: {}'.format(path, name)
+
+    with ExitStack() as stack:
+        if jobs > 1 and len(pairs) > 1:
+            # Imported here, as multiprocessing takes longer to import than this module without it
+            from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+            executor = stack.enter_context(ProcessPoolExecutor(
+                max_workers=jobs, initializer=parsing.enable_huge_tree, initargs=(parsing.HUGE_TREE,)
+            ))
+            diffs = executor.map(functools.partial(diff_file_pair_lines, output_format=output_format, keys=keys),
+                                 pairs)
+        else:
+            diffs = (diff_file_pair(pair, output_format=output_format, stats=stats, keys=keys) for pair in pairs)
+
+        for (path_left, path_right), lines in zip(pairs, diffs):
+            lines = iter(lines)
+            first_line = next(lines, None)
+            if first_line is None:
+                continue
+            yield json.dumps({'left': path_left, 'right': path_right}) if jsonl \
+                else 'diff {} {}'.format(path_left, path_right)
+            yield first_line
+            yield from lines
+
+
+def parse_and_get_diff_files_args(argv):
+    """
+    Create arg parser of the diff-files command.
+    Args:
+        argv: (List) of Strings of the arguments after the command name
+
+    Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog='pyocnos {}'.format(DIFF_FILES_COMMAND),
+        description='Diff local config files without connecting to a device.',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument(
+        'left_path',
+        help='Left config file, e.g. a saved running config, or a directory of them'
+    )
+
+    parser.add_argument(
+        'right_path',
+        help=textwrap.dedent("""
+        Right config file, e.g. a candidate config, or a directory of them.
+        Files of the same name are diffed if both paths are directories.
+        """)
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        dest='jobs',
+        type=int,
+        default=1,
+        help=textwrap.dedent("""
+        Number of processes to diff in. File pairs of directories are spread
+        over them, otherwise the top level containers of the two files.
+        """)
+    )
+
+    parser.add_argument(
+        '--stats',
+        dest='stats',
+        action='store_true',
+        help=textwrap.dedent("""
+        Print statistics of the work of the diffs to stderr, e.g. the tags
+        whose lists are matched by similarity as they have no keys. Diffs of
+        directories spread over processes with -j are not counted.
+        """)
+    )
+
+    parser.add_argument(
+        '-f',
+        '--format',
+        dest='output_format',
+        choices=sorted(RENDERERS),
+        default='text',
+        help=textwrap.dedent("""
+        Output format of the diff: text as the 'diff' action shows,
+        jsonl with one JSON object per changed element, or unified
+        with a hunk per parent of changed elements. Default: text
+        """)
+    )
+
+    parser.add_argument(
+        '-k',
+        '--keys-file',
+        dest='keys_file_path',
+        help=textwrap.dedent("""
+        YAML or JSON file with the keys of lists to pair list entries by,
+        tried before the keys known to pyocnos, see pyocnos.keys.
+        """)
+    )
+
+    parser.add_argument(
+        '--platform',
+        dest='platform',
+        help='Platform of the switches, e.g. AS7712-32X, to select the keys of the --keys-file.'
+    )
+
+    parser.add_argument(
+        '--ocnos-version',
+        dest='ocnos_version',
+        help='OcNOS version of the switches, e.g. 6.4.1, to select the keys of the --keys-file.'
+    )
+
+    parser.add_argument(
+        '--huge-tree',
+        dest='huge_tree',
+        action='store_true',
+        help=textwrap.dedent("""
+        Parse configs beyond the security limits of libxml2, e.g. text
+        longer than 10 MB or elements nested deeper than 256 levels.
+        """)
+    )
+
+    parser.add_argument(
+        '--trace-file',
+        dest='trace_file_path',
+        help=textwrap.dedent("""
+        File path to append spans of this run to, one JSON object per line,
+        with the durations of connecting, retrieving, committing and each
+        stage of the diffs. Nothing is traced by default.
+        """)
+    )
+
+    args = parser.parse_args(argv)
+    if os.path.isdir(args.left_path) != os.path.isdir(args.right_path):
+        parser.error('left_path and right_path must be both files or both directories.')
+    if args.jobs < 1:
+        parser.error('-j, --jobs must be at least 1.')
+    return args
+
+
+def run_agent(config_file_path, *, socket_path=DEFAULT_SOCKET_PATH, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+              persist=PERSIST_IMMEDIATE, retries=1, retry_deadline=None, verbose=0, keys=None):
+    """
+    Serve device actions on a Unix domain socket until interrupted, keeping
+    the device sessions open, see pyocnos.agent.
+    Args:
+        config_file_path: (String) Path to the yaml file with username, password and timeout
+        socket_path: (String) Path of the socket to listen on
+        idle_timeout: (float) Seconds after which an unused session is closed
+        persist: (String) When commits save the running config as startup config, see pyocnos.ocnos.OCNOS
+        retries: (int) Maximum number of attempts of each operation, see process()
+        retry_deadline: (float) Seconds after which no operation is tried again, unlimited if None
+        verbose: (int) verbosity, see setup_logging()
+        keys: (dict) Keys of lists to diff configs by, see pyocnos.keys.load_keys. The keys known to pyocnos if None
+    """
+    # pylint: disable=too-many-arguments
+    config = load_user_details(config_file_path)
+    setup_logging(verbose)
+    retry = retry_policies(retries, deadline=retry_deadline)
+
+    def create_device(hostname):
+        return OCNOS(hostname=hostname, username=config['config']['username'],
+                     password=config['config']['password'], timeout=config['config']['timeout'],
+                     persist=persist, retry=retry, keys=keys)
+
+    server = AgentServer(socket_path, SessionPool(create_device, idle_timeout=idle_timeout))
+    logging.getLogger(LOGGER_NAME).info('Agent listening on %s', socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def parse_and_get_agent_args(argv):
+    """
+    Create arg parser of the agent command.
+    Args:
+        argv: (List) of Strings of the arguments after the command name
+
+    Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog='pyocnos {}'.format(AGENT_COMMAND),
+        description=textwrap.dedent("""
+        Keep device sessions open and run the actions of 'pyocnos --agent'
+        in them, so they do not connect to the device every time.
+        """),
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+
+    parser.add_argument(
+        'config_file_path',
+        help='Config file with user details like username and password'
+    )
+
+    parser.add_argument(
+        '-s',
+        '--socket',
+        dest='socket_path',
+        default=DEFAULT_SOCKET_PATH,
+        help='Unix domain socket to listen on. Default: {}'.format(DEFAULT_SOCKET_PATH)
+    )
+
+    parser.add_argument(
+        '--idle-timeout',
+        dest='idle_timeout',
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help='Seconds after which an unused device session is closed. Default: {}'.format(DEFAULT_IDLE_TIMEOUT)
+    )
+
+    parser.add_argument(
+        '-p',
+        '--persist',
+        dest='persist',
+        choices=PERSIST_MODES,
+        default=PERSIST_IMMEDIATE,
+        help=textwrap.dedent("""
+        When commits save the running config as startup config:
+        'immediate' after each of them, 'deferred' when the session is
+        closed or 'never'. Default: immediate
+        """)
+    )
+
+    parser.add_argument(
+        '--retries',
+        dest='retries',
+        type=int,
+        default=1,
+        help='Maximum number of attempts of operations failing for a transient reason. Default: 1, no retries'
+    )
+
+    parser.add_argument(
+        '--retry-deadline',
+        dest='retry_deadline',
+        type=float,
+        help='Seconds after which a failing operation is not tried again. Unlimited by default.'
+    )
+
+    parser.add_argument(
+        '-k',
+        '--keys-file',
+        dest='keys_file_path',
+        help=textwrap.dedent("""
+        YAML or JSON file with the keys of lists to pair list entries by,
+        tried before the keys known to pyocnos, see pyocnos.keys.
+        """)
+    )
+
+    parser.add_argument(
+        '--platform',
+        dest='platform',
+        help='Platform of the switches, e.g. AS7712-32X, to select the keys of the --keys-file.'
+    )
+
+    parser.add_argument(
+        '--ocnos-version',
+        dest='ocnos_version',
+        help='OcNOS version of the switches, e.g. 6.4.1, to select the keys of the --keys-file.'
+    )
+
+    parser.add_argument(
+        '-v',
+        '--verbosity',
+        action='count',
+        default=0,
+        help='Set logging verbose level, see pyocnos -h.'
+    )
+
+    parser.add_argument(
+        '--huge-tree',
+        dest='huge_tree',
+        action='store_true',
+        help=textwrap.dedent("""
+        Parse configs beyond the security limits of libxml2, e.g. text
+        longer than 10 MB or elements nested deeper than 256 levels.
+        """)
+    )
+
+    parser.add_argument(
+        '--trace-file',
+        dest='trace_file_path',
+        help=textwrap.dedent("""
+        File path to append spans of this run to, one JSON object per line,
+        with the durations of connecting, retrieving, committing and each
+        stage of the diffs. Nothing is traced by default.
+        """)
+    )
+
+    return parser.parse_args(argv)
+
+
 def parse_and_get_args():
     """
     Create arg parser.
@@ -80,6 +628,10 @@ def parse_and_get_args():
     """
     parser = argparse.ArgumentParser(
         description='Diff and Replace/Merge configs.',
+        epilog=textwrap.dedent("""
+        Run 'pyocnos {} -h' to diff local config files without a device.
+        Run 'pyocnos {} -h' to keep device sessions open for --agent.
+        """).format(DIFF_FILES_COMMAND, AGENT_COMMAND),
         formatter_class=argparse.RawTextHelpFormatter
     )
 
@@ -102,7 +654,9 @@ def parse_and_get_args():
             'merge',
             'running',
             'connection',
-            'startup'
+            'startup',
+            'audit',
+            'backup'
         ],
         help=textwrap.dedent("""
         Please choose one or multiple actions from below
@@ -112,6 +666,9 @@ def parse_and_get_args():
         'running' Get running config from switch and save it to a file.
         'connection' Make a connection to device.
         'startup' Get startup config from switch and save it to a file.
+        'audit' Compare Running config of all given switches with Candidate config.
+        'backup' Store Running config of all given switches in one archive.
+        For audit and backup, hostnames are separated by commas, e.g. switch1,switch2.
         """)
     )
 
@@ -124,7 +681,9 @@ def parse_and_get_args():
         If no path is given than file will be saved in current dir
         with hostname-action.xml. For example for running config with
         hostname foo.bar foo.bar-running.xml will be created.
-        """)
+        For the backup action, the archive ending with .tar.gz, .tgz,
+        .tar.zst or .tar. Default: {}
+        """).format(DEFAULT_ARCHIVE_PATH)
     )
 
     parser.add_argument(
@@ -147,26 +706,201 @@ def parse_and_get_args():
         """)
     )
 
+    parser.add_argument(
+        '-m',
+        '--metrics-file-path',
+        dest='metrics_file_path',
+        help=textwrap.dedent("""
+        File path to write Prometheus metrics of this run in, e.g. into the
+        directory of the node exporter textfile collector. The file is written
+        even if an action fails. No metrics are written by default.
+        """)
+    )
+
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest='workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help='Number of switches the audit and backup actions retrieve configs from concurrently.'
+    )
+
+    parser.add_argument(
+        '--max-workers',
+        dest='max_workers',
+        type=int,
+        help=textwrap.dedent("""
+        Let the audit and backup actions adapt the number of switches retrieved
+        concurrently, starting from --workers, up to this number as long as
+        connecting and retrieving stay fast and do not fail. Sites of
+        switches with limits of their own are read from the sites section
+        of the config file. Fixed at --workers by default.
+        """)
+    )
+
+    parser.add_argument(
+        '-p',
+        '--persist',
+        dest='persist',
+        choices=PERSIST_MODES,
+        default=PERSIST_IMMEDIATE,
+        help=textwrap.dedent("""
+        When the replace and merge actions save the running config as
+        startup config: 'immediate' after each of them, 'deferred' once
+        after all actions or 'never'. Default: immediate
+        """)
+    )
+
+    parser.add_argument(
+        '--retries',
+        dest='retries',
+        type=int,
+        default=1,
+        help=textwrap.dedent("""
+        Maximum number of attempts of connecting, retrieving, committing and
+        saving configs failing for a transient reason, e.g. a lost SSH
+        session or a locked candidate datastore. Default: 1, no retries
+        """)
+    )
+
+    parser.add_argument(
+        '--retry-deadline',
+        dest='retry_deadline',
+        type=float,
+        help='Seconds after which a failing operation is not tried again. Unlimited by default.'
+    )
+
+    parser.add_argument(
+        '-k',
+        '--keys-file',
+        dest='keys_file_path',
+        help=textwrap.dedent("""
+        YAML or JSON file with the keys of lists to pair list entries by,
+        tried before the keys known to pyocnos, see pyocnos.keys.
+        """)
+    )
+
+    parser.add_argument(
+        '--platform',
+        dest='platform',
+        help='Platform of the switches, e.g. AS7712-32X, to select the keys of the --keys-file.'
+    )
+
+    parser.add_argument(
+        '--ocnos-version',
+        dest='ocnos_version',
+        help='OcNOS version of the switches, e.g. 6.4.1, to select the keys of the --keys-file.'
+    )
+
+    parser.add_argument(
+        '--agent',
+        dest='agent_socket_path',
+        nargs='?',
+        const=DEFAULT_SOCKET_PATH,
+        help=textwrap.dedent("""
+        Run the actions in the session of the agent started by
+        'pyocnos {}', listening on this socket, with its --persist,
+        --retries, --retry-deadline and --keys-file. Default socket:
+        {}
+        """).format(AGENT_COMMAND, DEFAULT_SOCKET_PATH)
+    )
+
+    parser.add_argument(
+        '--huge-tree',
+        dest='huge_tree',
+        action='store_true',
+        help=textwrap.dedent("""
+        Parse configs beyond the security limits of libxml2, e.g. text
+        longer than 10 MB or elements nested deeper than 256 levels.
+        """)
+    )
+
+    parser.add_argument(
+        '--trace-file',
+        dest='trace_file_path',
+        help=textwrap.dedent("""
+        File path to append spans of this run to, one JSON object per line,
+        with the durations of connecting, retrieving, committing and each
+        stage of the diffs. Nothing is traced by default.
+        """)
+    )
+
     args = parser.parse_args()
-    if any(action in args.actions for action in ['diff', 'replace', 'merge']) and not args.candidate_file_path:
-        parser.error("diff, replace and merge actions requires -c, --candidate-file-path.")
+    if any(action in args.actions for action in ['diff', 'replace', 'merge', 'audit']) and not args.candidate_file_path:
+        parser.error("diff, replace, merge and audit actions requires -c, --candidate-file-path.")
+    for action in FLEET_ACTIONS:
+        if action in args.actions and len(args.actions) > 1:
+            parser.error("{} action can't be combined with other actions.".format(action))
+    if args.max_workers is not None and args.max_workers < args.workers:
+        parser.error("--max-workers can't be lower than -w, --workers.")
+    if any(action in FLEET_ACTIONS for action in args.actions) and args.agent_socket_path:
+        parser.error("audit and backup actions can't be run in the agent.")
+    if args.agent_socket_path and (args.persist != PERSIST_IMMEDIATE or args.retries != 1
+                                   or args.retry_deadline is not None or args.keys_file_path):
+        parser.error("--persist, --retries, --retry-deadline and -k, --keys-file are given to "
+                     "'pyocnos {}', not with --agent.".format(AGENT_COMMAND))
     return args
 
 
+def load_keys_args(args):
+    """
+    Read the keys file given on the command line.
+    Args:
+        args: argparse.Namespace with keys_file_path, platform and ocnos_version
+
+    Returns: (dict) of the keys, see pyocnos.keys.load_keys, or None if no keys file is given
+    """
+    if not args.keys_file_path:
+        return None
+    return load_keys(args.keys_file_path, platform=args.platform, version=args.ocnos_version)
+
+
 def main():
     """
     Main function called from command line
     Returns: None
 
     """
+    if sys.argv[1:2] == [DIFF_FILES_COMMAND]:
+        args = parse_and_get_diff_files_args(sys.argv[2:])
+        parsing.enable_huge_tree(args.huge_tree)
+        stats = DiffStats() if args.stats else None
+        with trace_to_file(args.trace_file_path):
+            for line in process_diff_files(args.left_path, args.right_path, jobs=args.jobs,
+                                           output_format=args.output_format, stats=stats, keys=load_keys_args(args)):
+                print(line)
+        if stats is not None:
+            for line in stats.report():
+                print(line, file=sys.stderr)
+        return
+    if sys.argv[1:2] == [AGENT_COMMAND]:
+        args = parse_and_get_agent_args(sys.argv[2:])
+        parsing.enable_huge_tree(args.huge_tree)
+        with trace_to_file(args.trace_file_path):
+            run_agent(args.config_file_path, socket_path=args.socket_path, idle_timeout=args.idle_timeout,
+                      persist=args.persist, retries=args.retries, retry_deadline=args.retry_deadline,
+                      verbose=args.verbosity, keys=load_keys_args(args))
+        return
+
     args = parse_and_get_args()
-    output = process(
-        config_file_path=args.config_file_path,
-        hostname=args.hostname,
-        actions=args.actions,
-        save_config_file_path=args.save_config_file_path,
-        candidate_file_path=args.candidate_file_path,
-        verbose=args.verbosity
-    )
-    for line in output:
-        print(line)
+    parsing.enable_huge_tree(args.huge_tree)
+    with trace_to_file(args.trace_file_path):
+        output = process(
+            config_file_path=args.config_file_path,
+            hostname=args.hostname,
+            actions=args.actions,
+            save_config_file_path=args.save_config_file_path,
+            candidate_file_path=args.candidate_file_path,
+            verbose=args.verbosity,
+            metrics_file_path=args.metrics_file_path,
+            workers=args.workers,
+            persist=args.persist,
+            retries=args.retries,
+            retry_deadline=args.retry_deadline,
+            max_workers=args.max_workers,
+            agent_socket_path=args.agent_socket_path,
+            keys=load_keys_args(args)
+        )
+        for line in output:
+            print(line)
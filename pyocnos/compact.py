@@ -0,0 +1,299 @@
+"""
+This module defines a compact representation of xml trees for the diff
+engine. Instead of lxml elements every node is an integer index into flat
+arrays holding an interned tag id, an interned text id, a hash of the subtree
+and the range of indexes of its children. Nodes are numbered in breadth first
+order, so the children of a node are contiguous.
+
+Usage:
+ > from lxml import etree
+ > from pyocnos.compact import CompactTree
+ > tree = CompactTree([etree.XML('<data><foo>1</foo><bar>2</bar></data>')])
+ > list(tree.children(0))
+ [1, 2]
+ > tree.tag(2)
+ 'bar'
+
+Two trees to compare must share one Symbols table, so that their ids are
+comparable. Hashes do not depend on the ids, thus they are comparable between
+any trees.
+"""
+from array import array
+from collections import deque
+import hashlib
+import sys
+
+from lxml import etree
+
+# Text id of elements without text.
+NO_TEXT = -1
+
+# Pseudo tags of nodes which are not elements. They can't clash with a tag of
+# an element as '#' is not allowed in a xml name.
+COMMENT_TAG = '#comment'
+PI_TAG = '#pi'
+
+HASH_SIZE = 8
+
+
+class Symbols:
+    """ Table interning strings, i.e. tags and texts, to integer ids """
+
+    __slots__ = ('ids', 'names')
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """
+        Get the id of a string, adding the string to the table if new.
+
+        Args:
+            name: String
+
+        Returns: int
+        """
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return symbol
+
+    def copy(self):
+        """
+        Copy the table, so more strings can be interned without changing this
+        one, whilst all ids of this table remain valid in the copy.
+
+        Returns: Symbols
+        """
+        result = Symbols()
+        result.ids = dict(self.ids)
+        result.names = list(self.names)
+        return result
+
+    def extends(self, other):
+        """
+        Whether this table has all strings of another one with the same ids,
+        e.g. as a copy of it, see copy().
+
+        Args:
+            other: Symbols
+
+        Returns: bool
+        """
+        names = other.names
+        return self is other or self.names[:len(names)] == names
+
+
+def own_content(elem):
+    """
+    Content of an element itself, i.e. tag, attributes and text, regardless of
+    its children. Texts are compared without surrounding white spaces, the same
+    as the similarity of elements.
+
+    Returns: tuple (tag, text, bytes)
+    """
+    tag = elem.tag
+    if isinstance(tag, str):
+        attributes = elem.items()
+        if attributes:
+            tag_content = tag + ''.join('\0{}={}'.format(name, value) for name, value in sorted(attributes))
+        else:
+            tag_content = tag
+    else:
+        tag = tag_content = COMMENT_TAG if tag is etree.Comment else PI_TAG
+    text = elem.text
+    if text is not None:
+        text = text.strip()
+        return tag, text, (tag_content + '\0' + text).encode()
+    return tag, text, (tag_content + '\1').encode()
+
+
+class CompactTree:
+    """
+    Flat array representation of one or more xml trees. The roots are the
+    first nodes, i.e. for a single tree its root element is node 0.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = ('roots', 'symbols', 'tags', 'texts', 'hashes', 'child_start', 'child_end', 'parents')
+
+    def __init__(self, roots, symbols=None):
+        """
+        Build the arrays in one pass over the given trees.
+
+        Args:
+            roots: list of lxml.etree.Element
+            symbols: Symbols shared with the trees to compare with
+        """
+        # pylint: disable=too-many-locals
+        self.roots = list(roots)
+        self.symbols = Symbols() if symbols is None else symbols
+        self.tags = array('i')
+        self.texts = array('i')
+        self.hashes = array('q')
+        self.child_start = array('i')
+        self.child_end = array('i')
+        self.parents = array('i', [-1] * len(self.roots))
+
+        intern = self.symbols.intern
+        contents = []
+        queue = deque(self.roots)
+        count = len(self.roots)
+        node = 0
+        while queue:
+            elem = queue.popleft()
+            tag, text, content = own_content(elem)
+            self.tags.append(intern(tag))
+            self.texts.append(NO_TEXT if text is None else intern(text))
+            contents.append(content)
+            self.child_start.append(count)
+            children = len(elem)
+            if children:
+                queue.extend(elem)
+                count += children
+                self.parents.extend([node] * children)
+            self.child_end.append(count)
+            node += 1
+
+        # Children always have larger indexes than their parent, so in the
+        # reversed order the hashes of all children are known before their
+        # parent's.
+        hashes = [b''] * count
+        for node in range(count - 1, -1, -1):
+            start = self.child_start[node]
+            end = self.child_end[node]
+            content = contents[node] + b''.join(hashes[start:end]) if start != end else contents[node]
+            hashes[node] = hashlib.blake2b(content, digest_size=HASH_SIZE).digest()
+        self.hashes.frombytes(b''.join(hashes))
+        if sys.byteorder != 'big':
+            self.hashes.byteswap()
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getstate__(self):
+        # Only the arrays are pickled, e.g. to send a tree to another process, as lxml elements can't be. The
+        # unpickled tree can't look up elements().
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'roots'}
+
+    def __setstate__(self, state):
+        self.roots = []
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def pair(cls, roots_left, roots_right):
+        """
+        Build two trees sharing one Symbols table to compare them.
+
+        Returns: tuple (CompactTree, CompactTree)
+        """
+        left = cls(roots_left)
+        return left, cls(roots_right, left.symbols)
+
+    def with_symbols(self, symbols):
+        """
+        The same tree with the ids of another Symbols table, e.g. to compare
+        it with a tree it was not built together with. Strings missing in the
+        table are interned to it. The hashes are the same.
+
+        Args:
+            symbols: Symbols
+
+        Returns: CompactTree sharing all arrays but the ids with this one
+        """
+        if symbols is self.symbols:
+            return self
+        result = CompactTree.__new__(CompactTree)
+        result.roots = self.roots
+        result.symbols = symbols
+        if symbols.extends(self.symbols):
+            # The table is a copy of this one with more strings, see Symbols.copy()
+            result.tags = self.tags
+            result.texts = self.texts
+        else:
+            mapping = [symbols.intern(name) for name in self.symbols.names]
+            result.tags = array('i', (mapping[tag] for tag in self.tags))
+            result.texts = array('i', (NO_TEXT if text == NO_TEXT else mapping[text] for text in self.texts))
+        result.hashes = self.hashes
+        result.child_start = self.child_start
+        result.child_end = self.child_end
+        result.parents = self.parents
+        return result
+
+    def children(self, node):
+        """
+        Returns: range of the indexes of the children of a node
+        """
+        return range(self.child_start[node], self.child_end[node])
+
+    def is_leaf(self, node):
+        """ Whether the node has no children """
+        return self.child_start[node] == self.child_end[node]
+
+    def tag(self, node):
+        """ Tag name of a node """
+        return self.symbols.names[self.tags[node]]
+
+    def text(self, node):
+        """ Text of a node without surrounding white spaces or None """
+        text = self.texts[node]
+        return None if text == NO_TEXT else self.symbols.names[text]
+
+    def position(self, node):
+        """ Index of a node among its siblings """
+        parent = self.parents[node]
+        return node if parent == -1 else node - self.child_start[parent]
+
+    def elements(self, nodes):
+        """
+        Look up the lxml elements of the given nodes. The trees are traversed
+        in the same order as built, so all nodes are found in one pass.
+
+        Args:
+            nodes: iterable of int
+
+        Returns: a dictionary like this {int: lxml.etree.Element}
+        """
+        wanted = set(nodes)
+        result = {}
+        if not wanted:
+            return result
+        last = max(wanted)
+        queue = deque(self.roots)
+        node = 0
+        while node <= last:
+            elem = queue.popleft()
+            if node in wanted:
+                result[node] = elem
+            if self.child_start[node] <= last:
+                queue.extend(elem)
+            node += 1
+        return result
+
+
+def common_symbols(left, right):
+    """
+    Two trees with the ids of one Symbols table, to compare them. If one table
+    extends the other, e.g. as its copy, see Symbols.copy(), both trees get
+    that one. Otherwise the strings are interned to a copy of the left table.
+    The tables of the given trees are never changed, so trees can be compared
+    with many others, even at the same time.
+
+    Args:
+        left: CompactTree
+        right: CompactTree
+
+    Returns: tuple of the left and the right CompactTree
+    """
+    if right.symbols.extends(left.symbols):
+        return left.with_symbols(right.symbols), right
+    if left.symbols.extends(right.symbols):
+        return left, right.with_symbols(left.symbols)
+    symbols = left.symbols.copy()
+    return left.with_symbols(symbols), right.with_symbols(symbols)
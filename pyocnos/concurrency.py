@@ -0,0 +1,231 @@
+"""
+This module limits the number of device sessions a fleet run holds at once,
+adjusting the limit to what the devices, the management network and the
+authentication servers can take.
+
+The limit grows additively while the sessions go well and shrinks
+multiplicatively when they do not (AIMD): it grows by about one after as many
+good operations as the limit, and is cut by a factor when an operation fails or
+takes much longer than the fastest one of its kind so far. Operations of a
+size, e.g. retrieving configs, are also given as long as the fastest one per
+byte would take for their size, so the devices with the largest configs are
+not taken as slow. It is cut at most once per window of operations, so a burst
+of failures of the sessions open at the same time cuts it once only. Sites,
+e.g. behind the same slow link, can have a fixed limit of their own on top.
+
+Usage:
+ > from pyocnos.concurrency import ConcurrencyLimiter
+ > limiter = ConcurrencyLimiter(initial_limit=8, max_limit=64, sites={'switch1': 'fra1'}, site_limits={'fra1': 2})
+ > with limiter.slot('switch1'):
+ >     with limiter.time('connect'):
+ >         device.open()
+ >     with limiter.time('fetch') as operation:
+ >         operation['size'] = len(device.get_config('running')['running'])
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from pyocnos import LOGGER_NAME
+
+# Factor the limit is cut by after a failed or slow operation
+DEFAULT_BACKOFF = 0.5
+
+# How many times as long as the fastest operation of its kind an operation
+# may take before it counts as slow
+DEFAULT_LATENCY_TOLERANCE = 2.0
+
+
+class ConcurrencyLimiter:
+    """
+    Limit of concurrent device sessions, adjusted from the latencies and
+    failures of their operations.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, initial_limit, *, min_limit=1, max_limit=None, backoff=DEFAULT_BACKOFF,
+                 latency_tolerance=DEFAULT_LATENCY_TOLERANCE, sites=None, site_limits=None):
+        """
+        Args:
+            initial_limit: (int) Number of sessions allowed at first
+            min_limit: (int) Lowest number of sessions the limit is cut to
+            max_limit: (int) Highest number of sessions the limit grows to, the initial limit if None
+            backoff: (float) Factor the limit is cut by, between 0 and 1
+            latency_tolerance: (float) How many times as long as the fastest operation of its kind an operation
+                               may take, None to adjust to failures only
+            sites: mapping of hostnames to their site
+            site_limits: mapping of sites to their fixed number of sessions, at least 1
+        """
+        # pylint: disable=too-many-arguments
+        max_limit = initial_limit if max_limit is None else max_limit
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError('The limits must be 1 <= min_limit <= initial_limit <= max_limit.')
+        if not 0 < backoff < 1:
+            raise ValueError('The backoff must be between 0 and 1.')
+        if any(site_limit < 1 for site_limit in (site_limits or {}).values()):
+            raise ValueError('The limits of sites must be at least 1.')
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.sites = sites or {}
+        self.site_limits = site_limits or {}
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self.site_in_flight = {}
+        # Fastest latency, and fastest latency per byte of the operations of
+        # a size, by operation
+        self.baselines = {}
+        self.rates = {}
+        self.observed = 0
+        # Number of operations observed when the limit was cut last, and the
+        # limit before, i.e. how many sessions may still fail from before the cut
+        self.cut_at = None
+        self.cut_window = 0
+        self.condition = threading.Condition()
+        self.log = logging.getLogger(LOGGER_NAME)
+
+    def acquire(self, hostname):
+        """
+        Wait until the limit and the limit of the site of the device allow
+        another session.
+
+        Args:
+            hostname: (String) hostname of the device
+        """
+        site = self.sites.get(hostname)
+        site_limit = self.site_limits.get(site)
+        with self.condition:
+            while self.in_flight >= int(self.limit) or (
+                    site_limit is not None and self.site_in_flight.get(site, 0) >= site_limit):
+                self.condition.wait()
+            self.in_flight += 1
+            if site is not None:
+                self.site_in_flight[site] = self.site_in_flight.get(site, 0) + 1
+
+    def release(self, hostname):
+        """
+        End a session started by acquire().
+
+        Args:
+            hostname: (String) hostname of the device
+        """
+        site = self.sites.get(hostname)
+        with self.condition:
+            self.in_flight -= 1
+            if site is not None:
+                self.site_in_flight[site] -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, hostname):
+        """
+        Context manager holding a session for a device.
+
+        Args:
+            hostname: (String) hostname of the device
+        """
+        self.acquire(hostname)
+        try:
+            yield
+        finally:
+            self.release(hostname)
+
+    def observe(self, operation, latency, failed=False, size=None):
+        """
+        Adjust the limit to an operation: grow it after a good one, cut it
+        after a failed or slow one.
+
+        Args:
+            operation: (String) kind of operation, e.g. pyocnos.metrics.CONNECT
+            latency: (float) duration of the operation in seconds
+            failed: (bool) whether the operation failed
+            size: (int) size of the operation in bytes, e.g. of the config retrieved, if it takes longer the larger
+                  it is
+        """
+        with self.condition:
+            self.observed += 1
+            slow = False
+            if not failed:
+                expected = self.expected_latency(operation, latency, size)
+                slow = self.latency_tolerance is not None and latency > expected * self.latency_tolerance
+            if failed or slow:
+                # Operations started before the last cut do not cut it again
+                if self.cut_at is None or self.observed - self.cut_at > self.cut_window:
+                    self.cut_at = self.observed
+                    self.cut_window = self.limit
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self.log.info('Concurrency limit cut to %s after a %s %s', int(self.limit),
+                                  'failed' if failed else 'slow', operation)
+            elif self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+    def expected_latency(self, operation, latency, size=None):
+        """
+        Update the fastest latencies of an operation which went well, and
+        tell how long it may be expected to take: as long as the fastest one
+        of its kind, or as the fastest one per byte would take for its size.
+        Must be called holding the condition.
+
+        Args:
+            operation: (String) kind of operation, e.g. pyocnos.metrics.CONNECT
+            latency: (float) duration of the operation in seconds
+            size: (int) size of the operation in bytes, None if it has none
+
+        Returns: (float) expected duration of the operation in seconds
+        """
+        baseline = min(latency, self.baselines.get(operation, latency))
+        self.baselines[operation] = baseline
+        if not size:
+            return baseline
+        rate = min(latency / size, self.rates.get(operation, latency / size))
+        self.rates[operation] = rate
+        return max(baseline, rate * size)
+
+    @contextmanager
+    def time(self, operation):
+        """
+        Context manager observing the duration of an operation, which failed
+        if the body raises. It yields a dictionary the body can set the
+        'size' of the operation in, see observe().
+
+        Args:
+            operation: (String) kind of operation, e.g. pyocnos.metrics.CONNECT
+        """
+        observation = {}
+        start = time.monotonic()
+        try:
+            yield observation
+        except BaseException:
+            self.observe(operation, time.monotonic() - start, failed=True)
+            raise
+        self.observe(operation, time.monotonic() - start, size=observation.get('size'))
+
+
+def parse_sites(config):
+    """
+    Read the sites of the devices and their limits from the sites section of
+    the yaml config of the command line, e.g.
+
+    sites:
+      fra1:
+        limit: 2
+        hosts:
+          - switch1
+
+    Args:
+        config: (dict) the yaml config
+
+    Returns: tuple of the mapping of hostnames to sites and of sites to their limits
+    """
+    sites = {}
+    site_limits = {}
+    for site, site_config in (config.get('sites') or {}).items():
+        for hostname in site_config.get('hosts') or []:
+            sites[hostname] = site
+        if site_config.get('limit') is not None:
+            site_limits[site] = int(site_config['limit'])
+    return sites, site_limits
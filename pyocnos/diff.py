@@ -14,21 +14,34 @@ Usage:
  - <foo>100</foo>
  + <foo>10</foo>
 
+build_xml_diff_with_stats returns the diff with a pyocnos.diffstats.DiffStats
+of its work. The other functions take a DiffStats to add their work to, so the
+work of several diffs can be counted together.
 """
+# pylint: disable=too-many-lines
 
 from __future__ import print_function
 
-from collections import defaultdict, namedtuple
+from collections import Counter, defaultdict, namedtuple, OrderedDict
 from copy import deepcopy
 import hashlib
 import itertools
+import logging
 import os
 import re
+import time
 
 from lxml import etree
 
-from .exceptions import OCNOSCDuplicateKeyError
-from .similarity import similarity_indexes
+from . import LOGGER_NAME
+from . import tracing
+from .compact import common_symbols
+from .compact import CompactTree
+from .diffstats import DiffStats
+from .keys import ELEMENTS_WITH_FIXED_KEYS
+from .keys import KeyExtractor
+from .parsing import parse_xml
+from .similarity import NodeSimilarity
 
 # Four supported change types are declared here.
 # It indicates this module treats all sorts of xml element based changes are either an added, moved or removed.
@@ -37,30 +50,30 @@ MOVED = 'moved'
 REMOVED = 'removed'
 SAME = 'same'
 DIFF_SYMBOLS = {MOVED: '!', ADDED: '+', REMOVED: '-'}
-# mapping of xml elements to its child to use as a key in diff comparison
-# keys for list elements are defined in the schema files
-# (https://github.com/IPInfusion/OcNOS/tree/1.3.8.151/yang-files/trident2plus/DC_IPBASE)
-# or in response from 'get-schema' RPC call
-ELEMENTS_WITH_FIXED_KEYS = {
-    'interface': [('ifName',), ('name',), ('interface-name',)],
-    'accessListMac': [('aclNameMAC',)],
-    'filterList': [('sMacFM', 'vlanFM', 'packetFormatFM'), ('<sIpFC>', '<vlanFC>'), ('<accessNumFL>',)],
-    'nvoAccessIfVlanInfo': [('vlanId',)],
-    'acl-set': [('name',)],
-    'acl-entry': [('sequence-id',)],
-    'config': [('source-mac-host', 'vlan-id',
-                'ethertype',),  # for acl-entry/mac/config
-               ('vlan-identifier',)  # for tagged-access-interface/config
-               ],
-    'vxlan-tenant': [('vxlan-identifier',)],
-    'network-instance': [('network-instance',)],
-    'class-map': [('name',)],
-    'ingress-acl-set': [('acl-type',)],
-}
-
-# Data structure to pair an xml element and its hash.
+
+# Declarations of default name spaces, see normalize_tree()
+DEFAULT_NAMESPACE = re.compile(r'\sxmlns="[^"]+"')
+DEFAULT_NAMESPACE_BYTES = re.compile(DEFAULT_NAMESPACE.pattern.encode())
+
+# Data structure to pair an xml element and its hash. The diff itself works on nodes of a compact tree, see
+# pyocnos.compact.CompactTree, this is only kept as argument of rdiff().
 HashElement = namedtuple('HashElement', ['hash', 'elem'])
 
+# Default numbers of similarities and of diffs of subtrees kept by a DiffSession, see DiffSession.trim()
+MAX_CACHED_SIMILARITIES = 100000
+MAX_STORED_DIFFS = 100000
+
+# Placeholder in diff information for the diff of a pair of nodes done by a worker process, see
+# CompactDiff.parallel_rdiff().
+DeferredDiff = namedtuple('DeferredDiff', ['index'])
+
+# Reference in stored diff information to the diff of a pair of children, by their positions among the children of
+# the left and the right node, see CompactDiff.stored_rdiff().
+ChildDiff = namedtuple('ChildDiff', ['left', 'right'])
+
+# Diff of the trees of a parallel diff in a worker process, see init_worker().
+WORKER_DIFF = None
+
 
 def utf8(obj):
     """
@@ -116,55 +129,41 @@ def has_changed_children(element):
     return any(element.xpath('.//*[@change="%s"]' % type) for type in [ADDED, MOVED, REMOVED])
 
 
-def has_children(element):
+def changed_ancestors(tree_diff):
     """
-    Find out whether a xml element contains any children.
-    The lxml native approach with len is a bit confusing literaly.
+    Collect all elements in a xml diff tree which contain any changed children, in one pass over the tree. It gives
+    the same answer as has_changed_children for every element of the tree, without searching the subtree each time.
 
     Args:
-        element: lxml.etree.Element
+        tree_diff: lxml.etree.Element
 
-    Returns: boolean
+    Returns: set of lxml.etree.Element
     """
-    return bool(len(element))
+    result = set()
+    for elem in tree_diff.xpath('.//*[@change]'):
+        if elem.get('change') not in DIFF_SYMBOLS:
+            continue
+        for ancestor in elem.iterancestors():
+            if ancestor in result:
+                break
+            result.add(ancestor)
+    return result
 
 
-def ordering_intersection(hashelements_left, hashelements_right):
+def has_children(element):
     """
-    Collects elements that belongs to hashelements_a and also to hashelements_b
-    (respecting the counts of same elements in both lists). For those elemets
-    returns lists of elements on the same position and reordered elements.
+    Find out whether a xml element contains any children.
+    The lxml native approach with len is a bit confusing literaly.
 
     Args:
-        hashelements_left: [HashElement]
-        hashelements_right: [HashElement]
-
-    Returns: a dictionary like this
-             {
-                 'moved': [HashElement],
-                 'same': [HashElement]
-             }
-    """
-    tree_diff = defaultdict(list)
-    hashes_left = [hashelem.hash for hashelem in hashelements_left]
-    hashes_right = [hashelem.hash for hashelem in hashelements_right]
-
-    common_hashes = set(hashes_left) & set(hashes_right)
-    for hash_ in sorted(common_hashes):
-        left_indexes = {i for i, elem in enumerate(hashelements_left) if elem.hash == hash_}
-        right_indexes = {i for i, elem in enumerate(hashelements_right) if elem.hash == hash_}
-        same_indexes = left_indexes & right_indexes
-        potential_moved_indexes = left_indexes - right_indexes
-        tree_diff[SAME].extend(hashelements_left[i] for i in same_indexes)
-        # number of (moved elements + same elements) can't be more than
-        # number of those elements is in the right list
-        moved_count = min(len(left_indexes), len(right_indexes)) - len(same_indexes)
-        tree_diff[MOVED].extend(hashelements_left[i] for i in list(potential_moved_indexes)[:moved_count])
+        element: lxml.etree.Element
 
-    return tree_diff
+    Returns: boolean
+    """
+    return bool(len(element))
 
 
-def normalize_tree(xmlstring):
+def normalize_tree(xmlstring, huge_tree=None):
     """
     Build xml tree from string in normalised form for the sake of comparison.
     Note, it does not mean to convert to canonical xml. For example, canonical
@@ -175,32 +174,44 @@ def normalize_tree(xmlstring):
      * No name spaces
      * Element value contains no invisible characters like new line
      * Element value converted to None in case of empty string
-    """
-    # Stripe off all default name spaces.
-    xmlstring = re.sub(r'\sxmlns="[^"]+"', '', xmlstring)
-
-    # Remove pure white space string with customised xml parser
-    parser = etree.XMLParser(remove_blank_text=True)
-
-    # parsing from bytes, so it works with xml encoding declaration
-    tree = etree.XML(xmlstring.encode(), parser=parser)
-
-    # Loop over all elements and do...
-    for elem in tree.iter('*'):
-        # Single tag is not supported
-        elem.tail = None
 
-        # Any element with children should just be a container with no settings
-        if has_children(elem):
-            elem.text = None
-
-        if elem.text is not None:
-            # ensure elem.text is None if its value is nothing but
-            # invisible characters
-            elem.text = elem.text.strip() or None
-        if elem.prefix is not None:
-            # Remove name space for any element if used
-            elem.tag = etree.QName(elem).localname
+    Args:
+        xmlstring: serialised xml, or a parsed lxml.etree.Element, which is
+                   normalised in place
+        huge_tree: see pyocnos.parsing.xml_parser
+    """
+    with tracing.span('diff.normalize_tree') as span:
+        if etree.iselement(xmlstring):
+            tree = xmlstring
+        else:
+            span.set_attribute('config.bytes', len(xmlstring))
+            # Stripe off all default name spaces, cheaper than renaming the elements of the tree
+            if isinstance(xmlstring, bytes):
+                xmlstring = DEFAULT_NAMESPACE_BYTES.sub(b'', xmlstring)
+            else:
+                xmlstring = DEFAULT_NAMESPACE.sub('', xmlstring)
+            # Remove pure white space string with the parser, see pyocnos.parsing
+            tree = parse_xml(xmlstring, huge_tree)
+
+        # Loop over all elements and do...
+        for elem in tree.iter('*'):
+            # Single tag is not supported
+            elem.tail = None
+
+            # Any element with children should just be a container with no settings
+            if has_children(elem):
+                elem.text = None
+
+            if elem.text is not None:
+                # ensure elem.text is None if its value is nothing but
+                # invisible characters
+                elem.text = elem.text.strip() or None
+            tag = elem.tag
+            if tag[0] == '{':
+                # Remove name space for any element if used, e.g. prefixed
+                elem.tag = tag[tag.index('}') + 1:]
+        if span.recording:
+            span.set_attribute('config.elements', sum(1 for _ in tree.iter('*')))
 
     # Remove redundant name spaces. After this statement, all type of name
     # spaces have been removed.
@@ -222,93 +233,429 @@ def mark_ref_path(path, elems):
     return [elem.attrib.update({'ref_path': path}) or elem for elem in elems]
 
 
-def similarity_zip(hashelements_left, hashelements_right):
+class CompactDiff:
+    """
+    Diff information between two compact trees, see pyocnos.compact.CompactTree. The trees must share one symbol
+    table. Nodes are compared by their hashes, interned tags and texts, the lxml elements of the trees are only looked
+    up for the nodes in the result.
     """
-    Apart from mimic the behavior of builtin zip function, this routine allows
-    entries from the provided two iterable are provided in specific order, so
-    that the content in the generated tuple has the largest similarity, with
-    the constraint the whole similarity of the two given list of xml nodes is
-    at a max level.
+
+    __slots__ = ('left', 'right', 'keys', 'similarity', 'results', 'stats', 'extractors')
+
+    def __init__(self, left, right, keys=None, *, cache=None, results=None, stats=None):
+        """
+        Args:
+            left: CompactTree
+            right: CompactTree
+            keys: mapping of xml elements to their key elements, ELEMENTS_WITH_FIXED_KEYS if not given
+            cache: OrderedDict of similarities to share with other diffs, see pyocnos.similarity.NodeSimilarity
+            results: OrderedDict of diffs of subtrees to share with other diffs with the same keys, in order of
+                     their last use, see stored_rdiff()
+            stats: pyocnos.diffstats.DiffStats to count the work of the diff in, nothing is counted if None
+        """
+        # pylint: disable=too-many-arguments
+        self.left = left
+        self.right = right
+        self.keys = ELEMENTS_WITH_FIXED_KEYS if keys is None else keys
+        self.similarity = NodeSimilarity(left, right, cache, stats)
+        self.results = OrderedDict() if results is None else results
+        self.stats = stats
+        # Compiled keys by tag of the left and the right tree, see key_extractor()
+        self.extractors = ({}, {})
+
+    def key_extractor(self, tree, tag):
+        """
+        Compile the keys of a tag for the symbols of a tree once per diff, see pyocnos.keys.KeyExtractor.
+
+        Args:
+            tree: self.left or self.right
+            tag: tag name of the list entries
+
+        Returns: KeyExtractor
+        """
+        extractors = self.extractors[tree is self.right]
+        extractor = extractors.get(tag)
+        if extractor is None:
+            extractor = extractors[tag] = KeyExtractor(self.keys[tag], tree.symbols)
+        return extractor
+
+    def ordering_intersection(self, nodes_left, nodes_right):
+        """
+        Collects nodes that belongs to nodes_left and also to nodes_right
+        (respecting the counts of same nodes in both lists). For those nodes
+        returns lists of nodes on the same position and reordered nodes.
+
+        Args:
+            nodes_left: sequence of nodes of the left tree
+            nodes_right: sequence of nodes of the right tree
+
+        Returns: a dictionary like this
+                 {
+                     'moved': [int],
+                     'same': [int]
+                 }
+                 with nodes of the left tree
+        """
+        # pylint: disable=too-many-locals
+        if self.stats is not None:
+            self.stats.ordering_intersections += 1
+        tree_diff = defaultdict(list)
+        indexes_left = defaultdict(list)
+        indexes_right = defaultdict(list)
+        hashes_left = self.left.hashes
+        hashes_right = self.right.hashes
+        for i, node in enumerate(nodes_left):
+            indexes_left[hashes_left[node]].append(i)
+        for i, node in enumerate(nodes_right):
+            indexes_right[hashes_right[node]].append(i)
+
+        for hash_, left_indexes in indexes_left.items():
+            if hash_ not in indexes_right:
+                continue
+            right_indexes = set(indexes_right[hash_])
+            same_indexes = [i for i in left_indexes if i in right_indexes]
+            potential_moved_indexes = [i for i in left_indexes if i not in right_indexes]
+            tree_diff[SAME].extend(nodes_left[i] for i in same_indexes)
+            # number of (moved elements + same elements) can't be more than
+            # number of those elements is in the right list
+            moved_count = min(len(left_indexes), len(right_indexes)) - len(same_indexes)
+            tree_diff[MOVED].extend(nodes_left[i] for i in potential_moved_indexes[:moved_count])
+
+        return tree_diff
+
+    def similarity_zip(self, nodes_left, nodes_right):
+        """
+        Apart from mimic the behavior of builtin zip function, this routine allows
+        entries from the provided two iterable are provided in specific order, so
+        that the content in the generated tuple has the largest similarity, with
+        the constraint the whole similarity of the two given list of xml nodes is
+        at a max level.
+
+        Args:
+            nodes_left: [int]
+            nodes_right: [int]
+        Return:
+            a generator like zip
+        """
+        if not nodes_left or not nodes_right:
+            return
+        for index_left, index_right in self.similarity.indexes(nodes_left, nodes_right):
+            yield (nodes_left[index_left], nodes_right[index_right])
+
+    def element_keys_zip(self, elem_tag, nodes_left, nodes_right):
+        """
+        Apart from mimic the behavior of builtin zip function, this routine allows
+        entries from the provided two iterable are provided in specific order, so
+        that the content in the generated tuple has the same value for the
+        specified key element.
+        It fails if two elementes in one iterable have the same key value.
+
+        Args:
+            elem_tag: tag name of the nodes
+            nodes_left: [int]
+            nodes_right: [int]
+        Return:
+            a generator like zip
+        """
+        if not nodes_left or not nodes_right:
+            return
+
+        keys_left = self.key_extractor(self.left, elem_tag).key_dict(self.left, nodes_left)
+        keys_right = self.key_extractor(self.right, elem_tag).key_dict(self.right, nodes_right)
+        if keys_left is None or keys_right is None:
+            # Indicating no key elements were found
+            if self.stats is not None:
+                self.stats.key_fallbacks[elem_tag] += 1
+            yield from self.similarity_zip(nodes_left, nodes_right)
+        else:
+            if self.stats is not None:
+                self.stats.keyed_lists[elem_tag] += 1
+            for key, node in keys_left.items():
+                if key in keys_right:
+                    yield (node, keys_right[key])
+
+    def rdiff(self, node_left, node_right, diffs=None, descend=None):
+        """
+        Recursively create diff information between two nodes provided in arguments.
+        It goes through each level of both trees, collects added, moved or removed nodes,
+        and only goes into deeper layer if two nodes share the same tag and have children.
+        Paired nodes with the same hash are identical and skipped without going deeper. Leaves are only ever matched
+        with identical leaves, so lists of leaves, e.g. vlan ids or member ports, take no similarity matching.
+
+        Args:
+            node_left: node of the left tree
+            node_right: node of the right tree
+            diffs: dictionary to add the diff information to
+            descend: callable taking the arguments node_left, node_right and diffs, called for paired children
+                     instead of going into them, see parallel_rdiff()
+
+        Returns: a dictionary like this
+            {
+                'removed': [int],
+                'added': [(int, int)],
+                'moved': [int],
+            }
+            with nodes of the left tree, except added nodes are tuples of the left node to add the right node to
+        """
+        # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+        if diffs is None:
+            diffs = {REMOVED: [], ADDED: [], MOVED: []}
+        left, right = self.left, self.right
+        hashes_right = right.hashes
+        children_left = left.children(node_left)
+        children_right = right.children(node_right)
+
+        # Handle identical elments, which might be in different order
+        inter_diff = self.ordering_intersection(children_left, children_right)
+        diffs[MOVED].extend(inter_diff[MOVED])
+        matched_left = set(inter_diff[MOVED] + inter_diff[SAME])
+        stats = self.stats
+        if stats is not None:
+            stats.rdiff_calls += 1
+            stats.nodes_visited += len(children_left) + len(children_right)
+            stats.identical_pairs += len(matched_left)
+        # Each identical left node is matched with the first unmatched right node of the same hash
+        matched_hashes = Counter(left.hashes[node] for node in matched_left)
+        remaining_left = [node for node in children_left if node not in matched_left]
+        remaining_right = []
+        for node in children_right:
+            if matched_hashes[hashes_right[node]]:
+                matched_hashes[hashes_right[node]] -= 1
+            else:
+                remaining_right.append(node)
+
+        # Comparing elements with the same tag name (and not completelly same)
+        tagged_left = defaultdict(list)
+        tagged_right = defaultdict(list)
+        for node in remaining_left:
+            tagged_left[left.tags[node]].append(node)
+        for node in remaining_right:
+            tagged_right[right.tags[node]].append(node)
+
+        paired_left = set()
+        paired_right = set()
+        for tag, filtered_nodes_left in tagged_left.items():
+            filtered_nodes_right = tagged_right.get(tag)
+            if not filtered_nodes_right:
+                continue
+            tag_name = left.symbols.names[tag]
+
+            if len(filtered_nodes_left) == len(filtered_nodes_right) == 1:
+                node_tuples = [(filtered_nodes_left[0], filtered_nodes_right[0])]
+            elif all(map(left.is_leaf, filtered_nodes_left)) and all(map(right.is_leaf, filtered_nodes_right)):
+                # Leaves equal to a leaf on the other side are matched already, the rest differ from every leaf on
+                # the other side and are removed and added whichever they are paired with, so they are not paired
+                if stats is not None:
+                    stats.leaf_lists[tag_name] += 1
+                continue
+            elif tag_name in self.keys:
+                node_tuples = self.element_keys_zip(tag_name, filtered_nodes_left, filtered_nodes_right)
+            else:
+                if stats is not None:
+                    stats.similarity_lists[tag_name] += 1
+                node_tuples = self.similarity_zip(filtered_nodes_left, filtered_nodes_right)
+
+            for node_l, node_r in node_tuples:
+                if left.hashes[node_l] == hashes_right[node_r]:
+                    # Identical subtrees, nothing to look into
+                    if stats is not None:
+                        stats.identical_pairs += 1
+                    paired_left.add(node_l)
+                    paired_right.add(node_r)
+                elif not left.is_leaf(node_l) and not right.is_leaf(node_r):
+                    (descend or self.rdiff)(node_l, node_r, diffs)
+                    paired_left.add(node_l)
+                    paired_right.add(node_r)
+
+        # Remaining elements
+        diffs[REMOVED].extend(node for node in remaining_left if node not in paired_left)
+        diffs[ADDED].extend((node_left, node) for node in remaining_right if node not in paired_right)
+
+        return diffs
+
+    def parallel_rdiff(self, node_left, node_right, workers):
+        """
+        Create the same diff information as rdiff(), but the paired children of the given nodes, e.g. the top level
+        containers of a config, are diffed in a pool of worker processes. The compact trees are sent to each worker
+        once and every task is just a pair of nodes. The results are put in place of the pairs in the order rdiff()
+        would have added them, so the diff is identical.
+
+        Args:
+            node_left: node of the left tree
+            node_right: node of the right tree
+            workers: maximum number of worker processes
+
+        Returns: a dictionary like returned by rdiff()
+        """
+        pairs = []
+
+        def defer(node_l, node_r, diffs):
+            deferred = DeferredDiff(len(pairs))
+            pairs.append((node_l, node_r))
+            for nodes in diffs.values():
+                nodes.append(deferred)
+
+        diffs = self.rdiff(node_left, node_right, descend=defer)
+        if len(pairs) > 1 and workers > 1:
+            # Imported here, as multiprocessing takes longer to import than this module without it
+            from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+            with ProcessPoolExecutor(max_workers=min(workers, len(pairs)), initializer=init_worker,
+                                     initargs=(self.left, self.right, self.keys)) as executor:
+                results = list(executor.map(rdiff_worker, pairs))
+        else:
+            results = [self.rdiff(node_l, node_r) for node_l, node_r in pairs]
+
+        merged = {}
+        for change, nodes in diffs.items():
+            merged[change] = []
+            for node in nodes:
+                if isinstance(node, DeferredDiff):
+                    merged[change].extend(results[node.index][change])
+                else:
+                    merged[change].append(node)
+        return merged
+
+    def stored_rdiff(self, node_left, node_right):
+        """
+        Create the same diff information as rdiff(), reusing the diffs of subtrees stored by previous diffs, e.g. of
+        an earlier version of a candidate config. The diff of every pair of nodes is stored by the hashes of the two
+        subtrees, with the nodes as positions among the children of the pair and the diffs of paired children as
+        references to their own stored diffs. So only the pairs whose subtrees were not diffed before are diffed,
+        the rest is looked up, no matter where the subtrees are in either tree.
+
+        Args:
+            node_left: node of the left tree
+            node_right: node of the right tree
+
+        Returns: a dictionary like returned by rdiff()
+        """
+        self.store_rdiff(node_left, node_right)
+        return {change: list(self.stored_nodes(node_left, node_right, change)) for change in (REMOVED, ADDED, MOVED)}
+
+    def store_rdiff(self, node_left, node_right):
+        """
+        Diff a pair of nodes unless their diff is stored already, see stored_rdiff().
+
+        Returns: None
+        """
+        key = (self.left.hashes[node_left], self.right.hashes[node_right])
+        if key in self.results:
+            if self.stats is not None:
+                self.stats.stored_hits += 1
+            return
+        start_left = self.left.child_start[node_left]
+        start_right = self.right.child_start[node_right]
+
+        def descend(node_l, node_r, diffs):
+            self.store_rdiff(node_l, node_r)
+            child_diff = ChildDiff(node_l - start_left, node_r - start_right)
+            for nodes in diffs.values():
+                nodes.append(child_diff)
+
+        diffs = self.rdiff(node_left, node_right, descend=descend)
+        self.results[key] = {
+            REMOVED: [node if isinstance(node, ChildDiff) else node - start_left for node in diffs[REMOVED]],
+            ADDED: [node if isinstance(node, ChildDiff) else node[1] - start_right for node in diffs[ADDED]],
+            MOVED: [node if isinstance(node, ChildDiff) else node - start_left for node in diffs[MOVED]],
+        }
+
+    def stored_nodes(self, node_left, node_right, change):
+        """
+        Look up the nodes of one change type of a stored diff of a pair of nodes, see stored_rdiff().
+
+        Returns: a generator of nodes like in the lists returned by rdiff()
+        """
+        start_left = self.left.child_start[node_left]
+        start_right = self.right.child_start[node_right]
+        key = (self.left.hashes[node_left], self.right.hashes[node_right])
+        # A diff is used after the diffs referring to it, so these are dropped first, see DiffSession.trim()
+        self.results.move_to_end(key)
+        for node in self.results[key][change]:
+            if isinstance(node, ChildDiff):
+                yield from self.stored_nodes(start_left + node.left, start_right + node.right, change)
+            elif change == ADDED:
+                yield (node_left, start_right + node)
+            else:
+                yield start_left + node
+
+    def elements(self, diffs, ref_paths=None):
+        """
+        Look up the lxml elements of diff information of nodes, as created by rdiff().
+
+        Args:
+            diffs: a dictionary of nodes like returned by rdiff()
+            ref_paths: list to append the paths of the left elements to add the added elements to, in their order,
+                       instead of setting them as attributes, which changes the right tree, see build_diff_tree()
+
+        Returns: a dictionary like this
+            {
+                'removed': [lxml.etree.Element],
+                'added': [lxml.etree.Element],
+                'moved': [lxml.etree.Element],
+            }
+            each added element has an attribute 'ref_path' of the path of the left element to add it to, unless
+            ref_paths is given
+        """
+        elements_left = self.left.elements(
+            itertools.chain(diffs[REMOVED], diffs[MOVED], (parent for parent, _ in diffs[ADDED]))
+        )
+        elements_right = self.right.elements(node for _, node in diffs[ADDED])
+        paths = {}
+        added = []
+        for parent, node in diffs[ADDED]:
+            if parent not in paths:
+                paths[parent] = get_path(elements_left[parent])
+            if ref_paths is None:
+                added.extend(mark_ref_path(paths[parent], [elements_right[node]]))
+            else:
+                added.append(elements_right[node])
+                ref_paths.append(paths[parent])
+
+        return {
+            REMOVED: [elements_left[node] for node in diffs[REMOVED]],
+            ADDED: added,
+            MOVED: [elements_left[node] for node in diffs[MOVED]],
+        }
+
+
+def init_worker(left, right, keys):
+    """
+    Set up a worker process of CompactDiff.parallel_rdiff().
 
     Args:
-        hashelements_left: [HashElement]
-        hashelements_right: [HashElement]
-    Return:
-        a generator like zip
+        left: CompactTree
+        right: CompactTree
+        keys: mapping of xml elements to their key elements
+
+    Returns: None
     """
-    if not hashelements_left or not hashelements_right:
-        return
-    elems_left = [hashelem.elem for hashelem in hashelements_left]
-    elems_right = [hashelem.elem for hashelem in hashelements_right]
-    for index_left, index_right in similarity_indexes(elems_left, elems_right):
-        yield (hashelements_left[index_left], hashelements_right[index_right])
+    global WORKER_DIFF  # pylint: disable=global-statement
+    WORKER_DIFF = CompactDiff(left, right, keys)
 
 
-def element_keys_zip(elem_tag, hashelements_left, hashelements_right):
+def rdiff_worker(pair):
     """
-    Apart from mimic the behavior of builtin zip function, this routine allows
-    entries from the provided two iterable are provided in specific order, so
-    that the content in the generated tuple has the same value for the
-    specified key element.
-    It fails if two elementes in one iterable have the same key value.
+    Diff a pair of nodes in a worker process of CompactDiff.parallel_rdiff().
 
     Args:
-        hashelements_left: [HashElement]
-        hashelements_right: [HashElement]
-    Return:
-        a generator like zip
-    """
-    def to_key_dict(key, hash_elements):
-        result = {}
-        for item in hash_elements:
-            item_key = []
-            for key_option in key:
-                elem = item.elem.find(key_option[0])
-                if elem is not None:
-                    item_key = key_option
-                    break
-            else:
-                # Indicating no key elements were found
-                return None
-
-            value = tuple()
-            for key_element in item_key:
-                elem = item.elem.find(key_element)
-                if elem is not None:
-                    value2 = str(elem.text).strip()
-                else:
-                    value2 = None
-                value = value + (value2,)
-            if value in result:
-                raise OCNOSCDuplicateKeyError(
-                    'The config has more elements with the same key value: '
-                    'key={}, value={}'.format(item_key, value))
-            result[value] = item
-        return result
+        pair: tuple of a node of the left tree and a node of the right tree
 
-    if not hashelements_left or not hashelements_right:
-        return
-
-    sorting_key = ELEMENTS_WITH_FIXED_KEYS[elem_tag]
-    keys_left = to_key_dict(sorting_key, hashelements_left)
-    keys_right = to_key_dict(sorting_key, hashelements_right)
-    if keys_left is None or keys_right is None:
-        # Indicating no key elements were found
-        yield from similarity_zip(hashelements_left, hashelements_right)
-    else:
-        for key in set(keys_left) & set(keys_right):
-            yield (keys_left[key], keys_right[key])
+    Returns: a dictionary like returned by CompactDiff.rdiff()
+    """
+    return WORKER_DIFF.rdiff(*pair)
 
 
-def rdiff(hashelem_left, hashelem_right):
+def rdiff(hashelem_left, hashelem_right, keys=None):
     """
     Recursively create diff information between two elements provided in arguments.
     It goes through each level of both xml trees, collects added, moved or removed elements,
     and only goes into deeper layer if two elements share the same tag and have children.
+    See CompactDiff.rdiff(), the hashes of the given HashElement objects are not used.
 
     Args:
         hashelem_left: HashElement object
         hashelem_right: HashElement object
+        keys: mapping of xml elements to their key elements, ELEMENTS_WITH_FIXED_KEYS if not given
 
     Returns: a dictionary like this
         {
@@ -318,54 +665,17 @@ def rdiff(hashelem_left, hashelem_right):
         }
 
     """
-    # pylint: disable=too-many-locals
-    diffs = defaultdict(list)
-
-    hashed_elements_left = [HashElement(sha(elem), elem) for elem in hashelem_left.elem]
-    hashed_elements_right = [HashElement(sha(elem), elem) for elem in hashelem_right.elem]
-
-    # Handle identical elments, which might be in different order
-    inter_diff = ordering_intersection(hashed_elements_left, hashed_elements_right)
-    diffs[MOVED].extend([helem.elem for helem in inter_diff[MOVED]])
-    for hashelem in inter_diff[MOVED] + inter_diff[SAME]:
-        hashed_elements_left.remove(hashelem)
-        for helem in hashed_elements_right:
-            if helem.hash == hashelem.hash:
-                hashed_elements_right.remove(helem)
-                break
-
-    # Comparing elements with the same tag name (and not completelly same)
-    for tag in ({elem.tag for elem in hashelem_left.elem} & {elem.tag for elem in hashelem_right.elem}):
-        filtered_elems_left = [x for x in hashed_elements_left if x.elem.tag == tag]
-        filtered_elems_right = [x for x in hashed_elements_right if x.elem.tag == tag]
-
-        if len(filtered_elems_left) == len(filtered_elems_right) == 1:
-            element_tuples = [(filtered_elems_left[0], filtered_elems_right[0])]
-        elif tag in ELEMENTS_WITH_FIXED_KEYS:
-            element_tuples = element_keys_zip(tag, filtered_elems_left, filtered_elems_right)
-        else:
-            element_tuples = similarity_zip(filtered_elems_left, filtered_elems_right)
+    left, right = CompactTree.pair([hashelem_left.elem], [hashelem_right.elem])
+    compact_diff = CompactDiff(left, right, keys)
+    return compact_diff.elements(compact_diff.rdiff(0, 0))
 
-        for hashelem_l, hashelem_r in element_tuples:
-            if has_children(hashelem_l.elem) and has_children(hashelem_r.elem):
-                deeper_diff = rdiff(hashelem_l, hashelem_r)
-                for change_type in deeper_diff:
-                    diffs[change_type].extend(deeper_diff[change_type])
-                hashed_elements_left.remove(hashelem_l)
-                hashed_elements_right.remove(hashelem_r)
 
-    # Remaining elements
-    diffs[REMOVED].extend(hashelem.elem for hashelem in hashed_elements_left)
-    diffs[ADDED].extend(mark_ref_path(get_path(hashelem_left.elem),
-                                      [hashelem.elem for hashelem in hashed_elements_right]))
-
-    return diffs
-
-
-def build_diff_tree(tree_ref, diffs):
+def build_diff_tree(tree_ref, diffs, ref_paths=None):
     """
     Create a xml tree using provided diff information based on a reference xml tree.
-    The tree_ref is generally the left tree to compare with.
+    The tree_ref is generally the left tree to compare with. The elements of the diff information are not changed, so
+    the trees they are in can be diffed by other threads at the same time, if the paths to add the added elements to
+    are given as ref_paths.
 
     Args:
         tree_ref: lxml.etree.Element
@@ -375,30 +685,56 @@ def build_diff_tree(tree_ref, diffs):
                 'added': [lxml.etree.Element],
                 'moved': [lxml.etree.Element],
             }
+            the added elements with an attribute 'ref_path', see CompactDiff.elements(), unless ref_paths is given
+        ref_paths: list of the paths of the left elements to add the added elements to, in their order
 
     Returns: lxml.etree.element
     """
-    tree_diff = deepcopy(tree_ref)
-    for elem in diffs[REMOVED]:
-        tree_diff.xpath(get_path(elem))[0].set('change', REMOVED)
-    for elem in diffs[MOVED]:
-        tree_diff.xpath(get_path(elem))[0].set('change', MOVED)
-
-    for elem in diffs[ADDED]:
-        ref_path = elem.attrib.pop('ref_path')
-        found = tree_diff.xpath('{}/{}'.format(ref_path, elem.tag))
-        added_elem = deepcopy(elem)
-        added_elem.set('change', ADDED)
-        elem.set('ref_path', ref_path)
-        if found:
-            found[-1].addnext(added_elem)
-        else:
-            tree_diff.xpath(ref_path)[0].append(added_elem)
+    with tracing.span('diff.build_diff_tree', {'diff.{}'.format(change): len(diffs[change])
+                                               for change in (ADDED, MOVED, REMOVED)}):
+        tree_diff = deepcopy(tree_ref)
+        for elem in diffs[REMOVED]:
+            tree_diff.xpath(get_path(elem))[0].set('change', REMOVED)
+        for elem in diffs[MOVED]:
+            tree_diff.xpath(get_path(elem))[0].set('change', MOVED)
+
+        for index, elem in enumerate(diffs[ADDED]):
+            if ref_paths is None:
+                # The attribute is not copied to the diff tree
+                ref_path = elem.attrib.pop('ref_path')
+                added_elem = deepcopy(elem)
+                elem.set('ref_path', ref_path)
+            else:
+                ref_path = ref_paths[index]
+                added_elem = deepcopy(elem)
+            found = tree_diff.xpath('{}/{}'.format(ref_path, elem.tag))
+            added_elem.set('change', ADDED)
+            if found:
+                found[-1].addnext(added_elem)
+            else:
+                tree_diff.xpath(ref_path)[0].append(added_elem)
 
-    return tree_diff
+        return tree_diff
 
 
-def rrender(tree_diff, indent_initial=0):
+def changed_element_xml(elem, pretty_print=True):
+    """
+    Serialise a changed element of a diff xml tree without its change attribute.
+
+    Args:
+        elem: lxml.etree.Element
+        pretty_print: whether to indent the children on lines of their own
+
+    Returns: String
+    """
+    change_type = elem.attrib.pop('change')
+    try:
+        return etree.tostring(elem, pretty_print=pretty_print).decode('utf-8')
+    finally:
+        elem.attrib['change'] = change_type
+
+
+def rrender(tree_diff, indent_initial=0, changed=None, keys=None):
     """
     Recursively render a provided diff xml tree with a given indent.
     The tree_diff contains information about which element is added, moved or removed, which will be renderd with
@@ -407,52 +743,180 @@ def rrender(tree_diff, indent_initial=0):
     Args:
         tree_diff: lxml.etree.Element
         indent_initial: how many white spaces for indention to render this tree
+        changed: set of elements containing changed children, see changed_ancestors(). Generated if not given.
+        keys: mapping of xml elements to their key elements, ELEMENTS_WITH_FIXED_KEYS if not given
+
+    Returns: a list of lines of the diff tree, see iter_rrender() to get them one by one
+    """
+    with tracing.span('diff.rrender') as span:
+        lines = list(iter_rrender(tree_diff, indent_initial, changed, keys))
+        span.set_attribute('diff.lines', len(lines))
+        return lines
+
+
+def iter_rrender(tree_diff, indent_initial=0, changed=None, keys=None):
+    """
+    Render a diff xml tree like rrender(), but yield the lines as they are rendered, so they can be written out without
+    holding all of them.
 
-    Returns: a string representation of the diff tree
+    Returns: a generator of lines
     """
     if not has_children(tree_diff):
         raise ValueError('A diff tree without any children is not supported.')
 
-    if not has_changed_children(tree_diff):
-        return []
+    if changed is None:
+        changed = changed_ancestors(tree_diff)
+    if keys is None:
+        keys = ELEMENTS_WITH_FIXED_KEYS
+
+    if tree_diff not in changed:
+        return
 
-    result = ['{}[{}]'.format(' '*indent_initial, tree_diff.tag)]
+    yield '{}[{}]'.format(' '*indent_initial, tree_diff.tag)
     for elem in tree_diff:
         if elem.get('change'):
-            change_type = elem.attrib.pop('change')
-            symbol = DIFF_SYMBOLS[change_type]
+            symbol = DIFF_SYMBOLS[elem.get('change')]
+            for xml in changed_element_xml(elem).rstrip(os.linesep).split(os.linesep):
+                yield '{}{}{}'.format(symbol, ' ' * (indent_initial+1), xml)
 
-            xml_string_list = etree.tostring(elem, pretty_print=True) \
-                                   .decode('utf-8')                   \
-                                   .rstrip(os.linesep)                \
-                                   .split(os.linesep)
-            result.extend(['{}{}{}'.format(symbol, ' ' * (indent_initial+1), xml) for xml in xml_string_list])
-            elem.attrib['change'] = change_type
-
-        elif has_changed_children(elem):
-            result.extend(rrender(elem, indent_initial+2))
+        elif elem in changed:
+            yield from iter_rrender(elem, indent_initial+2, changed, keys)
 
         else:
             parent_keys = itertools.chain(
-                *ELEMENTS_WITH_FIXED_KEYS.get(tree_diff.tag, []))
+                *keys.get(tree_diff.tag, []))
             if elem.tag in parent_keys:
-                result.append('{}{}'.format(' '*(indent_initial+2), etree.tostring(elem).decode('utf-8')))
+                yield '{}{}'.format(' '*(indent_initial+2), etree.tostring(elem).decode('utf-8'))
 
-    return result
+
+class PreparedTree:
+    """
+    A normalised xml tree together with its compact tree, see normalize_tree() and pyocnos.compact.CompactTree. It is
+    parsed and hashed once, to diff it against any number of other trees, see DiffSession.
+    """
+
+    __slots__ = ('tree', 'compact')
+
+    def __init__(self, xmlstring, symbols=None, huge_tree=None):
+        """
+        Args:
+            xmlstring: serialised xml, or a parsed lxml.etree.Element, which becomes the normalised tree
+            symbols: pyocnos.compact.Symbols to build the compact tree with, a new one if not given
+            huge_tree: see pyocnos.parsing.xml_parser
+        """
+        self.tree = normalize_tree(xmlstring, huge_tree)
+        self.compact = CompactTree([self.tree], symbols)
 
 
-def build_xml_diff(xmlstring_left, xmlstring_right):
+class DiffSession:
+    """
+    Diff one xml tree, either the left or the right one, against many others. The fixed tree is prepared once, and
+    the similarities and the diffs of subtrees calculated for one diff are reused by the following ones. Diffing
+    an edited version of a tree diffed before only diffs the subtrees changed by the edit, see
+    CompactDiff.stored_rdiff().
+
+    Usage:
+     > session = DiffSession(left=running_config)
+     > diffs = [session.diff(candidate) for candidate in candidates]
     """
-    Main entry of the module, which generates a string representation of the diff between two xml tree.
 
-    Args:
-        xmlstring_left: serialised xml
-        xmlstring_right: serialised xml
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = ('left', 'right', 'keys', 'workers', 'cache', 'results', 'max_cached', 'max_results')
+
+    def __init__(self, left=None, right=None, keys=None, workers=None, *, max_cached=MAX_CACHED_SIMILARITIES,
+                 max_results=MAX_STORED_DIFFS):
+        """
+        Args:
+            left: serialised xml or PreparedTree to diff other trees against
+            right: serialised xml or PreparedTree to diff other trees to, if left is not given
+            keys: see build_xml_diff()
+            workers: see build_xml_diff(), the subtree diffs of a parallel diff are not reused
+            max_cached: number of similarities of subtrees kept after each diff, the least recently used are dropped
+            max_results: number of diffs of subtrees kept after each diff, the least recently used are dropped
+        """
+        # pylint: disable=too-many-arguments
+        if (left is None) == (right is None):
+            raise ValueError('Either the left or the right tree must be given.')
+        self.left = self.prepare(left)
+        self.right = self.prepare(right)
+        self.keys = keys
+        self.workers = workers
+        self.cache = OrderedDict()
+        self.results = OrderedDict()
+        self.max_cached = max_cached
+        self.max_results = max_results
+
+    @staticmethod
+    def prepare(tree, symbols=None):
+        """ Parse a tree unless prepared already """
+        if tree is None or isinstance(tree, PreparedTree):
+            return tree
+        return PreparedTree(tree, symbols)
+
+    def diff(self, other, stats=None):
+        """
+        Diff the fixed tree against another one.
+
+        Args:
+            other: serialised xml or PreparedTree, the right tree if the session has the left one and vice versa
+            stats: see build_xml_diff()
+
+        Returns: diff in string, see build_xml_diff()
+        """
+        fixed = self.left or self.right
+        start = time.perf_counter()
+        prepared = self.prepare(other, fixed.compact.symbols.copy())
+        if stats is not None and prepared is not other:
+            stats.add_time('normalize', time.perf_counter() - start)
+            stats.hashed_nodes += len(prepared.compact)
+        try:
+            if self.left is not None:
+                result = diff_prepared(self.left, prepared, self.keys, self.workers, cache=self.cache,
+                                       results=self.results, stats=stats)
+            else:
+                result = diff_prepared(prepared, self.right, self.keys, self.workers, cache=self.cache,
+                                       results=self.results, stats=stats)
+        except Exception:
+            # The diffs stored by a failed diff are not in order of their use, see trim()
+            self.results.clear()
+            raise
+        self.trim()
+        return result
 
-    Returns: diff in string
+    def trim(self):
+        """
+        Drop the least recently used similarities beyond max_cached and diffs of subtrees beyond max_results. The
+        diffs referring to a diff of a subtree are used before it, see CompactDiff.stored_nodes(), so they are dropped
+        before it and every diff kept finds the diffs it refers to.
+        """
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+
+
+def diff_tree_prepared(left, right, keys=None, workers=None, *, cache=None, results=None, stats=None):
     """
-    tree_left, tree_right = (normalize_tree(xmlstring) for xmlstring in (utf8(xmlstring_left), utf8(xmlstring_right)))
+    Create the diff xml tree of two prepared trees, see build_diff_tree(). The prepared trees are not changed, so they
+    can be diffed again.
 
+    Args:
+        left: PreparedTree
+        right: PreparedTree
+        keys: see build_xml_diff()
+        workers: see build_xml_diff()
+        cache: OrderedDict of similarities to share with other diffs, see pyocnos.similarity.NodeSimilarity
+        results: OrderedDict of diffs of subtrees to share with other diffs, see CompactDiff.stored_rdiff()
+        stats: see build_xml_diff(). The statistics of the diff are logged at debug level, counted even if None then.
+
+    Returns: lxml.etree.Element, or None if the trees are the same
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    log = logging.getLogger(LOGGER_NAME)
+    if stats is None and log.isEnabledFor(logging.DEBUG):
+        stats = DiffStats()
+    tree_left, tree_right = left.tree, right.tree
     if tree_left.tag != tree_right.tag:
         raise ValueError('The root tags must be the same! '
                          'left: {}, right: {}'.format(tree_left.tag, tree_right.tag))
@@ -460,14 +924,98 @@ def build_xml_diff(xmlstring_left, xmlstring_right):
     if not (has_children(tree_left) and has_children(tree_right)):
         raise ValueError('Comparing simple xml with no children elements is not supported.')
 
-    hash_left = sha(tree_left)
-    hash_right = sha(tree_right)
-    if hash_left == hash_right:
-        return ''
+    compact_left, compact_right = common_symbols(left.compact, right.compact)
+    if compact_left.hashes[0] == compact_right.hashes[0]:
+        return None
+
+    compact_diff = CompactDiff(compact_left, compact_right, keys, cache=cache, results=results, stats=stats)
+    # Kept apart from the right tree, which may be diffed by other threads, e.g. a candidate shared by many devices
+    ref_paths = []
+    start = time.perf_counter()
+    with tracing.span('diff.rdiff', {'diff.nodes.left': len(compact_left),
+                                     'diff.nodes.right': len(compact_right), 'diff.workers': workers or 1}):
+        if workers and workers > 1:
+            diffs = compact_diff.elements(compact_diff.parallel_rdiff(0, 0, workers), ref_paths)
+        elif results is not None:
+            diffs = compact_diff.elements(compact_diff.stored_rdiff(0, 0), ref_paths)
+        else:
+            diffs = compact_diff.elements(compact_diff.rdiff(0, 0), ref_paths)
+    rdiff_end = time.perf_counter()
+    tree_diff = build_diff_tree(tree_left, diffs, ref_paths)
+    if stats is not None:
+        stats.add_time('rdiff', rdiff_end - start)
+        stats.add_time('build_diff_tree', time.perf_counter() - rdiff_end)
+        log.debug('Diff statistics: %s', stats.as_dict())
+    return tree_diff
+
 
-    diffs = rdiff(HashElement(hash_left, tree_left), HashElement(hash_right, tree_right))
-    tree_diff = build_diff_tree(tree_left, diffs)
-    rendered_diffs = rrender(tree_diff)
+def diff_prepared(left, right, keys=None, workers=None, *, cache=None, results=None, stats=None):
+    """
+    Generate a string representation of the diff between two prepared trees, see build_xml_diff() and
+    diff_tree_prepared().
+
+    Returns: diff in string
+    """
+    # pylint: disable=too-many-arguments
+    tree_diff = diff_tree_prepared(left, right, keys, workers, cache=cache, results=results, stats=stats)
+    if tree_diff is None:
+        return ''
 
     # Till here we have a xml tree with indication of diff and collaps of same elements. Prettify the result and return.
-    return '{}'.format(os.linesep).join(rendered_diffs)
+    start = time.perf_counter()
+    lines = rrender(tree_diff, keys=keys)
+    if stats is not None:
+        stats.add_time('render', time.perf_counter() - start)
+    return '{}'.format(os.linesep).join(lines)
+
+
+def prepare_pair(xmlstring_left, xmlstring_right, stats=None):
+    """
+    Prepare two xml trees to be diffed, the right one with the symbols of the left one.
+
+    Args:
+        xmlstring_left: serialised xml, or lxml.etree.Element which is normalised in place
+        xmlstring_right: serialised xml, or lxml.etree.Element which is normalised in place
+        stats: pyocnos.diffstats.DiffStats to add the time and the hashed nodes of the preparation to
+
+    Returns: tuple of the left and the right PreparedTree
+    """
+    start = time.perf_counter()
+    left = PreparedTree(xmlstring_left)
+    right = PreparedTree(xmlstring_right, left.compact.symbols)
+    if stats is not None:
+        stats.add_time('normalize', time.perf_counter() - start)
+        stats.hashed_nodes += len(left.compact) + len(right.compact)
+    return left, right
+
+
+def build_xml_diff(xmlstring_left, xmlstring_right, keys=None, workers=None, stats=None):
+    """
+    Main entry of the module, which generates a string representation of the diff between two xml tree.
+
+    Args:
+        xmlstring_left: serialised xml
+        xmlstring_right: serialised xml
+        keys: mapping of xml elements to their key elements, ELEMENTS_WITH_FIXED_KEYS if not given,
+              e.g. merged with keys discovered by pyocnos.schema
+        workers: if more than 1, the top level containers are diffed in up to this many processes, see
+                 CompactDiff.parallel_rdiff(). The diff is the same.
+        stats: pyocnos.diffstats.DiffStats to count the work of the diff in, e.g. to find the tags which need keys
+
+    Returns: diff in string
+    """
+    left, right = prepare_pair(xmlstring_left, xmlstring_right, stats)
+    return diff_prepared(left, right, keys, workers, stats=stats)
+
+
+def build_xml_diff_with_stats(xmlstring_left, xmlstring_right, keys=None, workers=None):
+    """
+    Generate the diff between two xml trees like build_xml_diff, counting its work.
+
+    Args:
+        See build_xml_diff.
+
+    Returns: tuple of the diff in string and the pyocnos.diffstats.DiffStats of its work
+    """
+    stats = DiffStats()
+    return build_xml_diff(xmlstring_left, xmlstring_right, keys, workers, stats=stats), stats
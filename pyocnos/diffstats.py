@@ -0,0 +1,126 @@
+"""
+This module counts the work of a diff, to tell why a diff is slow: how many
+nodes it visited, how siblings were matched, how often and on how large lists
+the hungarian algorithm ran, and the time of each stage.
+
+Siblings of the same tag are matched by their keys if the tag has keys, see
+pyocnos.diff.ELEMENTS_WITH_FIXED_KEYS, otherwise by their similarity, see
+pyocnos.similarity. The latter is much more expensive for long lists, so the
+tags matched by similarity most often are the first to give keys.
+
+Usage:
+ > from pyocnos.diff import build_xml_diff_with_stats
+ > diff, stats = build_xml_diff_with_stats(running, candidate)
+ > print('\\n'.join(stats.report()))
+"""
+from collections import Counter
+from collections import OrderedDict
+
+# Number of tags listed per kind of matching by report()
+REPORT_TOP_TAGS = 10
+
+
+class DiffStats:
+    """
+    Counters of the work of one or more diffs. Work done in worker processes
+    of a parallel diff is not counted, except for the time of its stage.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self):
+        # Nodes hashed to prepare the trees of the diff, see pyocnos.compact.CompactTree
+        self.hashed_nodes = 0
+        # Pairs of nodes diffed, and their children looked at
+        self.rdiff_calls = 0
+        self.nodes_visited = 0
+        # Pairs of siblings skipped as identical subtrees by their hashes
+        self.identical_pairs = 0
+        self.ordering_intersections = 0
+        # Pairs of nodes whose diff was found stored from an earlier diff, see pyocnos.diff.DiffSession
+        self.stored_hits = 0
+        # Lists of siblings by tag, matched by their keys, by similarity as some had no key elements, and by
+        # similarity as the tag has no keys, and lists of leaves, which are not matched at all
+        self.keyed_lists = Counter()
+        self.key_fallbacks = Counter()
+        self.similarity_lists = Counter()
+        self.leaf_lists = Counter()
+        self.hungarian_calls = 0
+        self.hungarian_cells = 0
+        # Rows and columns of the largest cost matrix
+        self.hungarian_largest = (0, 0)
+        self.similarity_cache_hits = 0
+        self.similarity_cache_misses = 0
+        # Seconds by stage, e.g. 'rdiff'
+        self.stage_times = OrderedDict()
+
+    def record_hungarian(self, rows, columns):
+        """
+        Count a run of the hungarian algorithm.
+
+        Args:
+            rows: (int) number of rows of the cost matrix
+            columns: (int) number of columns of the cost matrix
+        """
+        self.hungarian_calls += 1
+        self.hungarian_cells += rows * columns
+        if rows * columns > self.hungarian_largest[0] * self.hungarian_largest[1]:
+            self.hungarian_largest = (rows, columns)
+
+    def add_time(self, stage, seconds):
+        """
+        Add to the time of a stage.
+
+        Args:
+            stage: (String) name of the stage, e.g. 'normalize', 'rdiff', 'build_diff_tree' or 'render'
+            seconds: (float) duration
+        """
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        """
+        Returns: (dict) of all counters, with tags counted by name, e.g. to log or dump as JSON
+        """
+        return {
+            'hashed_nodes': self.hashed_nodes,
+            'rdiff_calls': self.rdiff_calls,
+            'nodes_visited': self.nodes_visited,
+            'identical_pairs': self.identical_pairs,
+            'ordering_intersections': self.ordering_intersections,
+            'stored_hits': self.stored_hits,
+            'keyed_lists': dict(self.keyed_lists),
+            'key_fallbacks': dict(self.key_fallbacks),
+            'similarity_lists': dict(self.similarity_lists),
+            'leaf_lists': dict(self.leaf_lists),
+            'hungarian_calls': self.hungarian_calls,
+            'hungarian_cells': self.hungarian_cells,
+            'hungarian_largest': list(self.hungarian_largest),
+            'similarity_cache_hits': self.similarity_cache_hits,
+            'similarity_cache_misses': self.similarity_cache_misses,
+            'stage_times': dict(self.stage_times),
+        }
+
+    def report(self):
+        """
+        Render the counters for people.
+
+        Returns: a generator of lines
+        """
+        yield 'Nodes hashed: {}, visited: {} in {} pairs, identical pairs skipped: {}, stored diffs reused: {}'.format(
+            self.hashed_nodes, self.nodes_visited, self.rdiff_calls, self.identical_pairs, self.stored_hits)
+        yield 'Ordering intersections: {}'.format(self.ordering_intersections)
+        yield ('Lists matched by keys: {}, by similarity for missing keys: {}, by similarity without keys: {}, '
+               'lists of leaves: {}').format(
+                   sum(self.keyed_lists.values()), sum(self.key_fallbacks.values()),
+                   sum(self.similarity_lists.values()), sum(self.leaf_lists.values()))
+        for title, tags in (('Tags with missing keys', self.key_fallbacks),
+                            ('Tags without keys', self.similarity_lists)):
+            if tags:
+                yield '{}: {}'.format(title, ', '.join(
+                    '{} ({})'.format(tag, count) for tag, count in tags.most_common(REPORT_TOP_TAGS)))
+        yield 'Hungarian algorithm runs: {}, cells: {}, largest matrix: {}x{}'.format(
+            self.hungarian_calls, self.hungarian_cells, *self.hungarian_largest)
+        yield 'Similarity cache hits: {}, misses: {}'.format(self.similarity_cache_hits, self.similarity_cache_misses)
+        if self.stage_times:
+            yield 'Stages: {}'.format(', '.join(
+                '{} {:.3f}s'.format(stage, seconds) for stage, seconds in self.stage_times.items()))
@@ -1,36 +1,60 @@
 #!/usr/bin/env python
 """ Exceptions for pyocnos """
+from collections import namedtuple
+import sys
 
-from ncclient.operations.rpc import RPCError
+
+def is_rpc_error(exception):
+    """
+    Whether an exception is a ncclient RPCError. It is checked without
+    importing ncclient, which is loaded already if the exception comes from it.
+    """
+    rpc = sys.modules.get('ncclient.operations.rpc')
+    return rpc is not None and isinstance(exception, rpc.RPCError)
+
+
+# Details of one rpc-error reply of the device
+RPCErrorDetail = namedtuple('RPCErrorDetail', ['tag', 'path', 'message', 'info'])
+
+
+def rpc_error_details(exception):
+    """
+    Collect the details of the rpc-errors of a ncclient RPCError.
+
+    Args:
+        exception: any exception
+
+    Returns: list of RPCErrorDetail, empty if the exception is not a RPCError
+    """
+    if not is_rpc_error(exception):
+        return []
+    # Received multiple ncclient errors
+    netconf_errors = exception.errors if hasattr(exception, 'errors') else [exception]
+    # The internal attributes in RPCError class for its properties, "tag",
+    # "path", etc. might be unavailable since they are all set at run time
+    # depending on rpc error.
+    return [
+        RPCErrorDetail(getattr(error, '_tag', ''), getattr(error, '_path', ''), getattr(error, '_message', ''),
+                       getattr(error, '_info', ''))
+        for error in netconf_errors
+    ]
 
 
 class OCNOSError(Exception):
     """ OcNOS Exception """
     def __init__(self, msg='', ncclient_exc=None):
-        if ncclient_exc is not None and isinstance(ncclient_exc, RPCError):
-            if hasattr(ncclient_exc, 'errors'):
-                # Received multiple ncclient errors
-                netconf_errors = ncclient_exc.errors
-            else:
-                netconf_errors = [ncclient_exc]
+        # The rpc-errors of the device, e.g. to tell whether to try again
+        self.rpc_errors = rpc_error_details(ncclient_exc)
+        if self.rpc_errors:
             netconf_msgs = []
-            for error in netconf_errors:
+            for error in self.rpc_errors:
                 netconf_msgs.append(
                     'rpc-error:\n'
                     '    error-tag: {}\n'
                     '    error-path: {}\n'
                     '    error-message: {}\n'
                     '    error-info:\n'
-                    '    {}'.format(
-                        # The internal attributes in RPCError class for
-                        # its properties, "tag", "path", etc. might be
-                        # unavailable since they are all set at run time
-                        # depending on rpc error.
-                        getattr(error, '_tag', ''),
-                        getattr(error, '_path', ''),
-                        getattr(error, '_message', ''),
-                        getattr(error, '_info', '')
-                    )
+                    '    {}'.format(error.tag, error.path, error.message, error.info)
                 )
 
             error_msg = ('{}\n'
@@ -118,6 +142,29 @@ class OCNOSCandidateConfigInvalidError(OCNOSError):
     """
 
 
+class OCNOSSaveConfigError(OCNOSError):
+    """
+    Exception class when unable to save the running config as startup config
+    """
+
+
+class OCNOSAgentError(OCNOSError):
+    """
+    Exception class when a request to the agent failed, see pyocnos.agent
+    """
+
+    def __init__(self, msg='', error=None):
+        # Class name of the exception raised in the agent, if it raised one
+        self.error = error
+        super().__init__(msg)
+
+
+class OCNOSKeysFileError(OCNOSError):
+    """
+    Exception class when a file of list keys can't be read or is invalid, see pyocnos.keys
+    """
+
+
 class OCNOSCDuplicateKeyError(OCNOSError):
     """
     Exception class when config contains elements with the same key
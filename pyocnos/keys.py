@@ -0,0 +1,216 @@
+"""
+This module keeps the keys of list elements, which pyocnos.diff pairs list
+entries by, e.g. interfaces by their names, instead of by their similarity.
+
+The keys of a list are given by the tag of its entries as options, tuples of
+the names of key elements. The first option whose first key element is a
+child of an entry gives the key of the entry, e.g. an interface is keyed by
+its ifName, or by its name if it has no ifName:
+  {'interface': [('ifName',), ('name',)]}
+
+ELEMENTS_WITH_FIXED_KEYS are the keys of the lists known to pyocnos. Lists
+of other platforms or OcNOS versions are read from a YAML or JSON file with
+load_keys, in this form:
+  keys:
+    vlan:
+      - [vlanId]
+  platforms:
+    - platform: AS7712-32X
+      version: '6.4'
+      keys:
+        mac-acl:
+          - [name]
+The keys of the sections matching the platform and the OcNOS version are
+tried first, then the common ones. A section without platform or version
+matches any, a version matches the versions starting with it. More keys are
+added to the keys given to the diffs with register_keys.
+
+A diff compiles the keys of a tag once per tree into a KeyExtractor, which
+looks up the key elements of an entry by their symbol ids, see
+pyocnos.compact.Symbols, rather than by their names.
+"""
+import io
+import json
+
+from future.utils import raise_from
+
+from .compact import NO_TEXT
+from .exceptions import OCNOSCDuplicateKeyError
+from .exceptions import OCNOSKeysFileError
+from .schema import merge_keys
+
+# mapping of xml elements to its child to use as a key in diff comparison
+# keys for list elements are defined in the schema files
+# (https://github.com/IPInfusion/OcNOS/tree/1.3.8.151/yang-files/trident2plus/DC_IPBASE)
+# or in response from 'get-schema' RPC call
+ELEMENTS_WITH_FIXED_KEYS = {
+    'interface': [('ifName',), ('name',), ('interface-name',)],
+    'accessListMac': [('aclNameMAC',)],
+    'filterList': [('sMacFM', 'vlanFM', 'packetFormatFM'), ('<sIpFC>', '<vlanFC>'), ('<accessNumFL>',)],
+    'nvoAccessIfVlanInfo': [('vlanId',)],
+    'acl-set': [('name',)],
+    'acl-entry': [('sequence-id',)],
+    'config': [('source-mac-host', 'vlan-id',
+                'ethertype',),  # for acl-entry/mac/config
+               ('vlan-identifier',)  # for tagged-access-interface/config
+               ],
+    'vxlan-tenant': [('vxlan-identifier',)],
+    'network-instance': [('network-instance',)],
+    'class-map': [('name',)],
+    'ingress-acl-set': [('acl-type',)],
+}
+
+
+class KeyExtractor:
+    """
+    The keys of one tag compiled for the symbols of a tree, see the module
+    docstring.
+    """
+
+    __slots__ = ('options', 'elements')
+
+    def __init__(self, options, symbols):
+        """
+        Args:
+            options: list of tuple of the names of key elements, e.g. [('ifName',), ('name',)]
+            symbols: pyocnos.compact.Symbols of the tree
+        """
+        # Options as tuples of their names and the symbol ids of their elements, None for names not in the tree
+        self.options = [(option, tuple(symbols.ids.get(name) for name in option)) for option in options]
+        # Symbol ids of all key elements, the only children looked at
+        self.elements = frozenset(symbol for _, ids in self.options for symbol in ids if symbol is not None)
+
+    def key_dict(self, tree, nodes):
+        """
+        Get the keys of list entries.
+
+        Args:
+            tree: pyocnos.compact.CompactTree
+            nodes: nodes of the entries
+
+        Returns: dictionary of tuples of the texts of the key elements, None for missing ones, to the nodes, or None
+                 if no option applies to some entry
+        Raises: OCNOSCDuplicateKeyError if entries have the same key
+        """
+        # pylint: disable=too-many-locals
+        tags, texts, names = tree.tags, tree.texts, tree.symbols.names
+        child_start, child_end = tree.child_start, tree.child_end
+        elements = self.elements
+        result = {}
+        for node in nodes:
+            # The first child of each tag, like lxml find() does
+            children = {}
+            for child in range(child_start[node], child_end[node]):
+                tag = tags[child]
+                if tag in elements and tag not in children:
+                    children[tag] = child
+                    if len(children) == len(elements):
+                        # Key elements usually come first, the other children need not be looked at
+                        break
+            for option, ids in self.options:
+                if ids[0] in children:
+                    break
+            else:
+                # Indicating no key elements were found
+                return None
+            value = tuple(
+                None if symbol not in children
+                else 'None' if texts[children[symbol]] == NO_TEXT else names[texts[children[symbol]]]
+                for symbol in ids
+            )
+            if value in result:
+                raise OCNOSCDuplicateKeyError(
+                    'The config has more elements with the same key value: '
+                    'key={}, value={}'.format(option, value))
+            result[value] = node
+        return result
+
+
+def register_keys(keys, tag, options):
+    """
+    Add key options of a tag, tried after the options it has already.
+
+    Args:
+        keys: mapping of tags to their keys to add to, e.g. returned by load_keys
+        tag: (String) tag of the list entries, e.g. 'vlan'
+        options: list of tuple of the names of key elements, e.g. [('vlanId',)]
+    """
+    known = keys.setdefault(tag, [])
+    known.extend(tuple(option) for option in options if tuple(option) not in known)
+
+
+def section_matches(section, platform, version):
+    """
+    Whether a section of a keys file applies to a platform and an OcNOS version, see the module docstring.
+
+    Returns: bool
+    """
+    if section.get('platform') is not None and section['platform'] != platform:
+        return False
+    return section.get('version') is None or str(version or '').startswith(str(section['version']))
+
+
+def checked_keys(keys):
+    """
+    Check the keys of a section of a keys file.
+
+    Args:
+        keys: a dictionary like this {'interface': [['ifName'], ['name']]}
+
+    Returns: the same dictionary
+    Raises: TypeError if it is not in this form
+    """
+    if not isinstance(keys, dict):
+        raise TypeError('keys must be a mapping of tags to lists of key options, not {!r}'.format(keys))
+    for tag, options in keys.items():
+        if not isinstance(options, list) or not all(
+                isinstance(option, list) and option and all(isinstance(name, str) for name in option)
+                for option in options):
+            raise TypeError('key options of {} must be lists of element names, not {!r}'.format(tag, options))
+    return keys
+
+
+def load_keys(path, platform=None, version=None, fixed=True):
+    """
+    Read the keys of lists from a YAML or JSON file, see the module docstring.
+    A file ending with .json is read as JSON, others as YAML.
+
+    Args:
+        path: (String) path of the file
+        platform: (String) platform of the devices, e.g. AS7712-32X, to select the sections of the file
+        version: (String) OcNOS version of the devices, e.g. 6.4.1, to select the sections of the file
+        fixed: (bool) whether to merge ELEMENTS_WITH_FIXED_KEYS too, after the keys of the file
+
+    Returns: a dictionary like this {'interface': [('ifName',), ('name',)]}, to give as keys to the diffs
+    Raises: OCNOSKeysFileError if the file can't be read or is not in this form
+    """
+    try:
+        with io.open(path, 'r', encoding='utf-8') as keys_file:
+            text = keys_file.read()
+    except IOError as io_error:
+        raise_from(OCNOSKeysFileError('Unable to read keys file {}: {}'.format(path, io_error)), io_error)
+
+    if path.endswith('.json'):
+        parse, errors = json.loads, ValueError
+    else:
+        # Imported here, as yaml takes long to import and is only needed with a keys file
+        import yaml  # pylint: disable=import-outside-toplevel
+        parse, errors = yaml.safe_load, yaml.YAMLError
+    try:
+        content = parse(text)
+        if content is None:
+            content = {}
+        if not isinstance(content, dict):
+            raise TypeError('a keys file must be a mapping with keys and platforms, not {!r}'.format(content))
+        key_maps = []
+        # Every section is checked, so a mistake shows for any platform
+        for section in content.get('platforms') or []:
+            keys = checked_keys(section['keys'])
+            if section_matches(section, platform, version):
+                key_maps.append(keys)
+        key_maps.append(checked_keys(content.get('keys') or {}))
+    except (errors, KeyError, TypeError, AttributeError) as error:
+        raise_from(OCNOSKeysFileError('Invalid keys file {}: {}'.format(path, error)), error)
+    if fixed:
+        key_maps.append(ELEMENTS_WITH_FIXED_KEYS)
+    return merge_keys(*key_maps)
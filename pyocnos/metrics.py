@@ -0,0 +1,289 @@
+"""
+This module collects operational metrics of pyocnos runs and renders them in
+the Prometheus text exposition format. It needs no external service: the
+rendered metrics are written to a local file, which fits the textfile
+collector of the Prometheus node exporter when the CLI runs from cron.
+
+Usage:
+ > from pyocnos.metrics import Metrics
+ > metrics = Metrics()
+ > with metrics.time('connect', 'switch1'):
+ >     device.open()
+ > metrics.write_textfile('/var/lib/node_exporter/pyocnos-switch1.prom')
+
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import io
+import os
+import tempfile
+import threading
+import time
+
+# Operations timed by the CLI.
+CONNECT = 'connect'
+FETCH = 'fetch'
+DIFF = 'diff'
+COMMIT = 'commit'
+
+# Upper bounds in seconds of the histogram buckets. They span a quick NETCONF
+# rpc up to a slow commit on a large config.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape_label_value(value):
+    """
+    Escape a label value as required by the Prometheus text format.
+
+    Args:
+        value: label value, converted to string
+
+    Returns: String
+    """
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(labels):
+    """
+    Render a label set, e.g. {host="foo",operation="connect"}.
+
+    Args:
+        labels: [(name, value)]
+
+    Returns: String, empty when there are no labels
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('{}="{}"'.format(name, escape_label_value(value)) for name, value in labels)
+
+
+def format_value(value):
+    """
+    Render a sample value, keeping integers free of a trailing '.0'.
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """ A monotonically increasing value per label set """
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = defaultdict(float)
+        # Values are updated from threads retrieving configs concurrently, see pyocnos.audit
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the counter of the given label set.
+
+        Args:
+            amount: (int|float) must not be negative
+            labels: value for every label name of this metric
+
+        Returns: None
+        """
+        if amount < 0:
+            raise ValueError('Counters can only be increased.')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def get(self, **labels):
+        """ Current value of the given label set """
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """
+        Returns: [(sample name, [(label name, label value)], value)]
+        """
+        return [(self.name, list(key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """ A value per label set which can go up and down """
+
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        """ Set the value of the given label set """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """ Observations per label set counted in cumulative buckets """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts = {}
+        self._sums = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        """
+        Record one observation for the given label set.
+
+        Args:
+            value: (int|float) e.g. a duration in seconds
+            labels: value for every label name of this metric
+
+        Returns: None
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._sums[key] += value
+
+    def count(self, **labels):
+        """ Number of observations of the given label set """
+        counts = self._counts.get(self._key(labels))
+        return counts[-1] if counts else 0
+
+    def samples(self):
+        """
+        Returns: [(sample name, [(label name, label value)], value)]
+        """
+        result = []
+        for key, counts in sorted(self._counts.items()):
+            for bound, count in zip(self.buckets, counts):
+                result.append(('{}_bucket'.format(self.name), list(key) + [('le', format_value(bound))], count))
+            result.append(('{}_sum'.format(self.name), list(key), self._sums[key]))
+            result.append(('{}_count'.format(self.name), list(key), counts[-1]))
+        return result
+
+
+class MetricsRegistry:
+    """ A collection of metrics rendered together """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        Returns: the registered metric
+        """
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError('Metric {} is already registered.'.format(metric.name))
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all registered metrics in the Prometheus text exposition format.
+
+        Returns: String
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.metric_type))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Write the rendered metrics to a file. The content is written to a
+        temporary file in the same directory and then renamed, so the node
+        exporter never reads a partially written file.
+
+        Args:
+            path: (String) destination file, usually ending with '.prom'
+
+        Returns: None
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=directory, prefix='.pyocnos-', suffix='.prom.tmp')
+        try:
+            with io.open(file_descriptor, 'w', encoding='utf-8') as prom_file:
+                prom_file.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+class Metrics(MetricsRegistry):
+    """ The metrics recorded by pyocnos runs """
+
+    def __init__(self):
+        super().__init__()
+        self.durations = self.register(Histogram(
+            'pyocnos_operation_duration_seconds',
+            'Duration of device operations in seconds.',
+            labelnames=('host', 'operation'),
+        ))
+        self.config_bytes = self.register(Gauge(
+            'pyocnos_config_bytes',
+            'Size of the last config retrieved or loaded in bytes.',
+            labelnames=('host', 'source'),
+        ))
+        self.exceptions = self.register(Counter(
+            'pyocnos_exceptions_total',
+            'Number of failures by exception class.',
+            labelnames=('host', 'exception'),
+        ))
+        self.retries = self.register(Counter(
+            'pyocnos_retries_total',
+            'Number of retried device operations.',
+            labelnames=('host', 'operation'),
+        ))
+
+    @contextmanager
+    def time(self, operation, host):
+        """
+        Context manager observing how long its body takes, whether or not it
+        raises an exception.
+
+        Args:
+            operation: (String) one of CONNECT, FETCH, DIFF or COMMIT
+            host: (String) hostname of the device
+
+        Returns: None
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.durations.observe(time.monotonic() - start, host=host, operation=operation)
+
+    def record_exception(self, host, exception):
+        """
+        Count a failure by the class name of the raised exception, e.g.
+        OCNOSConnectionError.
+        """
+        self.exceptions.inc(host=host, exception=type(exception).__name__)
+
+    def record_retry(self, host, operation):
+        """
+        Count an operation tried again, see pyocnos.retry.RetryPolicy.
+        """
+        self.retries.inc(host=host, operation=operation)
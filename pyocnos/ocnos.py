@@ -3,44 +3,134 @@ Class to communicate with devices running OcNOS operating system
 """
 import functools
 import logging
+import threading
 # todo: Remove this once Ipinfusion have fix issue on as5812 switches for timeout
 from time import sleep
 
 from future.utils import raise_from
-import lxml
-from ncclient import manager
-from ncclient import NCClientError
+from lxml import etree
 
 from pyocnos import LOGGER_NAME
-from pyocnos.diff import build_xml_diff
+from pyocnos import tracing
+from pyocnos.candidate import CandidateConfig
+from pyocnos.candidate import load_candidate
+from pyocnos.candidate import parse_candidate_config
+from pyocnos.diff import diff_prepared
+from pyocnos.diff import ELEMENTS_WITH_FIXED_KEYS
+from pyocnos.diff import PreparedTree
 from pyocnos.exceptions import OCNOSBasicModeError
 from pyocnos.exceptions import OCNOSCandidateConfigInvalidError
 from pyocnos.exceptions import OCNOSCandidateConfigNotInServerCapabilitiesError
 from pyocnos.exceptions import OCNOSCandidateConfigNotLoadedError
 from pyocnos.exceptions import OCNOSConnectionError
-from pyocnos.exceptions import OCNOSLoadCandidateConfigFileReadError
-from pyocnos.exceptions import OCNOSNoCandidateConfigError
+from pyocnos.exceptions import OCNOSSaveConfigError
 from pyocnos.exceptions import OCNOSUnableToRetrieveConfigError
 from pyocnos.exceptions import OCNOSUnOpenedConnectionError
+from pyocnos.parsing import log_parsed
+from pyocnos.parsing import parse_xml
+from pyocnos.retry import COMMIT
+from pyocnos.retry import CONNECT
+from pyocnos.retry import FETCH
+from pyocnos.retry import NO_RETRY
+from pyocnos.retry import SAVE
+from pyocnos.schema import capability_modules
+from pyocnos.schema import default_cache_dir
+from pyocnos.schema import load_cached_keys
+from pyocnos.schema import merge_keys
+from pyocnos.schema import parse_yang
+from pyocnos.schema import save_cached_keys
+from pyocnos.schema import schema_version
+from pyocnos.schema import unambiguous_keys
+
+
+# When commit_config saves the running config as startup config: right away,
+# by save() or when the connection is closed, or never
+PERSIST_IMMEDIATE = 'immediate'
+PERSIST_DEFERRED = 'deferred'
+PERSIST_NEVER = 'never'
+PERSIST_MODES = (PERSIST_IMMEDIATE, PERSIST_DEFERRED, PERSIST_NEVER)
+
+# Names imported from ncclient by import_transport()
+TRANSPORT_NAMES = ('manager', 'NCClientError', 'DefaultManager')
+
+# Held by import_transport() while it binds the names, as devices can be
+# opened by many threads at once, e.g. by an audit
+TRANSPORT_LOCK = threading.Lock()
+
+
+def default_manager_class(ncclient_manager):
+    """
+    Create the DefaultManager class, see import_transport.
+    Args:
+        ncclient_manager:   the module ncclient.manager
 
+    Returns:                class
+    """
+    class DefaultManager(ncclient_manager.Manager):  # pylint: disable=redefined-outer-name
+        """
+        Class extending ncclient default Manager class to prefer
+        default netconf operations instead of vendor specific operations.
+        """
+        # pylint: disable=abstract-method
+        def __getattr__(self, method):
+            if method in ncclient_manager.OPERATIONS:
+                return functools.partial(self.execute, ncclient_manager.OPERATIONS[method])
+            return super().__getattr__(method)
 
-class DefaultManager(manager.Manager):
+    return DefaultManager
+
+
+def import_transport():
     """
-    Class extending ncclient default Manager class to prefer
-    default netconf operations instead of vendor specific operations.
+    Import ncclient, which brings paramiko and cryptography along, on first
+    use rather than with this module. It takes longer than importing all of
+    pyocnos, which is wasted on diffing configs and e.g. 'pyocnos --help'.
+    The imported names are module globals from then on, DefaultManager
+    being bound last.
+
+    Returns:    None
+    """
+    # pylint: disable=global-statement,global-variable-undefined,invalid-name
+    # pylint: disable=import-outside-toplevel,redefined-outer-name
+    global manager, NCClientError, DefaultManager
+    if 'DefaultManager' in globals():
+        return
+
+    with TRANSPORT_LOCK:
+        if 'DefaultManager' in globals():
+            return
+        from ncclient import manager
+        from ncclient import NCClientError
+        DefaultManager = default_manager_class(manager)
+
+
+def transport_error():
+    """
+    The base class of ncclient exceptions, to catch them in methods which
+    can run before a connection is opened by this module, e.g. with a
+    connection of a pool, without import_transport having run.
+
+    Returns:    class
     """
-    # pylint: disable=abstract-method
-    def __getattr__(self, method):
-        if method in manager.OPERATIONS:
-            return functools.partial(self.execute, manager.OPERATIONS[method])
-        return super().__getattr__(method)
+    import_transport()
+    return NCClientError
+
+
+def __getattr__(name):
+    """ Import the ncclient names on first access, see import_transport """
+    if name in TRANSPORT_NAMES:
+        import_transport()
+        return globals()[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 class OCNOS:
     # pylint: disable=too-many-instance-attributes
     """ Class to instantiate a OcNOS device """
 
-    def __init__(self, hostname, username, password, timeout=60, port=830):
+    def __init__(self, hostname, username, password, timeout=60, port=830, *, discover_list_keys=False,
+                 persist=PERSIST_IMMEDIATE, persist_delay=None, retry=None, metrics=None, huge_tree=None,
+                 keys=None):
         # pylint: disable=too-many-arguments
         """
         OCNOS device constructor.
@@ -50,15 +140,57 @@ class OCNOS:
             password:   (str) Password
             timeout:    (int) Timeout (default: 60 sec)
             port:       (int) Port (default: 830)
+            discover_list_keys: (bool) Load the keys of lists from the YANG
+                        modules of the device before the first
+                        compare_config, see load_list_keys (default: False)
+            persist:    (str) When commit_config saves the running config as
+                        startup config: 'immediate' after each commit,
+                        'deferred' once by save() or close() after any
+                        number of commits, or 'never' (default: immediate)
+            persist_delay: (float) Seconds after the last deferred commit to
+                        save in a background thread, if no save() comes
+                        first. Only by save() or close() if None (default)
+            retry:      (pyocnos.retry.RetryPolicy) for all operations, or
+                        (dict) of operation classes to RetryPolicy, see
+                        pyocnos.retry.retry_policies. Operations are tried
+                        once only by default
+            metrics:    (pyocnos.metrics.Metrics) to count retries in
+            huge_tree:  (bool) Parse configs beyond the security limits of
+                        libxml2, see pyocnos.parsing.xml_parser. As set by
+                        pyocnos.parsing.enable_huge_tree if None (default)
+            keys:       (dict) Keys of lists to diff configs by, e.g. read
+                        by pyocnos.keys.load_keys. Discovered keys are
+                        merged after them. pyocnos.diff.ELEMENTS_WITH_FIXED_KEYS
+                        if None (default)
         """
+        if persist not in PERSIST_MODES:
+            raise ValueError('persist must be one of {}, not {!r}'.format(', '.join(PERSIST_MODES), persist))
         self.hostname = hostname
         self.username = username
         self.password = password
         self.timeout = timeout
         self.port = port
+        self.discover_list_keys = discover_list_keys
+        self.keys = keys
+        # Keys of list elements used to diff configs including the
+        # discovered ones, None for self.keys
+        self.list_keys = None
 
         self._connection = None
-        self._candidate_config = None
+        # The loaded candidate, shared with other devices, and the copy of its
+        # tree for this device, see _candidate_config
+        self._candidate = None
+        self._candidate_copy = None
+        self.persist = persist
+        self.persist_delay = persist_delay
+        # Whether a deferred commit is not saved yet, guarded by the lock
+        # together with the timer of the background save
+        self._unsaved = False
+        self._save_lock = threading.RLock()
+        self._save_timer = None
+        self.retry = retry
+        self.metrics = metrics
+        self.huge_tree = huge_tree
         self.log = logging.getLogger(LOGGER_NAME)
 
     def __enter__(self):
@@ -88,9 +220,23 @@ class OCNOS:
         """
         Open a connection to an OcNOS running device using SSH.
 
+        Returns:    None
+        Raises:     OCNOSConnectionError
+                    OCNOSBasicModeError
+        """
+        with tracing.span('ocnos.open', {'device.hostname': self.hostname}):
+            self._connect()
+            with tracing.span('ocnos.basic_mode', {'device.hostname': self.hostname}):
+                self._set_basic_mode()
+
+    def _connect(self):
+        """
+        Open the NETCONF session, see open().
+
         Returns:    None
         Raises:     OCNOSConnectionError
         """
+        import_transport()
         allow_agent = bool(self.password is None)
 
         # Because of the bug in ncclient it's not possible to connect to
@@ -100,7 +246,8 @@ class OCNOS:
         # DefaultManager class to temporarily fix the issue
         # ncclient github issue - https://github.com/ncclient/ncclient/issues/386
         try:
-            built_in_manager = manager.connect(
+            built_in_manager = self._retry(CONNECT, functools.partial(
+                manager.connect,
                 host=self.hostname,
                 port=self.port,
                 username=self.username,
@@ -109,14 +256,14 @@ class OCNOS:
                 look_for_keys=False,
                 allow_agent=allow_agent,
                 hostkey_verify=False,
-            )
+            ))
             # pylint: disable=protected-access
             self._connection = DefaultManager(built_in_manager._session,
                                               built_in_manager._device_handler,
                                               built_in_manager._timeout)
             # todo: Remove this once Ipinfusion have fix issue on as5812 switches for timeout
             sleep(2)
-        except NCClientError as ncclient_exception:
+        except transport_error() as ncclient_exception:
             self.log.error('Error', exc_info=True)
             raise_from(
                 OCNOSConnectionError('Unable to open ssh connection.', ncclient_exception),
@@ -129,16 +276,23 @@ class OCNOS:
                 self.username
             )
 
+    def _set_basic_mode(self):
+        """
+        Set the basic mode of the session to trim, see open().
+
+        Returns:    None
+        Raises:     OCNOSBasicModeError
+        """
         try:
             # Set basic mode to trim
-            rpc_elem = lxml.etree.fromstring(
+            rpc_elem = etree.fromstring(
                 b'<?xml version="1.0" encoding="UTF-8"?>'
                 b'<set-default-handling-basic-mode '
                 b'xmlns="http://ipinfusion.com/ns/zebmcli"><mode>'
                 b'trim</mode></set-default-handling-basic-mode>'
             )
             self._connection.dispatch(rpc_elem)
-        except NCClientError as ncclient_exception:
+        except transport_error() as ncclient_exception:
             if str(ncclient_exception) == 'definition not found':
                 self.log.info(
                     'The set-default-handling-basic-mode not supported on this'
@@ -170,9 +324,14 @@ class OCNOS:
                 raise OCNOSConnectionError(
                     'Unable to close ssh connection. The ssh transport is closed.'
                 )
+            save_error = None
+            try:
+                self.save()
+            except OCNOSSaveConfigError as exception:
+                save_error = exception
             try:
                 self._connection.close_session()
-            except NCClientError as ncclient_exception:
+            except transport_error() as ncclient_exception:
                 self.log.error('error', exc_info=True)
                 raise_from(
                     OCNOSConnectionError(
@@ -188,6 +347,8 @@ class OCNOS:
                     self.username
                 )
                 self._connection = None
+            if save_error is not None:
+                raise save_error
 
     def is_alive(self):
         """
@@ -199,7 +360,8 @@ class OCNOS:
 
     def load_candidate_config(self, filename=None, config=None):
         """
-        Load candidate_config from a string or file like object
+        Load candidate_config from a string or file like object. Files are
+        parsed once per process, see pyocnos.candidate.CandidateCache.
         Args:
             filename:       Path to the file containing the desired
                             configuration. Default: None.
@@ -210,31 +372,31 @@ class OCNOS:
         Raises:             OCNOSLoadCandidateConfigError,
                             OCNOSLoadCandidateConfigFileReadError
         """
-        if filename is None and config is None:
-            raise OCNOSNoCandidateConfigError
         if filename:
-            try:
-                self._candidate_config = lxml.etree.parse(
-                    str(filename),
-                    parser=lxml.etree.XMLParser(remove_blank_text=True)
-                ).getroot()
-            except IOError as io_error:
-                raise_from(OCNOSLoadCandidateConfigFileReadError, io_error)
+            self._candidate = load_candidate(filename, self.huge_tree)
         else:
-            # napalm_install_config passess config as string to the driver so
-            # encoding that to bytes
-            if isinstance(config, str):
-                config = config.encode()
-            # parsing from bytes, so it works with xml encoding declaration
-            self._candidate_config = lxml.etree.fromstring(
-                config,
-                parser=lxml.etree.XMLParser(remove_blank_text=True))
-        self._candidate_config.tag = 'config'
+            self._candidate = CandidateConfig(parse_candidate_config(config=config, huge_tree=self.huge_tree))
+        self._candidate_copy = None
         self.log.info('candidate_config loaded')
 
+    @property
+    def _candidate_config(self):
+        """
+        Tree of the loaded candidate config of this device, None if not loaded.
+        The candidate is shared with other devices, the tree is copied on first
+        use only.
+
+        Returns:            lxml.etree.Element
+        """
+        if self._candidate is not None and self._candidate_copy is None:
+            self._candidate_copy = self._candidate.copy()
+        return self._candidate_copy
+
     def commit_config(self, replace_config=False):
         """
-        Commit the loaded candidate config
+        Commit the loaded candidate config. The running config is saved as
+        startup config right away, later or never, see the persist argument
+        of the constructor.
 
         Args:
             replace_config:     (bool) True if replacing the running config
@@ -246,9 +408,10 @@ class OCNOS:
                                 OCNOSCandidateConfigNotLoadedError
                                 OCNOSCandidateConfigNotInServerCapabilitiesError
                                 OCNOSCandidateConfigInvalidError
+                                OCNOSSaveConfigError
         """
 
-        if self._candidate_config is None:
+        if self._candidate is None:
             self.log.error('Error: Candidate config not loaded')
             raise OCNOSCandidateConfigNotLoadedError
 
@@ -272,33 +435,141 @@ class OCNOS:
             self.log.info('Merge Candidate config with Running config')
             default_operation = 'merge'
 
-        with self._connection.locked(target='candidate'):
-            self._connection.discard_changes()
+        attributes = {'device.hostname': self.hostname}
+
+        def apply_candidate():
+            with tracing.span('netconf.lock', attributes), self._connection.locked(target='candidate'):
+                with tracing.span('netconf.discard_changes', attributes):
+                    self._connection.discard_changes()
+                with tracing.span('netconf.edit_config', attributes) as span:
+                    if span.recording:
+                        span.set_attribute('config.elements', sum(1 for _ in self._candidate_config.iter()))
+                    self._connection.edit_config(
+                        target='candidate',
+                        config=self._candidate_config,
+                        error_option='rollback-on-error',
+                        default_operation=default_operation
+                    )
+                with tracing.span('netconf.commit', attributes):
+                    self._connection.commit()
+
+        # A deferred save in the background waits for the commit
+        with tracing.span('ocnos.commit', dict(attributes, **{'commit.operation': default_operation})), \
+                self._save_lock:
             try:
-                self._connection.edit_config(
-                    target='candidate',
-                    config=self._candidate_config,
-                    error_option='rollback-on-error',
-                    default_operation=default_operation
-                )
-                self._connection.commit()
-            except NCClientError as ncclient_exception:
+                # The candidate is locked again by every attempt, e.g. after
+                # another session held the lock
+                self._retry(COMMIT, apply_candidate)
+            except transport_error() as ncclient_exception:
                 self.log.error('error', exc_info=True)
                 raise_from(
                     OCNOSCandidateConfigInvalidError('Failed to change the running config.', ncclient_exception),
                     ncclient_exception
                 )
-        self._connection.copy_config(source='running', target='startup')
+            self._unsaved = self._unsaved or self.persist != PERSIST_NEVER
+            self.cancel_background_save()
+            if self.persist == PERSIST_IMMEDIATE:
+                self.save()
+            elif self.persist == PERSIST_DEFERRED:
+                self.log.info('Saving the running config as startup config deferred')
+                if self.persist_delay is not None:
+                    self._save_timer = threading.Timer(self.persist_delay, self.background_save)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+
+    def _retry(self, operation, func):
+        """
+        Call a function with the retry policy of an operation class, logging
+        and counting the retries.
+        Args:
+            operation:          (str) operation class, see pyocnos.retry
+            func:               callable without arguments
+
+        Returns:                the result of func
+        """
+        if isinstance(self.retry, dict):
+            policy = self.retry.get(operation, NO_RETRY)
+        else:
+            policy = self.retry or NO_RETRY
+
+        def on_retry(attempt, exception, delay):
+            self.log.warning("%s of '%s' failed in attempt %s, trying again in %.1f seconds: %s",
+                             operation, self.hostname, attempt, delay, exception)
+            if self.metrics is not None:
+                self.metrics.record_retry(self.hostname, operation)
+
+        # The other operations run on the session opened by connecting
+        return policy.call(func, on_retry, in_session=operation != CONNECT)
+
+    def save(self):
+        """
+        Save the running config as startup config if a commit is not saved
+        yet, see the persist argument of the constructor.
+
+        Returns:                (bool) True if saved, False if there was
+                                nothing to save
+        Raises:                 OCNOSUnOpenedConnectionError
+                                OCNOSSaveConfigError
+        """
+        with self._save_lock:
+            self.cancel_background_save()
+            if not self._unsaved:
+                return False
+            if not self._connection:
+                self.log.error('Error: no open connection', exc_info=True)
+                raise OCNOSUnOpenedConnectionError
+            try:
+                with tracing.span('ocnos.save', {'device.hostname': self.hostname}):
+                    self._retry(SAVE, functools.partial(self._connection.copy_config, source='running',
+                                                        target='startup'))
+            except transport_error() as ncclient_exception:
+                self.log.error('Unable to save the running config as startup config', exc_info=True)
+                raise_from(
+                    OCNOSSaveConfigError('Failed to save the running config.', ncclient_exception),
+                    ncclient_exception
+                )
+            self._unsaved = False
+            self.log.info('Running config saved as startup config')
+            return True
 
-    def compare_config(self):
+    def cancel_background_save(self):
+        """
+        Stop the pending background save, if any.
+
+        Returns:                None
+        """
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+    def background_save(self):
+        """
+        Save deferred commits in the background thread started by
+        commit_config. An error is logged, the commits are saved again by the
+        next save() or close().
+
+        Returns:                None
+        """
+        try:
+            self.save()
+        except (OCNOSSaveConfigError, OCNOSUnOpenedConnectionError):
+            self.log.warning('Background save of %s failed, retried by save() or close()', self.hostname)
+
+    def compare_config(self, running=None):
         """
         Diff on the running and candidate config
+        Args:
+            running:    (str) running config retrieved before, e.g. by
+                        get_config, so that retrieving and diffing are
+                        timed apart. Retrieved from the device if None
+                        (default)
         Returns:        List
         Raises:         OCNOSCandidateConfigNotLoadedError
                         OCNOSUnOpenedConnectionError
 
         """
-        if self._candidate_config is None:
+        if self._candidate is None:
             self.log.error('Error: Candidate config not loaded')
             raise OCNOSCandidateConfigNotLoadedError
 
@@ -306,56 +577,158 @@ class OCNOS:
             self.log.error('Error: no open connection', exc_info=True)
             raise OCNOSUnOpenedConnectionError
 
-        return build_xml_diff(self._get_config_from_device('running'),
-                              lxml.etree.tostring(self._candidate_config, encoding='UTF-8'))
+        if self.discover_list_keys and self.list_keys is None:
+            self.load_list_keys()
 
-    # pylint: disable=inconsistent-return-statements
-    def _get_config_from_device(self, config_name):
+        candidate = self._candidate.prepared
+        if running is None:
+            # The tree as parsed, rather than serialised and parsed again
+            running_tree = self._get_config_tree('running')
+        else:
+            running_tree = parse_xml(running, self.huge_tree)
+            running_tree.tag = 'config'
+        running = PreparedTree(running_tree, candidate.compact.symbols.copy())
+        return diff_prepared(running, candidate, keys=self.keys if self.list_keys is None else self.list_keys)
+
+    def load_list_keys(self, cache_dir=None):
+        """
+        Discover the keys of all lists in the YANG modules advertised by the
+        device and merge them with the keys of the device, see __init__, so
+        compare_config pairs list entries by keys rather than by similarity.
+        The modules are retrieved with the get-schema rpc only once per set of
+        modules and revisions, i.e. per OcNOS version, and the discovered keys
+        cached in a json file.
+
+        Args:
+            cache_dir:  (str) Directory of the cache files
+                        (default: pyocnos in the user cache directory)
+
+        Returns:        (dict) the keys also stored in self.list_keys
+        Raises:         OCNOSUnOpenedConnectionError
+        """
+        if not self._connection:
+            self.log.error('Error: no open connection', exc_info=True)
+            raise OCNOSUnOpenedConnectionError
+
+        cache_dir = cache_dir or default_cache_dir()
+        modules = capability_modules(self._connection.server_capabilities)
+        version = schema_version(modules)
+        discovered = load_cached_keys(cache_dir, version)
+        if discovered is None:
+            discovered = self._get_list_keys_from_device(modules)
+            try:
+                save_cached_keys(cache_dir, version, discovered)
+            except (IOError, OSError):
+                self.log.warning('Unable to cache list keys in %s', cache_dir, exc_info=True)
+        else:
+            self.log.info('List keys of schema %s loaded from cache', version)
+        discovered, conflicts = unambiguous_keys(discovered)
+        if conflicts:
+            self.log.warning('Lists declared with different keys, paired by similarity: %s', ', '.join(conflicts))
+
+        self.list_keys = merge_keys(ELEMENTS_WITH_FIXED_KEYS if self.keys is None else self.keys, discovered)
+        return self.list_keys
+
+    def _get_list_keys_from_device(self, modules):
+        """
+        Retrieve YANG modules and their submodules from the device and collect
+        the keys of all lists. A module which can't be retrieved is skipped.
+        Args:
+            modules:        list of tuple (module, revision)
+
+        Returns:            (dict) e.g. {'interface': [('name',)]}
+        """
+        discovered = {}
+        pending = list(modules)
+        retrieved = set()
+        while pending:
+            module, revision = pending.pop(0)
+            if module in retrieved:
+                continue
+            retrieved.add(module)
+            try:
+                schema = self._retry(FETCH, functools.partial(self._connection.get_schema, module,
+                                                              version=revision)).data
+            except transport_error():
+                self.log.warning("Unable to retrieve schema of module '%s'", module, exc_info=True)
+                continue
+            keys, includes = parse_yang(schema or '')
+            discovered = merge_keys(discovered, keys)
+            pending.extend((include, None) for include in includes)
+        self.log.info('Keys of %s lists discovered in %s modules', len(discovered), len(retrieved))
+        return discovered
+
+    def _get_config_from_device(self, config_name, subtree=None):
         """
         Get config from device depending on config name
         Args:
             config_name:    (str) e.g. running or startup
+            subtree:        (str) subtree filter to retrieve a part of the
+                            config only, e.g. '<vr xmlns="..."/>'
 
         Returns:            (str) xml string representing the config
         Raises:             OCNOSUnOpenedConnectionError,
                             OCNOSUnableToRetrieveConfigError
         """
-        if self._connection:
+        config = self._get_config_tree(config_name, subtree)
+        return etree.tostring(config, encoding='UTF-8', pretty_print=True).decode()
+
+    # pylint: disable=inconsistent-return-statements
+    def _get_config_tree(self, config_name, subtree=None):
+        """
+        Get config from device as a tree, see _get_config_from_device.
+
+        Returns:            lxml.etree.Element with the tag 'config'
+        Raises:             OCNOSUnOpenedConnectionError,
+                            OCNOSUnableToRetrieveConfigError
+        """
+        if not self._connection:
+            self.log.error('Error', exc_info=True)
+            raise OCNOSUnOpenedConnectionError
+
+        attributes = {'device.hostname': self.hostname, 'config.source': config_name}
+        with tracing.span('ocnos.get_config', attributes) as span:
+            kwargs = {} if subtree is None else {'filter': ('subtree', subtree)}
             try:
-                config = self._connection.get_config(
-                    source=config_name,
-                    with_defaults='trim'
-                ).data_xml
-            except NCClientError as ncclient_exception:
+                # The rpc on its own, the rest of the span is parsing
+                with tracing.span('netconf.get_config', attributes):
+                    config = self._retry(FETCH, functools.partial(
+                        self._connection.get_config,
+                        source=config_name,
+                        with_defaults='trim',
+                        **kwargs
+                    )).data_xml
+            except transport_error() as ncclient_exception:
                 self.log.error('Error', exc_info=True)
                 raise_from(
                     OCNOSUnableToRetrieveConfigError('Unable to retrieve running config.', ncclient_exception),
                     ncclient_exception
                 )
             else:
-                running_config = lxml.etree.fromstring(
-                    config.encode(),
-                    parser=lxml.etree.XMLParser(remove_blank_text=True))
+                running_config = parse_xml(config, self.huge_tree)
                 running_config.tag = 'config'
-                return lxml.etree.tostring(running_config, encoding='UTF-8', pretty_print=True).decode()
-        else:
-            self.log.error('Error', exc_info=True)
-            raise OCNOSUnOpenedConnectionError
+                span.set_attribute('config.bytes', len(config))
+                if span.recording:
+                    span.set_attribute('config.elements', sum(1 for _ in running_config.iter()))
+                log_parsed('{} config of {}'.format(config_name, self.hostname), len(config), running_config)
+                return running_config
 
-    def get_config(self, retrieve='all'):
+    def get_config(self, retrieve='all', subtree=None):
         """
         Get all or a specific config
         Args:
             retrieve:   (str) could be all or one of startup, running,
                         or candidate
+            subtree:    (str) subtree filter to retrieve a part of the
+                        configs only, e.g. one top level container
+                        '<vr xmlns="..."/>'. The whole configs by default.
 
         Returns:        (dict)
 
         """
         return {
-            'startup': self._get_config_from_device('startup') if retrieve in ('startup', 'all') else '',
-            'running': self._get_config_from_device('running') if retrieve in ('running', 'all') else '',
-            'candidate': self._get_config_from_device('candidate') if retrieve in ('candidate', 'all') else ''
+            source: self._get_config_from_device(source, subtree) if retrieve in (source, 'all') else ''
+            for source in ('startup', 'running', 'candidate')
         }
 
     def discard_config(self):
@@ -365,5 +738,6 @@ class OCNOS:
         Returns:    None
         """
 
-        self._candidate_config = None
+        self._candidate = None
+        self._candidate_copy = None
         self.log.info("candidate_config discarded")
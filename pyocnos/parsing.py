@@ -0,0 +1,119 @@
+"""
+This module parses configs, which may be very large, e.g. with tens of
+thousands of interfaces or ACL entries.
+
+The parsers are reused, one per thread as lxml parsers must not be shared
+between threads. Files and file objects are parsed as a stream, without
+reading them into memory first.
+
+By default libxml2 refuses documents beyond its security limits, e.g. text
+longer than 10 MB or elements nested deeper than 256 levels. The huge tree
+mode lifts these limits, for a parse given huge_tree=True or for all parses
+of the process after enable_huge_tree().
+
+Usage:
+ > from pyocnos.parsing import parse_xml
+ > root = parse_xml('running.xml', huge_tree=True)
+"""
+import logging
+import os
+import threading
+
+from lxml import etree
+
+from pyocnos import LOGGER_NAME
+
+try:
+    import resource
+except ImportError:  # pragma: no cover, not available on Windows
+    resource = None
+
+# Whether parses lift the security limits of libxml2 unless told otherwise
+HUGE_TREE = False
+
+_parsers = threading.local()
+
+
+def enable_huge_tree(enabled=True):
+    """
+    Set whether parses lift the security limits of libxml2 by default, e.g.
+    for the command line option --huge-tree.
+
+    Args:
+        enabled: (bool)
+    """
+    global HUGE_TREE  # pylint: disable=global-statement
+    HUGE_TREE = bool(enabled)
+
+
+def xml_parser(huge_tree=None):
+    """
+    Get the parser of the current thread, which removes blank text.
+
+    Args:
+        huge_tree: (bool) whether to lift the security limits of libxml2,
+                   HUGE_TREE if None
+
+    Returns: lxml.etree.XMLParser
+    """
+    huge_tree = HUGE_TREE if huge_tree is None else bool(huge_tree)
+    parsers = getattr(_parsers, 'parsers', None)
+    if parsers is None:
+        parsers = _parsers.parsers = {}
+    parser = parsers.get(huge_tree)
+    if parser is None:
+        parser = parsers[huge_tree] = etree.XMLParser(remove_blank_text=True, huge_tree=huge_tree)
+    return parser
+
+
+def parse_xml(source, huge_tree=None):
+    """
+    Parse xml from a string, or as a stream from a file or file object.
+
+    Args:
+        source: serialised xml as str or bytes, a path as os.PathLike, or a
+                binary file object
+        huge_tree: see xml_parser()
+
+    Returns: lxml.etree.Element, the root
+    """
+    parser = xml_parser(huge_tree)
+    if isinstance(source, str):
+        # parsing from bytes, so it works with xml encoding declaration
+        source = source.encode()
+    if isinstance(source, bytes):
+        return etree.fromstring(source, parser=parser)
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    return etree.parse(source, parser=parser).getroot()
+
+
+def peak_memory():
+    """
+    Get the peak resident memory of the process.
+
+    Returns: (int) bytes, None where unknown
+    """
+    if resource is None:
+        return None
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def log_parsed(what, size, root):
+    """
+    Log the size of a parsed document and the peak memory of the process at
+    debug level.
+
+    Args:
+        what: (String) description of the document, e.g. 'running config of switch1'
+        size: (int) bytes parsed, None if unknown
+        root: lxml.etree.Element, the root of the document
+    """
+    log = logging.getLogger(LOGGER_NAME)
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    elements = sum(1 for _ in root.iter())
+    memory = peak_memory()
+    log.debug('Parsed %s: %s bytes, %s elements, peak memory %s MB', what, 'unknown' if size is None else size,
+              elements, 'unknown' if memory is None else memory // 2 ** 20)
@@ -0,0 +1,239 @@
+"""
+This module renders diff xml trees, see pyocnos.diff.build_diff_tree, in
+different output formats. All renderers are generators, so the lines of a
+diff can be written out one by one, no matter how large the diff is.
+
+Output formats:
+ text: the format of pyocnos.diff.build_xml_diff
+ jsonl: one JSON object per changed element with its change type, xpath and xml
+ unified: hunks of the changed elements of each parent, similar to diff -u
+
+Usage:
+ > from pyocnos.render import iter_xml_diff
+ > for line in iter_xml_diff("<data><foo>100</foo></data>", "<data><foo>10</foo></data>", output_format='jsonl'):
+ >     print(line)
+ {"change": "removed", "path": "/data/foo", "xml": "<foo>100</foo>"}
+ {"change": "added", "path": "/data/foo", "xml": "<foo>10</foo>"}
+
+More output formats can be added with register_renderer.
+"""
+import itertools
+import json
+
+from lxml import etree
+
+from pyocnos.diff import ADDED
+from pyocnos.diff import changed_ancestors
+from pyocnos.diff import changed_element_xml
+from pyocnos.diff import DIFF_SYMBOLS
+from pyocnos.diff import diff_tree_prepared
+from pyocnos.diff import ELEMENTS_WITH_FIXED_KEYS
+from pyocnos.diff import iter_rrender
+from pyocnos.diff import prepare_pair
+
+DEFAULT_LABELS = ('left', 'right')
+
+
+def left_steps(parent):
+    """
+    Steps of the children of an element of a diff xml tree in xpaths of the
+    left tree, counted in one pass over the children.
+
+    Args:
+        parent: lxml.etree.Element
+
+    Returns: a dictionary like this {lxml.etree.Element: 'vrId[1]'}, without
+             the added children, whose step is their tag
+    """
+    siblings = {}
+    for child in parent.iterchildren():
+        if child.get('change') != ADDED:
+            siblings.setdefault(child.tag, []).append(child)
+    steps = {}
+    for tag, children in siblings.items():
+        for position, child in enumerate(children, 1):
+            steps[child] = tag if len(children) == 1 else '{}[{}]'.format(tag, position)
+    return steps
+
+
+def left_path(elem, steps=None):
+    """
+    Xpath of an element of a diff xml tree in the left tree, i.e. not counting
+    the added elements. Added elements are not in the left tree, their path is
+    the path of their parent followed by their tag.
+
+    Args:
+        elem: lxml.etree.Element
+        steps: dictionary of the left_steps of the parents already seen, shared
+               by the paths of one tree so each parent is counted once
+
+    Returns: String e.g. '/data/vr/vrId[1]'
+    """
+    steps = {} if steps is None else steps
+    path = []
+    while elem is not None:
+        parent = elem.getparent()
+        if parent is None:
+            path.append(elem.tag)
+        else:
+            if parent not in steps:
+                steps[parent] = left_steps(parent)
+            path.append(steps[parent].get(elem, elem.tag))
+        elem = parent
+    return '/' + '/'.join(reversed(path))
+
+
+def changed_elements(tree_diff):
+    """
+    Returns: a generator of the changed elements of a diff xml tree in document order
+    """
+    return (elem for elem in tree_diff.iter() if elem.get('change') in DIFF_SYMBOLS)
+
+
+def render_text(tree_diff, keys, labels):
+    """
+    Render the same lines as pyocnos.diff.build_xml_diff.
+
+    Args:
+        tree_diff: lxml.etree.Element
+        keys: mapping of xml elements to their key elements
+        labels: not shown in this format
+
+    Returns: a generator of lines
+    """
+    # pylint: disable=unused-argument
+    return iter_rrender(tree_diff, keys=keys)
+
+
+def render_jsonl(tree_diff, keys, labels):
+    """
+    Render one JSON object per changed element, e.g.
+    {"change": "removed", "path": "/data/vr/vrId[1]", "xml": "<vrId>1</vrId>"}
+
+    Args:
+        tree_diff: lxml.etree.Element
+        keys: not needed in this format, as the path identifies the element
+        labels: not shown in this format
+
+    Returns: a generator of lines
+    """
+    # pylint: disable=unused-argument
+    steps = {}
+    for elem in changed_elements(tree_diff):
+        yield json.dumps({
+            'change': elem.get('change'),
+            'path': left_path(elem, steps),
+            'xml': changed_element_xml(elem, pretty_print=False),
+        })
+
+
+def render_unified(tree_diff, keys, labels):
+    """
+    Render a hunk for every element with changed children, headed by its path
+    and listing its key elements as context, e.g.
+    --- left
+    +++ right
+    @@ /data/vr @@
+      <vrId>1</vrId>
+    - <vrHostname>foo</vrHostname>
+    + <vrHostname>bar</vrHostname>
+
+    Args:
+        tree_diff: lxml.etree.Element
+        keys: mapping of xml elements to their key elements
+        labels: tuple of the names of the left and the right tree
+
+    Returns: a generator of lines
+    """
+    changed = changed_ancestors(tree_diff)
+    if not changed:
+        return
+    yield '--- {}'.format(labels[0])
+    yield '+++ {}'.format(labels[1])
+    steps = {}
+    for parent in tree_diff.iter():
+        if parent not in changed or not any(elem.get('change') in DIFF_SYMBOLS for elem in parent):
+            continue
+        parent_keys = set(itertools.chain(*keys.get(parent.tag, [])))
+        yield '@@ {} @@'.format(left_path(parent, steps))
+        for elem in parent:
+            change_type = elem.get('change')
+            if change_type in DIFF_SYMBOLS:
+                for xml in changed_element_xml(elem).splitlines():
+                    yield '{} {}'.format(DIFF_SYMBOLS[change_type], xml)
+            elif elem.tag in parent_keys:
+                yield '  {}'.format(etree.tostring(elem).decode('utf-8'))
+
+
+RENDERERS = {
+    'text': render_text,
+    'jsonl': render_jsonl,
+    'unified': render_unified,
+}
+
+
+def register_renderer(name, renderer):
+    """
+    Add an output format, or replace one.
+
+    Args:
+        name: (String) name of the output format
+        renderer: function taking a diff xml tree, the mapping of xml elements to their key elements and the labels
+                  of the left and the right tree, returning an iterable of lines
+    """
+    RENDERERS[name] = renderer
+
+
+def get_renderer(output_format):
+    """
+    Returns: the renderer of an output format
+    Raises: ValueError if the output format is unknown
+    """
+    renderer = RENDERERS.get(output_format)
+    if renderer is None:
+        raise ValueError('Unknown output format {}, expected one of {}'.format(
+            output_format, ', '.join(sorted(RENDERERS))))
+    return renderer
+
+
+def render(tree_diff, output_format='text', keys=None, labels=DEFAULT_LABELS):
+    """
+    Render a diff xml tree in an output format.
+
+    Args:
+        tree_diff: lxml.etree.Element
+        output_format: (String) name of the output format, see RENDERERS
+        keys: mapping of xml elements to their key elements, ELEMENTS_WITH_FIXED_KEYS if not given
+        labels: tuple of the names of the left and the right tree
+
+    Returns: an iterator of lines
+    Raises: ValueError if the output format is unknown
+    """
+    return iter(get_renderer(output_format)(tree_diff, ELEMENTS_WITH_FIXED_KEYS if keys is None else keys, labels))
+
+
+def iter_xml_diff(xmlstring_left, xmlstring_right, keys=None, workers=None, *, output_format='text',
+                  labels=DEFAULT_LABELS, stats=None):
+    """
+    Diff two xml trees like pyocnos.diff.build_xml_diff, but render the diff
+    line by line in an output format.
+
+    Args:
+        xmlstring_left: serialised xml or lxml.etree.Element
+        xmlstring_right: serialised xml or lxml.etree.Element
+        keys: see pyocnos.diff.build_xml_diff
+        workers: see pyocnos.diff.build_xml_diff
+        output_format: (String) name of the output format, see RENDERERS
+        labels: tuple of the names of the left and the right tree
+        stats: see pyocnos.diff.build_xml_diff, without the time of rendering the lines as they are iterated
+
+    Returns: an iterator of lines, empty if there are no differences
+    Raises: ValueError if the output format is unknown
+    """
+    # pylint: disable=too-many-arguments
+    get_renderer(output_format)
+    left, right = prepare_pair(xmlstring_left, xmlstring_right, stats)
+    tree_diff = diff_tree_prepared(left, right, keys, workers, stats=stats)
+    if tree_diff is None:
+        return iter(())
+    return render(tree_diff, output_format, keys, labels)
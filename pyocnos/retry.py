@@ -0,0 +1,172 @@
+"""
+This module retries device operations failing for a transient reason, e.g. a
+SSH handshake failing under load or the candidate datastore locked by another
+session.
+
+A RetryPolicy tells which failures are worth another attempt, by the
+error-tag of the rpc-errors of the device or by the class of the ncclient
+error, and how long to wait before the next attempt: exponentially longer
+after each attempt, with full jitter, until the number of attempts or the
+total deadline is reached. A lost SSH session fails every later rpc on it, so
+only opening a session is tried again after it.
+
+Usage:
+ > from pyocnos.ocnos import OCNOS
+ > from pyocnos.retry import retry_policies
+ > device = OCNOS('switch1', 'username', 'password', retry=retry_policies(attempts=5, deadline=120))
+"""
+import random
+from time import monotonic
+from time import sleep
+
+from pyocnos.exceptions import rpc_error_details
+from pyocnos.metrics import COMMIT
+from pyocnos.metrics import CONNECT
+from pyocnos.metrics import FETCH
+
+# Operation classes with a retry policy of their own, besides the ones timed by
+# the CLI
+SAVE = 'save'
+OPERATIONS = (CONNECT, FETCH, COMMIT, SAVE)
+
+# Error tags of rpc-errors of a busy device, see RFC 6241 appendix A
+RETRYABLE_TAGS = frozenset(['lock-denied', 'in-use', 'resource-denied'])
+
+# Classes of ncclient errors of a failed or lost SSH session. An
+# AuthenticationError is not one of them, trying again would not help.
+SESSION_ERRORS = frozenset(['SSHError', 'SessionCloseError'])
+RETRYABLE_ERRORS = SESSION_ERRORS
+
+# An rpc timing out is retried only if it has no effect on the config
+RETRYABLE_READ_ERRORS = RETRYABLE_ERRORS | frozenset(['TimeoutExpiredError'])
+
+
+class RetryPolicy:
+    """
+    When and how often to try an operation again. The default policy tries
+    once only.
+    """
+
+    __slots__ = ('attempts', 'base_delay', 'max_delay', 'deadline', 'retryable_tags', 'retryable_errors')
+
+    def __init__(self, attempts=1, base_delay=1.0, max_delay=30.0, deadline=None, *, retryable_tags=RETRYABLE_TAGS,
+                 retryable_errors=RETRYABLE_ERRORS):
+        """
+        Args:
+            attempts: (int) Maximum number of attempts, including the first one
+            base_delay: (float) Upper bound of the delay in seconds after the first attempt, doubled after each
+                        further attempt
+            max_delay: (float) Upper bound of any delay in seconds
+            deadline: (float) Seconds after the first attempt after which no attempt is started, unlimited if None
+            retryable_tags: set of error-tags of rpc-errors to try again
+            retryable_errors: set of class names of exceptions to try again
+        """
+        # pylint: disable=too-many-arguments
+        if attempts < 1:
+            raise ValueError('A retry policy needs at least one attempt.')
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retryable_tags = frozenset(retryable_tags)
+        self.retryable_errors = frozenset(retryable_errors)
+
+    def is_retryable(self, exception):
+        """
+        Whether an operation failing with an exception is worth another
+        attempt. Rpc-errors are retried if all their error-tags are retryable,
+        other exceptions if their class or a base class is. The rpc-errors of
+        an OCNOSError are the ones of the ncclient error it wraps.
+
+        Args:
+            exception: e.g. ncclient.NCClientError or pyocnos.exceptions.OCNOSError
+
+        Returns: bool
+        """
+        rpc_errors = getattr(exception, 'rpc_errors', None) or rpc_error_details(exception)
+        if rpc_errors:
+            return all(error.tag in self.retryable_tags for error in rpc_errors)
+        return any(cls.__name__ in self.retryable_errors for cls in type(exception).__mro__)
+
+    def delay(self, attempt):
+        """
+        Time to wait after a failed attempt, a random fraction of the
+        exponential backoff, so many clients failing together do not retry
+        together.
+
+        Args:
+            attempt: (int) number of the failed attempt, starting from 1
+
+        Returns: (float) seconds
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, func, on_retry=None, in_session=False):
+        """
+        Call a function until it succeeds, fails with an exception not worth
+        another attempt, or no attempt is left.
+
+        Args:
+            func: callable without arguments
+            on_retry: callable taking the number of the failed attempt, the exception and the delay, called before
+                      waiting for the next attempt
+            in_session: (bool) whether func runs rpcs on an open session, which are not tried again once the
+                        session is lost, see is_session_error()
+
+        Returns: the result of func
+        Raises: the exception of the last attempt
+        """
+        start = monotonic()
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as exception:  # pylint: disable=broad-except
+                if attempt >= self.attempts or not self.is_retryable(exception) or (
+                        in_session and is_session_error(exception)):
+                    raise
+                delay = self.delay(attempt)
+                if self.deadline is not None and monotonic() + delay - start > self.deadline:
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, exception, delay)
+            sleep(delay)
+            attempt += 1
+
+
+def is_session_error(exception):
+    """
+    Whether an exception tells the SSH session is lost, see SESSION_ERRORS.
+
+    Args:
+        exception: e.g. ncclient.NCClientError
+
+    Returns: bool
+    """
+    return any(cls.__name__ in SESSION_ERRORS for cls in type(exception).__mro__)
+
+
+# Policy of operations not given a policy
+NO_RETRY = RetryPolicy()
+
+
+def retry_policies(attempts, deadline=None, base_delay=1.0, max_delay=30.0):
+    """
+    Create the policies of all operation classes with the same backoff. Timed
+    out rpcs are only retried when fetching configs.
+
+    Args:
+        attempts: (int) Maximum number of attempts of each operation
+        deadline: (float) Seconds after which no attempt is started
+        base_delay: (float) see RetryPolicy
+        max_delay: (float) see RetryPolicy
+
+    Returns: dictionary of operation classes to RetryPolicy
+    """
+    return {
+        operation: RetryPolicy(
+            attempts, base_delay, max_delay, deadline,
+            retryable_errors=RETRYABLE_READ_ERRORS if operation == FETCH else RETRYABLE_ERRORS
+        )
+        for operation in OPERATIONS
+    }
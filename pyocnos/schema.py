@@ -0,0 +1,224 @@
+"""
+This module discovers the keys of list elements from the YANG modules a device
+advertises, so that pyocnos.diff can pair list entries by their keys instead of
+falling back to similarity matching for lists missing in
+pyocnos.diff.ELEMENTS_WITH_FIXED_KEYS.
+
+A YANG list declares its keys like this:
+  list interface {
+    key "name";
+    leaf name { type string; }
+    ...
+  }
+which here results in {'interface': [('name',)]}, the same form as
+ELEMENTS_WITH_FIXED_KEYS. The diff knows lists by their name only, so lists of
+the same name with different keys, e.g. in two modules, are left out, see
+unambiguous_keys.
+
+The discovered keys are cached in a json file per schema set, because fetching
+all modules with 'get-schema' takes a while and they only change with an
+upgrade of OcNOS.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+# Tokens of the YANG syntax (RFC 7950 section 6), comments and white spaces are
+# matched to be skipped.
+YANG_TOKEN = re.compile(r'''
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<dquoted>"(?:[^"\\]|\\.)*")
+  | (?P<squoted>'[^']*')
+  | (?P<symbol>[{};+])
+  | (?P<unquoted>[^\s{};"']+)
+''', re.VERBOSE | re.DOTALL)
+
+ESCAPES = {'n': '\n', 't': '\t', '"': '"', '\\': '\\'}
+
+
+def tokenize_yang(text):
+    """
+    Split a YANG module into keywords, arguments and the symbols '{', '}' and
+    ';'. Quoted strings are unquoted and strings concatenated with '+' joined.
+
+    Args:
+        text: (String) content of a YANG module
+
+    Returns: a list of tuple (is_symbol, String)
+    """
+    tokens = []
+    concatenate = False
+    for match in YANG_TOKEN.finditer(text):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'skip':
+            continue
+        if kind == 'symbol' and value == '+' and tokens:
+            concatenate = True
+            continue
+        if kind == 'dquoted':
+            value = re.sub(r'\\(.)', lambda escaped: ESCAPES.get(escaped.group(1), escaped.group()), value[1:-1])
+        elif kind == 'squoted':
+            value = value[1:-1]
+
+        if concatenate and kind in ('dquoted', 'squoted'):
+            tokens[-1] = (False, tokens[-1][1] + value)
+        else:
+            tokens.append((kind == 'symbol', value))
+        concatenate = False
+    return tokens
+
+
+def parse_yang(text):
+    """
+    Collect the keys of all lists and the included submodules of a YANG
+    module.
+
+    Args:
+        text: (String) content of a YANG module or submodule
+
+    Returns: tuple of
+        a dictionary like this {'interface': [('name',)]}
+        a list of names of included submodules
+    """
+    keys = {}
+    includes = []
+    # Enclosing statements of the current one, as (keyword, argument)
+    stack = []
+    statement = []
+    for is_symbol, token in tokenize_yang(text):
+        if not is_symbol:
+            statement.append(token)
+            continue
+        keyword, argument = (statement + [None, None])[:2]
+        if token in '{;' and keyword is not None:
+            if keyword == 'key' and argument and stack and stack[-1][0] == 'list':
+                key = tuple(name.split(':')[-1] for name in argument.split())
+                options = keys.setdefault(stack[-1][1], [])
+                if key not in options:
+                    options.append(key)
+            elif keyword == 'include' and argument:
+                includes.append(argument)
+            if token == '{':
+                stack.append((keyword, argument))
+        elif token == '}' and stack:
+            stack.pop()
+        statement = []
+    return keys, includes
+
+
+def merge_keys(*key_maps):
+    """
+    Merge dictionaries of list keys. Key options are kept in order of the given
+    dictionaries without duplicates, so options of the earlier ones are tried
+    first by pyocnos.diff.element_keys_zip.
+
+    Returns: a dictionary like this {'interface': [('ifName',), ('name',)]}
+    """
+    result = {}
+    for key_map in key_maps:
+        for tag, options in key_map.items():
+            merged = result.setdefault(tag, [])
+            merged.extend(tuple(option) for option in options if tuple(option) not in merged)
+    return result
+
+
+def unambiguous_keys(keys):
+    """
+    Leave out the lists whose name is declared with different keys, e.g. by
+    two modules. The keys of one of them would be applied to the entries of
+    the other, which then may not be unique by those keys.
+
+    Args:
+        keys: a dictionary like this {'interface': [('name',)]}, as merged
+              from parse_yang
+
+    Returns: tuple of
+        the dictionary without those lists
+        a sorted list of the names of those lists
+    """
+    conflicts = sorted(tag for tag, options in keys.items() if len(options) > 1)
+    return {tag: options for tag, options in keys.items() if len(options) == 1}, conflicts
+
+
+def capability_modules(capabilities):
+    """
+    Extract the YANG modules from the capabilities advertised in the NETCONF
+    hello of a device, e.g.
+    'http://ipinfusion.com/ns/zebmcli?module=ipi-interface&revision=2018-01-01'
+
+    Args:
+        capabilities: iterable of capability URIs
+
+    Returns: a sorted list of tuple (module, revision), revision might be None
+    """
+    modules = set()
+    for capability in capabilities:
+        parameters = parse_qs(urlparse(str(capability)).query)
+        if 'module' in parameters:
+            modules.add((parameters['module'][0], parameters.get('revision', [None])[0]))
+    return sorted(modules, key=lambda module: (module[0], module[1] or ''))
+
+
+def schema_version(modules):
+    """
+    Identify a set of YANG modules. Devices running the same OcNOS version
+    advertise the same modules and revisions, so they share the same
+    identity and the cached keys.
+
+    Args:
+        modules: list of tuple (module, revision)
+
+    Returns: String
+    """
+    content = '\n'.join('{}@{}'.format(module, revision or '') for module, revision in modules)
+    return hashlib.sha224(content.encode()).hexdigest()
+
+
+def default_cache_dir():
+    """
+    The directory keeping the discovered keys, following the XDG base
+    directory specification.
+
+    Returns: String
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pyocnos')
+
+
+def cache_path(cache_dir, version):
+    """ File keeping the keys of one schema version """
+    return os.path.join(cache_dir, 'list-keys-{}.json'.format(version))
+
+
+def load_cached_keys(cache_dir, version):
+    """
+    Read keys discovered before for a schema version.
+
+    Returns: a dictionary like this {'interface': [('name',)]} or None if not
+             cached
+    """
+    try:
+        with io.open(cache_path(cache_dir, version), 'r', encoding='utf-8') as cache_file:
+            cached = json.load(cache_file)
+    except (IOError, ValueError):
+        return None
+    return {tag: [tuple(option) for option in options] for tag, options in cached.items()}
+
+
+def save_cached_keys(cache_dir, version, keys):
+    """
+    Store discovered keys of a schema version.
+
+    Returns: None
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, version)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with io.open(tmp_path, 'w', encoding='utf-8') as cache_file:
+        json.dump(keys, cache_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
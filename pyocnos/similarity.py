@@ -6,11 +6,21 @@ Ref:
 J. Long, D. G. Schwartz, and S. Stoecklin, An XML Distance Measure, conference
 paper on the 2005 International Conference on Data Mining, 2005
 https://pdfs.semanticscholar.org/0d15/2846fd30a6898ac518d894c7070ba1ddc44a.pdf
+
+The algorithm runs on nodes of pyocnos.compact.CompactTree, see class
+NodeSimilarity, the functions taking lxml elements build compact trees of
+their arguments first.
 """
 from __future__ import division
 
+from collections import Counter
+from collections import defaultdict
+from collections import OrderedDict
+
 from munkres import Munkres
 
+from .compact import CompactTree
+
 # A small enough value only to state for a similarity between XML elements
 # like:
 # <foo>100</foo>
@@ -19,6 +29,16 @@ from munkres import Munkres
 # tag name in common.
 A_INFINITESIMAL_SIMILARITY = 0.0001
 
+# Lists of siblings to match are split into blocks of candidates sharing some
+# content before running the hungarian algorithm, once the full cost matrix
+# would have more cells than this.
+BLOCKING_MIN_CELLS = 400
+
+# Content shared by more siblings than this on either side, e.g.
+# <version>2c</version> in every snmp host, does not tell which siblings are
+# alike, so it is not used to build blocks.
+BLOCKING_MAX_FEATURE_FREQUENCY = 4
+
 
 def hungarian_algorithm(iter_a, iter_b):
     """
@@ -43,10 +63,8 @@ def hungarian_algorithm(iter_a, iter_b):
                  e.g., for the above example, the indexes would be
                  [(0, 1), (1, 2)]
     """
-    cost_matrix = [[(1 - similarity_element(elem_a, elem_b))
-                    for elem_b in iter_b] for elem_a in iter_a]
-    indexes = Munkres().compute(cost_matrix)
-    return cost_matrix, indexes
+    tree_a, tree_b = CompactTree.pair(list(iter_a), list(iter_b))
+    return NodeSimilarity(tree_a, tree_b).hungarian(range(len(tree_a.roots)), range(len(tree_b.roots)))
 
 
 def similarity_element(elem_a, elem_b):
@@ -123,20 +141,8 @@ def similarity_element(elem_a, elem_b):
     same structure, the diffing can go deeper layer and only compare the host
     element, and thus the diff result would be much clearer.
     """
-    if elem_a.tag != elem_b.tag:
-        return 0
-
-    similarity_v = similarity_value(elem_a, elem_b)
-
-    if len(elem_a) == 0 and len(elem_b) == 0:
-        if similarity_v:
-            return similarity_v
-        return A_INFINITESIMAL_SIMILARITY
-
-    if len(elem_a) == 0 or len(elem_b) == 0:
-        return A_INFINITESIMAL_SIMILARITY
-
-    return similarity_array(elem_a, elem_b)
+    tree_a, tree_b = CompactTree.pair([elem_a], [elem_b])
+    return NodeSimilarity(tree_a, tree_b).element(0, 0)
 
 
 def similarity_value(elem_a, elem_b):
@@ -153,12 +159,8 @@ def similarity_array(iter_a, iter_b):
     which generally are child elements of other nodes.
     This function and similarity_element recursively calles each other.
     """
-    matrix, indexes = hungarian_algorithm(iter_a, iter_b)
-    # Bear in mind the matrix returned from hungarian algorithm is distnacee
-    # (i.e. cost actually) but we need similarity here.
-    similarity_sum = (min(len(iter_a), len(iter_b))
-                      - sum(matrix[row][column] for row, column in indexes))
-    return similarity_sum/max(len(iter_a), len(iter_b))
+    tree_a, tree_b = CompactTree.pair(list(iter_a), list(iter_b))
+    return NodeSimilarity(tree_a, tree_b).array(range(len(tree_a.roots)), range(len(tree_b.roots)))
 
 
 def isclose(float_a, float_b, rel_tol=1e-9, abs_tol=0.0):
@@ -178,8 +180,331 @@ def similarity_indexes(iter_a, iter_b):
     being yild here with the first element in iter_b even they are totally
     different, and the user will see their diff, and got confused.
     """
-    matrix, indexes = hungarian_algorithm(list(iter_a), list(iter_b))
-    for row, column in indexes:
-        if isclose(matrix[row][column], 1, abs_tol=A_INFINITESIMAL_SIMILARITY/2):
-            continue
-        yield (row, column)
+    tree_a, tree_b = CompactTree.pair(list(iter_a), list(iter_b))
+    yield from NodeSimilarity(tree_a, tree_b).indexes(range(len(tree_a.roots)), range(len(tree_b.roots)))
+
+
+class NodeSimilarity:
+    """
+    The similarity algorithm on nodes of two compact trees, i.e.
+    pyocnos.compact.CompactTree sharing one symbol table. See
+    similarity_element for the algorithm.
+
+    Identical subtrees, i.e. nodes with the same hash, have similarity 1
+    without looking into their children. The similarity of two nodes with
+    children is cached by the hashes of both, so it is calculated only once
+    even though the diff asks for it again at each deeper level, and the
+    cache stays valid for any other trees.
+    """
+
+    __slots__ = ('tree_a', 'tree_b', 'cache', 'stats')
+
+    def __init__(self, tree_a, tree_b, cache=None, stats=None):
+        """
+        Args:
+            tree_a: CompactTree
+            tree_b: CompactTree
+            cache: OrderedDict of similarities to share with other instances,
+                   in order of their last use
+            stats: pyocnos.diffstats.DiffStats to count the cache hits and
+                   the runs of the hungarian algorithm in
+        """
+        self.tree_a = tree_a
+        self.tree_b = tree_b
+        self.cache = OrderedDict() if cache is None else cache
+        self.stats = stats
+
+    def element(self, node_a, node_b, threshold=None):
+        """
+        Similarity of a node of tree_a and a node of tree_b.
+
+        Args:
+            node_a: node of tree_a
+            node_b: node of tree_b
+            threshold: see array
+
+        Returns: float in scope [0, 1]
+        """
+        tree_a, tree_b = self.tree_a, self.tree_b
+        if tree_a.tags[node_a] != tree_b.tags[node_b]:
+            return 0
+
+        hash_a = tree_a.hashes[node_a]
+        hash_b = tree_b.hashes[node_b]
+        if hash_a == hash_b:
+            return 1
+
+        leaf_a = tree_a.is_leaf(node_a)
+        leaf_b = tree_b.is_leaf(node_b)
+        if leaf_a and leaf_b:
+            if tree_a.texts[node_a] == tree_b.texts[node_b]:
+                return 1
+            return A_INFINITESIMAL_SIMILARITY
+
+        if leaf_a or leaf_b:
+            return A_INFINITESIMAL_SIMILARITY
+
+        similarity = self.cache.get((hash_a, hash_b))
+        if similarity is not None:
+            self.cache.move_to_end((hash_a, hash_b))
+        if self.stats is not None:
+            if similarity is None:
+                self.stats.similarity_cache_misses += 1
+            else:
+                self.stats.similarity_cache_hits += 1
+        if similarity is None:
+            similarity = self.array(tree_a.children(node_a), tree_b.children(node_b), threshold)
+            if threshold is None or similarity > threshold:
+                self.cache[(hash_a, hash_b)] = similarity
+        return similarity
+
+    def exceeds(self, node_a, node_b, threshold):
+        """
+        Whether the similarity of a node of tree_a and a node of tree_b is
+        above the threshold, without calculating it if the bounds of it tell.
+
+        Returns: bool
+        """
+        tree_a, tree_b = self.tree_a, self.tree_b
+        if (tree_a.tags[node_a] == tree_b.tags[node_b] and not tree_a.is_leaf(node_a)
+                and not tree_b.is_leaf(node_b) and tree_a.hashes[node_a] != tree_b.hashes[node_b]
+                and (tree_a.hashes[node_a], tree_b.hashes[node_b]) not in self.cache):
+            lower, _ = self.bounds(tree_a.children(node_a), tree_b.children(node_b))
+            if lower > threshold:
+                return True
+        return self.element(node_a, node_b, threshold) > threshold
+
+    def bounds(self, nodes_a, nodes_b):
+        """
+        Lower and upper bound of the similarity of two lists of nodes, see
+        array, from the tags and the texts of leaves only.
+
+        Pairs of nodes with the same tag are counted per tag. Leaves with the
+        same tag and text and identical subtrees have similarity 1, other
+        pairs of leaves with the same tag A_INFINITESIMAL_SIMILARITY, so
+        matching these is a lower bound. Further pairs with a similarity up to
+        1 can only be those of nodes with children, which gives an upper
+        bound. Both are equal if there are no such further pairs, notably if
+        all nodes are leaves.
+
+        Returns: tuple of float (lower, upper)
+        """
+        lower, upper = self.pair_counts(self.summary(self.tree_a, nodes_a), self.summary(self.tree_b, nodes_b))
+        length = max(len(nodes_a), len(nodes_b))
+        return tuple((heavy + light * A_INFINITESIMAL_SIMILARITY) / length for heavy, light in (lower, upper))
+
+    @staticmethod
+    def pair_counts(summary_a, summary_b):
+        """
+        Count the pairs with similarity up to 1 and those with similarity
+        A_INFINITESIMAL_SIMILARITY for both bounds, see bounds.
+
+        Args:
+            summary_a: summary of nodes of tree_a
+            summary_b: summary of nodes of tree_b
+
+        Returns: tuple of list [pairs up to 1, other pairs] (lower, upper)
+        """
+        counts_b = summary_b[0]
+        equal_texts = Counter()
+        for (tag, _), count in (summary_a[1] & summary_b[1]).items():
+            equal_texts[tag] += count
+
+        lower = [sum((summary_a[2] & summary_b[2]).values()), 0]
+        upper = [0, 0]
+        for tag, (leaves_a, inner_a) in summary_a[0].items():
+            leaves_b, inner_b = counts_b.get(tag, (0, 0))
+            pairs = min(leaves_a + inner_a, leaves_b + inner_b)
+            heavy = min(pairs, equal_texts[tag] + min(inner_a, inner_b))
+            lower[0] += equal_texts[tag]
+            lower[1] += min(leaves_a, leaves_b) - equal_texts[tag]
+            upper[0] += heavy
+            upper[1] += pairs - heavy
+        return lower, upper
+
+    @staticmethod
+    def summary(tree, nodes):
+        """
+        Count the given nodes for bounds.
+
+        Returns: tuple of
+            a dictionary like this {tag id: (number of leaves, number of
+            others)}
+            Counter of (tag id, text id) of the leaves
+            Counter of hashes of the others
+        """
+        leaves = Counter()
+        inner = Counter()
+        texts = Counter()
+        hashes = Counter()
+        for node in nodes:
+            if tree.is_leaf(node):
+                leaves[tree.tags[node]] += 1
+                texts[(tree.tags[node], tree.texts[node])] += 1
+            else:
+                inner[tree.tags[node]] += 1
+                hashes[tree.hashes[node]] += 1
+        counts = {tag: (leaves[tag], inner[tag]) for tag in set(leaves) | set(inner)}
+        return counts, texts, hashes
+
+    def hungarian(self, nodes_a, nodes_b):
+        """
+        See hungarian_algorithm.
+
+        Args:
+            nodes_a: sequence of nodes of tree_a
+            nodes_b: sequence of nodes of tree_b
+
+        Returns: tuple of cost matrix and indexes
+        """
+        if self.stats is not None:
+            self.stats.record_hungarian(len(nodes_a), len(nodes_b))
+        cost_matrix = [[(1 - self.element(node_a, node_b))
+                        for node_b in nodes_b] for node_a in nodes_a]
+        indexes = Munkres().compute(cost_matrix)
+        return cost_matrix, indexes
+
+    def array(self, nodes_a, nodes_b, threshold=None):
+        """
+        See similarity_array.
+
+        The hungarian algorithm runs only if the bounds of the similarity
+        differ, see bounds.
+
+        Args:
+            nodes_a: sequence of nodes of tree_a
+            nodes_b: sequence of nodes of tree_b
+            threshold: if given, the similarity is exact above it only. As
+                       soon as the upper bound does not exceed it, this upper
+                       bound is returned instead.
+
+        Returns: float in scope [0, 1]
+        """
+        lower, upper = self.bounds(nodes_a, nodes_b)
+        if lower == upper or (threshold is not None and upper <= threshold):
+            return upper
+
+        matrix, indexes = self.hungarian(nodes_a, nodes_b)
+        # Bear in mind the matrix returned from hungarian algorithm is distnacee
+        # (i.e. cost actually) but we need similarity here.
+        similarity_sum = (min(len(nodes_a), len(nodes_b))
+                          - sum(matrix[row][column] for row, column in indexes))
+        return similarity_sum/max(len(nodes_a), len(nodes_b))
+
+    def indexes(self, nodes_a, nodes_b):
+        """
+        See similarity_indexes.
+
+        Large lists are matched block by block, see blocked_indexes.
+
+        Returns: a generator of tuple (index in nodes_a, index in nodes_b)
+        """
+        if len(nodes_a) * len(nodes_b) > BLOCKING_MIN_CELLS:
+            yield from self.blocked_indexes(nodes_a, nodes_b)
+            return
+        matrix, indexes = self.hungarian(nodes_a, nodes_b)
+        for row, column in indexes:
+            if isclose(matrix[row][column], 1, abs_tol=A_INFINITESIMAL_SIMILARITY/2):
+                continue
+            yield (row, column)
+
+    def features(self, tree, node):
+        """
+        Cheap signature of a node: its own text for a leaf, otherwise the tags
+        and texts of its leaf children and the hashes of its other children.
+
+        Returns: list of hashable features
+        """
+        if tree.is_leaf(node):
+            return [(-1, tree.texts[node])]
+        return [(tree.tags[child], tree.texts[child]) if tree.is_leaf(child) else (-2, tree.hashes[child])
+                for child in tree.children(node)]
+
+    def feature_members(self, nodes_a, nodes_b):
+        """
+        Index the given nodes by their features. Indexes into nodes_a are kept
+        as they are and those into nodes_b shifted by len(nodes_a).
+
+        Returns: a dictionary like this {feature: ([index], [index])}
+        """
+        members = defaultdict(lambda: ([], []))
+        for side, (tree, nodes) in enumerate(((self.tree_a, nodes_a), (self.tree_b, nodes_b))):
+            shift = len(nodes_a) * side
+            for index, node in enumerate(nodes):
+                for feature in set(self.features(tree, node)):
+                    members[feature][side].append(index + shift)
+        return members
+
+    def blocks(self, nodes_a, nodes_b):
+        """
+        Split the given nodes into blocks, so that nodes sharing a
+        discriminative feature are in the same block. It is the connected
+        components of the graph where nodes with a common feature are linked.
+
+        Returns: a list of tuple ([index in nodes_a], [index in nodes_b]) in
+                 order of their first index in nodes_a
+        """
+        # Indexes as of feature_members, to share one union find structure
+        shift = len(nodes_a)
+        parents = list(range(shift + len(nodes_b)))
+
+        def find(index):
+            while parents[index] != index:
+                parents[index] = parents[parents[index]]
+                index = parents[index]
+            return index
+
+        for indexes_a, indexes_b in self.feature_members(nodes_a, nodes_b).values():
+            if (not indexes_a or not indexes_b or len(indexes_a) > BLOCKING_MAX_FEATURE_FREQUENCY
+                    or len(indexes_b) > BLOCKING_MAX_FEATURE_FREQUENCY):
+                continue
+            root = find(indexes_a[0])
+            for index in indexes_a[1:] + indexes_b:
+                parents[find(index)] = root
+
+        components = defaultdict(lambda: ([], []))
+        for index in range(len(parents)):
+            side = int(index >= shift)
+            components[find(index)][side].append(index - shift * side)
+        return [component for component in components.values() if component[0] and component[1]]
+
+    def blocked_indexes(self, nodes_a, nodes_b):
+        """
+        Match nodes like indexes(), but solve the assignment within each block
+        of candidates sharing content, see blocks(), instead of for all nodes
+        at once. A node not matched to a similar one in its block, including
+        nodes not sharing any content with the other side, is matched in a
+        final pass amongst all such leftovers.
+
+        Returns: a generator of tuple (index in nodes_a, index in nodes_b) in
+                 order of index in nodes_a
+        """
+        matched = []
+        matched_a = set()
+        matched_b = set()
+        for block_a, block_b in self.blocks(nodes_a, nodes_b):
+            matrix, indexes = self.hungarian([nodes_a[i] for i in block_a], [nodes_b[j] for j in block_b])
+            for row, column in indexes:
+                # Leave a pair of nodes with nothing but the tag in common to the final pass
+                if matrix[row][column] < 1 - A_INFINITESIMAL_SIMILARITY * 1.5:
+                    matched.append((block_a[row], block_b[column]))
+                    matched_a.add(block_a[row])
+                    matched_b.add(block_b[column])
+
+        # Nodes without any counterpart which would pass the filter of
+        # indexes() are not matched at all, so they are left out of the final
+        # pass.
+        threshold = A_INFINITESIMAL_SIMILARITY / 2
+        leftovers_b = [j for j in range(len(nodes_b)) if j not in matched_b]
+        leftovers_a = [i for i in range(len(nodes_a)) if i not in matched_a and any(
+            self.exceeds(nodes_a[i], nodes_b[j], threshold) for j in leftovers_b)]
+        leftovers_b = [j for j in leftovers_b if any(
+            self.exceeds(nodes_a[i], nodes_b[j], threshold) for i in leftovers_a)]
+        if leftovers_a and leftovers_b:
+            matrix, indexes = self.hungarian([nodes_a[i] for i in leftovers_a], [nodes_b[j] for j in leftovers_b])
+            for row, column in indexes:
+                if isclose(matrix[row][column], 1, abs_tol=A_INFINITESIMAL_SIMILARITY/2):
+                    continue
+                matched.append((leftovers_a[row], leftovers_b[column]))
+
+        yield from sorted(matched)
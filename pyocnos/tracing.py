@@ -0,0 +1,252 @@
+"""
+This module traces where the time of a run goes, in spans like those of
+OpenTelemetry: a span times one operation, e.g. retrieving a config or
+diffing two trees, has attributes like the hostname or the size of the
+config, and is nested in the span of the operation it is part of. The span
+of retrieving a config contains the span of the NETCONF rpc, so the time
+spent on the device and the network is told apart from the time spent
+parsing.
+
+Tracing is off by default, every span is a no-op then. A Tracer hands its
+finished spans to an exporter: MemoryExporter keeps them in a list, e.g. for
+tests or to analyse them in the same process, FileExporter writes them to a
+file, one JSON object per line, without any external service.
+
+Spans nest per thread. The spans of a thread without an open span start a
+trace of their own, e.g. each device of an audit.
+
+Usage:
+ > from pyocnos import tracing
+ > exporter = tracing.FileExporter('trace.jsonl')
+ > tracing.set_tracer(tracing.Tracer(exporter))
+ > with tracing.span('ocnos.open', {'device.hostname': 'switch1'}) as span:
+ >     device.open()
+ >     span.set_attribute('device.connected', True)
+ > exporter.close()
+"""
+from contextlib import contextmanager
+import json
+import random
+import threading
+import time
+
+
+class Span:
+    """
+    A timed operation, see the module docstring. The start time is seconds
+    since the epoch, the duration is seconds.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'start_time', 'duration', 'error')
+
+    # Whether the span is recorded, so that attributes which are expensive to
+    # get are only got for recorded spans
+    recording = True
+
+    def __init__(self, name, trace_id, span_id, parent_id=None, attributes=None):
+        """
+        Args:
+            name: (String) name of the operation, e.g. 'ocnos.open'
+            trace_id: (String) 32 hex digits shared by the spans of a trace
+            span_id: (String) 16 hex digits
+            parent_id: (String) span_id of the span this one is nested in, None for the root of a trace
+            attributes: (dict) of attribute names to values, e.g. {'device.hostname': 'switch1'}
+        """
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.duration = None
+        # Exception class and message if the operation raised
+        self.error = None
+
+    def set_attribute(self, name, value):
+        """
+        Set an attribute of the span.
+
+        Args:
+            name: (String) attribute name, e.g. 'config.bytes'
+            value: a string, number or bool
+        """
+        self.attributes[name] = value
+
+    def to_dict(self):
+        """
+        Returns: (dict) of the span as exported to files, with times in nanoseconds like OTLP
+        """
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'start_time_unix_nano': int(self.start_time * 1e9),
+            'end_time_unix_nano': int((self.start_time + (self.duration or 0)) * 1e9),
+            'attributes': self.attributes,
+            'status': {'code': 'ERROR', 'message': self.error} if self.error else {'code': 'OK'},
+        }
+
+
+class NoopSpan:
+    """ Span of a tracer which records nothing """
+
+    __slots__ = ()
+
+    recording = False
+
+    def set_attribute(self, name, value):
+        """ See Span.set_attribute """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+# The one span of NoopTracer, its own context manager so a no-op span costs
+# next to nothing
+NOOP_SPAN = NoopSpan()
+
+
+class NoopTracer:
+    """ The tracer when tracing is off """
+
+    def span(self, name, attributes=None):  # pylint: disable=unused-argument
+        """ See Tracer.span """
+        return NOOP_SPAN
+
+
+class Tracer:
+    """ Create spans and hand them to an exporter once finished """
+
+    def __init__(self, exporter):
+        """
+        Args:
+            exporter: object with an export(span) method, e.g. MemoryExporter or FileExporter
+        """
+        self.exporter = exporter
+        self._local = threading.local()
+
+    def current(self):
+        """
+        Returns: the innermost open Span of the current thread, None if there is none
+        """
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name, attributes=None):
+        """
+        Context manager timing a span nested in the open span of the thread.
+
+        Args:
+            name: (String) name of the operation
+            attributes: (dict) of attribute names to values
+
+        Returns: Span
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        parent = stack[-1] if stack else None
+        opened = Span(
+            name,
+            '{:032x}'.format(random.getrandbits(128)) if parent is None else parent.trace_id,
+            '{:016x}'.format(random.getrandbits(64)),
+            None if parent is None else parent.span_id,
+            attributes,
+        )
+        stack.append(opened)
+        start = time.perf_counter()
+        try:
+            yield opened
+        except BaseException as exception:
+            opened.error = '{}: {}'.format(type(exception).__name__, exception)
+            raise
+        finally:
+            opened.duration = time.perf_counter() - start
+            stack.pop()
+            self.exporter.export(opened)
+
+
+class MemoryExporter:
+    """ Keep finished spans in a list """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, finished):
+        """
+        Args:
+            finished: Span
+        """
+        with self._lock:
+            self.spans.append(finished)
+
+    def find(self, name):
+        """
+        Returns: list of the spans of a name, in the order they finished
+        """
+        with self._lock:
+            return [finished for finished in self.spans if finished.name == name]
+
+
+class FileExporter:
+    """
+    Append finished spans to a file, one JSON object per line, see
+    Span.to_dict.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: (String) path of the file
+        """
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+
+    def export(self, finished):
+        """
+        Args:
+            finished: Span
+        """
+        line = json.dumps(finished.to_dict(), sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        """ Close the file """
+        with self._lock:
+            self._file.close()
+
+
+TRACER = NoopTracer()
+
+
+def set_tracer(tracer):
+    """
+    Set the tracer of the process, a NoopTracer to turn tracing off.
+
+    Args:
+        tracer: Tracer or NoopTracer
+    """
+    global TRACER  # pylint: disable=global-statement
+    TRACER = tracer
+
+
+def span(name, attributes=None):
+    """
+    Context manager of a span of the tracer of the process, see Tracer.span.
+    A no-op unless a Tracer is set, see set_tracer.
+
+    Returns: Span or NoopSpan
+    """
+    return TRACER.span(name, attributes)
@@ -0,0 +1,195 @@
+"""
+This module watches the running config of devices for changes made out of
+band, e.g. on the command line of a device.
+
+A watcher keeps the last known config of a device split into its top level
+containers, each prepared for the diff with the hash of its subtree, see
+pyocnos.diff.PreparedTree. Every poll retrieves the containers one by one with
+a subtree filter and compares their hashes with the known ones. Only changed
+containers are diffed, and a change event is yielded as soon as a container is
+found changed. Containers added to the config are found by retrieving the
+whole config every few polls.
+
+Usage:
+ > from pyocnos.ocnos import OCNOS
+ > from pyocnos.watch import ConfigWatcher
+ > with OCNOS('switch1', 'username', 'password') as device:
+ >     watcher = ConfigWatcher(device)
+ >     while True:
+ >         for event in watcher.poll():
+ >             print(event.container, event.change)
+ >             print(event.diff)
+ >         time.sleep(60)
+"""
+from collections import namedtuple
+from collections import OrderedDict
+from copy import deepcopy
+import logging
+import os
+
+from lxml import etree
+
+from pyocnos import LOGGER_NAME
+from pyocnos.diff import ADDED
+from pyocnos.diff import diff_prepared
+from pyocnos.diff import iter_rrender
+from pyocnos.diff import PreparedTree
+from pyocnos.diff import REMOVED
+from pyocnos.parsing import parse_xml
+
+# Change type of a container found in the last known and the retrieved config,
+# but with a different content
+CHANGED = 'changed'
+
+# Number of polls after which the whole config is retrieved by default
+DEFAULT_FULL_FETCH_EVERY = 10
+
+
+class ChangeEvent(namedtuple('ChangeEvent', ['hostname', 'container', 'change', 'diff'])):
+    """
+    Change of a top level container of the running config of a device: its
+    tag, the change type, i.e. added, removed or changed, and the diff.
+    """
+
+    __slots__ = ()
+
+
+def split_containers(config):
+    """
+    Split a config into its top level containers, each one prepared as a
+    config of its own.
+
+    Args:
+        config: (String) xml of the config, see OCNOS.get_config
+
+    Returns: OrderedDict of the tags, with name space, to pyocnos.diff.PreparedTree
+    """
+    root = parse_xml(config)
+    wrappers = OrderedDict()
+    for container in root.iterchildren('*'):
+        if container.tag not in wrappers:
+            wrappers[container.tag] = etree.Element(root.tag)
+        wrappers[container.tag].append(deepcopy(container))
+    return OrderedDict(
+        (tag, PreparedTree(wrapper)) for tag, wrapper in wrappers.items()
+    )
+
+
+def subtree_filter(tag):
+    """
+    Create a subtree filter retrieving one top level container.
+
+    Args:
+        tag: (String) tag of the container, with name space if it has one
+
+    Returns: (String) e.g. '<vr xmlns="http://www.ipinfusion.com/yang/ocnos/ipi-vr"/>'
+    """
+    qname = etree.QName(tag)
+    nsmap = {None: qname.namespace} if qname.namespace else None
+    return etree.tostring(etree.Element(tag, nsmap=nsmap)).decode()
+
+
+def render_container(prepared, change):
+    """
+    Render a whole container as added or removed, like a diff shows it.
+
+    Args:
+        prepared: pyocnos.diff.PreparedTree with the container
+        change: ADDED or REMOVED
+
+    Returns: diff in string
+    """
+    tree = deepcopy(prepared.tree)
+    for container in tree:
+        container.set('change', change)
+    return os.linesep.join(iter_rrender(tree))
+
+
+class ConfigWatcher:
+    """
+    Watch the running config of a device for changes. The first poll
+    retrieves the whole config to know it, the following ones yield the
+    changes since the previous poll.
+    """
+
+    def __init__(self, device, keys=None, full_fetch_every=DEFAULT_FULL_FETCH_EVERY):
+        """
+        Args:
+            device: opened pyocnos.ocnos.OCNOS
+            keys: mapping of xml elements to their key elements, see pyocnos.diff.build_xml_diff
+            full_fetch_every: (int) Number of polls after which the whole config is retrieved, to find added
+                              containers. 1 to retrieve the whole config by every poll.
+        """
+        self.device = device
+        self.keys = keys
+        self.full_fetch_every = full_fetch_every
+        # The last known config, None until the first poll
+        self.containers = None
+        self.polls = 0
+        # Similarities of the diffs of one poll, see pyocnos.similarity.NodeSimilarity
+        self.cache = OrderedDict()
+        self.log = logging.getLogger(LOGGER_NAME)
+
+    def fetch(self, subtree=None):
+        """
+        Retrieve the running config, or a part of it, split into containers.
+
+        Returns: OrderedDict like returned by split_containers()
+        """
+        return split_containers(self.device.get_config('running', subtree=subtree)['running'])
+
+    def poll(self):
+        """
+        Retrieve the running config and compare it with the last known one.
+        The last known config is updated container by container as the
+        events are yielded.
+
+        Returns: a generator of ChangeEvent
+        """
+        full_fetch = self.containers is None or self.polls % self.full_fetch_every == 0
+        self.polls += 1
+        if self.containers is None:
+            self.containers = self.fetch()
+            self.log.info('Watching %s containers of %s', len(self.containers), self.device.hostname)
+            return
+
+        try:
+            if full_fetch:
+                fetched = self.fetch()
+                for tag in list(self.containers):
+                    yield from self.compare(tag, fetched.get(tag))
+                for tag in fetched:
+                    if tag not in self.containers:
+                        yield from self.compare(tag, fetched[tag])
+            else:
+                for tag in list(self.containers):
+                    yield from self.compare(tag, self.fetch(subtree_filter(tag)).get(tag))
+        finally:
+            # The next poll diffs other versions of the containers, so the cache would only grow
+            self.cache.clear()
+
+    def compare(self, tag, fetched):
+        """
+        Compare a retrieved container with the last known one and keep it.
+
+        Args:
+            tag: (String) tag of the container
+            fetched: pyocnos.diff.PreparedTree with the container, None if not in the config anymore
+
+        Returns: a generator of ChangeEvent, empty if the container is the same
+        """
+        known = self.containers.get(tag)
+        name = etree.QName(tag).localname
+        if fetched is None:
+            if known is not None:
+                del self.containers[tag]
+                yield ChangeEvent(self.device.hostname, name, REMOVED, render_container(known, REMOVED))
+            return
+
+        self.containers[tag] = fetched
+        if known is None:
+            yield ChangeEvent(self.device.hostname, name, ADDED, render_container(fetched, ADDED))
+        elif known.compact.hashes[0] != fetched.compact.hashes[0]:
+            self.log.info('Container %s of %s changed', name, self.device.hostname)
+            yield ChangeEvent(self.device.hostname, name, CHANGED,
+                              diff_prepared(known, fetched, self.keys, cache=self.cache))
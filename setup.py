@@ -14,6 +14,7 @@ setup(
     py_modules=['pyocnos'],
     packages=find_packages(),
     install_requires=install_requires,
+    extras_require={'zstd': ['zstandard']},
     include_package_data=True,
     description='Python API to interact with network devices running OcNOS',
     author='LINX',
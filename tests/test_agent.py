@@ -0,0 +1,159 @@
+import os
+import socket
+import tempfile
+import threading
+from unittest import TestCase
+
+import mock
+
+from pyocnos.agent import AgentDevice
+from pyocnos.agent import AgentServer
+from pyocnos.agent import send_request
+from pyocnos.agent import SessionPool
+from pyocnos.exceptions import OCNOSAgentError
+from pyocnos.exceptions import OCNOSUnableToRetrieveConfigError
+from pyocnos.ocnos import OCNOS
+
+
+def create_device(hostname):
+    """ Mock OCNOS instance alive once opened """
+    device = mock.Mock(hostname=hostname)
+    device.alive = False
+    device.is_alive.side_effect = lambda: device.alive
+
+    def open_device():
+        device.alive = True
+
+    def close_device():
+        device.alive = False
+
+    device.open.side_effect = open_device
+    device.close.side_effect = close_device
+    device.get_config.side_effect = lambda retrieve, subtree=None: {retrieve: '<config/>'}
+    device.compare_config.return_value = '[config]'
+    return device
+
+
+def create_ocnos(hostname):
+    """ OCNOS instance with a mock connection once opened """
+    device = OCNOS(hostname=hostname, username='username', password='password')
+
+    def open_device():
+        device._connection = mock.MagicMock()
+
+    device.open = open_device
+    return device
+
+
+class TestAgent(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, 'agent.sock')
+        self.factory = mock.Mock(side_effect=create_device)
+        self.pool = SessionPool(self.factory, idle_timeout=60)
+        self.server = AgentServer(self.socket_path, self.pool)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.start()
+
+        def stop():
+            self.server.shutdown()
+            thread.join()
+            self.server.server_close()
+        self.addCleanup(stop)
+
+    def test_success_session_kept_open(self):
+        with AgentDevice('switch1', self.socket_path) as device:
+            self.assertEqual({'running': '<config/>'}, device.get_config('running'))
+            device.load_candidate_config(filename='candidate.xml')
+            self.assertEqual('[config]', device.compare_config())
+            self.assertEqual('[config]', device.compare_config(running='<config/>'))
+            device.commit_config(replace_config=True)
+            self.assertTrue(device.is_alive())
+
+        self.factory.assert_called_once_with('switch1')
+        opened = self.pool.sessions['switch1'].device
+        opened.open.assert_called_once_with()
+        opened.load_candidate_config.assert_called_with(filename=os.path.abspath('candidate.xml'), config=None)
+        opened.compare_config.assert_has_calls([mock.call(running=None), mock.call(running='<config/>')])
+        opened.commit_config.assert_called_once_with(replace_config=True)
+        self.assertEqual(0o600, os.stat(self.socket_path).st_mode & 0o777)
+
+    def test_success_session_opened_again_when_closed(self):
+        device = AgentDevice('switch1', self.socket_path)
+        device.is_alive()
+        opened = self.pool.sessions['switch1'].device
+        opened.alive = False
+        device.is_alive()
+        self.assertEqual(2, opened.open.call_count)
+
+    def test_success_close_idle(self):
+        AgentDevice('switch1', self.socket_path).is_alive()
+        opened = self.pool.sessions['switch1'].device
+        self.pool.close_idle(now=self.pool.sessions['switch1'].last_used + 30)
+        opened.close.assert_not_called()
+        self.pool.close_idle(now=self.pool.sessions['switch1'].last_used + 61)
+        opened.close.assert_called_once_with()
+        self.assertEqual({}, self.pool.sessions)
+
+    def test_success_concurrent_diffs_against_one_candidate(self):
+        self.factory.side_effect = create_ocnos
+        with tempfile.TemporaryDirectory() as directory:
+            candidate_path = os.path.join(directory, 'candidate.xml')
+            with open(candidate_path, 'w', encoding='utf-8') as candidate_file:
+                candidate_file.write('<config><vr><vrId>1</vrId></vr>{}</config>'.format(
+                    ''.join('<vlan><id>{0}</id><name>v{0}</name></vlan>'.format(i) for i in range(20))))
+            running = '<data><vr><vrId>1</vrId></vr><vlan><id>0</id><name>v0</name></vlan></data>'
+            results = []
+
+            def compare(hostname):
+                device = AgentDevice(hostname, self.socket_path)
+                device.load_candidate_config(filename=candidate_path)
+                results.extend(device.compare_config(running=running) for _ in range(20))
+
+            threads = [threading.Thread(target=compare, args=('switch{}'.format(i),)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(8, len(self.pool.sessions))
+        self.assertIn('+ <vlan>', results[0])
+        self.assertEqual(8 * 20, results.count(results[0]))
+
+    def test_fail_when_device_raises(self):
+        device = AgentDevice('switch1', self.socket_path)
+        device.is_alive()
+        opened = self.pool.sessions['switch1'].device
+        opened.get_config.side_effect = OCNOSUnableToRetrieveConfigError('Unable to retrieve running config.')
+        with self.assertRaises(OCNOSAgentError) as context:
+            device.get_config('running')
+        self.assertEqual('OCNOSUnableToRetrieveConfigError', context.exception.error)
+        self.assertIn('Unable to retrieve running config.', str(context.exception))
+
+    def test_fail_when_request_invalid(self):
+        with self.assertRaises(OCNOSAgentError) as context:
+            send_request({'action': 'reboot', 'hostname': 'switch1'}, self.socket_path)
+        self.assertEqual('ValueError', context.exception.error)
+
+    def test_fail_when_agent_already_listening(self):
+        self.assertRaises(OCNOSAgentError, AgentServer, self.socket_path, self.pool)
+
+
+class TestAgentSocket(TestCase):
+
+    def test_success_stale_socket_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, 'agent.sock')
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(socket_path)
+            stale.close()
+            server = AgentServer(socket_path, SessionPool(create_device))
+            server.server_close()
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_fail_when_agent_not_running(self):
+        with tempfile.TemporaryDirectory() as directory:
+            device = AgentDevice('switch1', os.path.join(directory, 'agent.sock'))
+            self.assertRaises(OCNOSAgentError, device.is_alive)
@@ -0,0 +1,150 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import mock
+from lxml import etree
+
+from pyocnos.audit import audit
+from pyocnos.audit import AuditResult
+from pyocnos.audit import load_template
+from pyocnos.audit import render_report
+from pyocnos.concurrency import ConcurrencyLimiter
+from pyocnos.diff import build_xml_diff
+from pyocnos.diff import DiffSession
+from pyocnos.exceptions import OCNOSConnectionError
+from pyocnos.exceptions import OCNOSLoadCandidateConfigFileReadError
+from pyocnos.metrics import Metrics
+
+ocnos_class_path = 'pyocnos.audit.OCNOS'
+
+TEMPLATE = '<config><vr><vrId>1</vrId></vr></config>'
+
+
+def running_configs(configs):
+    """ Mock OCNOS instances returning the running config of their hostname """
+    def create(hostname, **_):
+        device = mock.Mock()
+        if isinstance(configs[hostname], Exception):
+            device.open.side_effect = configs[hostname]
+        device.get_config.return_value = {'running': configs[hostname]}
+        return device
+    return create
+
+
+class TestLoadTemplate(TestCase):
+
+    def test_success(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'golden.xml')
+            with open(path, 'w', encoding='utf-8') as template_file:
+                template_file.write('<data>\n  <vr><vrId>1</vrId></vr>\n</data>')
+            template = load_template(path)
+        self.assertEqual('config', template.tree.tag)
+
+    def test_fail_when_file_does_not_exist(self):
+        self.assertRaises(OCNOSLoadCandidateConfigFileReadError, load_template, 'foo.xml')
+
+
+class TestAudit(TestCase):
+
+    @mock.patch(ocnos_class_path)
+    def test_success(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs({
+            'switch1': TEMPLATE,
+            'switch2': '<config><vr><vrId>2</vrId></vr></config>',
+            'switch3': OCNOSConnectionError('Unable to open ssh connection.'),
+        })
+        metrics = Metrics()
+        results = list(audit(['switch1', 'switch2', 'switch3'], TEMPLATE, 'username', 'password', workers=2,
+                             metrics=metrics))
+
+        self.assertEqual(['switch1', 'switch2', 'switch3'], [result.hostname for result in results])
+        self.assertEqual([True, False, False], [result.compliant for result in results])
+        self.assertEqual('', results[0].diff)
+        self.assertIn('-   <vrId>2</vrId>', results[1].diff)
+        self.assertIsInstance(results[2].error, OCNOSConnectionError)
+        self.assertEqual(1, metrics.exceptions.get(host='switch3', exception='OCNOSConnectionError'))
+        self.assertEqual(1, metrics.durations.count(host='switch2', operation='diff'))
+
+    @mock.patch(ocnos_class_path)
+    def test_success_when_running_config_unusable(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs({
+            'switch1': '<other><vr><vrId>1</vrId></vr></other>',
+            'switch2': '',
+            'switch3': TEMPLATE,
+        })
+        metrics = Metrics()
+        results = list(audit(['switch1', 'switch2', 'switch3'], TEMPLATE, 'username', 'password', metrics=metrics))
+
+        self.assertEqual([ValueError, etree.XMLSyntaxError, type(None)], [type(result.error) for result in results])
+        self.assertTrue(results[2].compliant)
+        self.assertEqual(1, metrics.exceptions.get(host='switch1', exception='ValueError'))
+
+    @mock.patch(ocnos_class_path)
+    def test_success_retrieves_no_more_than_workers_ahead(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs({'switch{}'.format(i): TEMPLATE for i in range(10)})
+        taken = []
+
+        def hostnames():
+            for i in range(10):
+                taken.append(i)
+                yield 'switch{}'.format(i)
+
+        results = audit(hostnames(), TEMPLATE, 'username', 'password', workers=3)
+        self.assertEqual('switch0', next(results).hostname)
+        self.assertEqual(4, len(taken))
+        self.assertEqual(9, len(list(results)))
+
+    @mock.patch(ocnos_class_path)
+    def test_success_limiter_adapts(self, mock_ocnos):
+        configs = {'switch{}'.format(i): TEMPLATE for i in range(10)}
+        mock_ocnos.side_effect = running_configs(configs)
+        limiter = ConcurrencyLimiter(2, max_limit=4, latency_tolerance=None)
+        results = list(audit(sorted(configs), TEMPLATE, 'username', 'password', limiter=limiter))
+
+        self.assertTrue(all(result.compliant for result in results))
+        # Connect and fetch of every device are observed
+        self.assertEqual(20, limiter.observed)
+        self.assertEqual(4, limiter.limit)
+        self.assertEqual(0, limiter.in_flight)
+
+    @mock.patch(ocnos_class_path)
+    def test_success_session_bounded(self, mock_ocnos):
+        template = '<config><vr><vrId>1</vrId><a>1</a></vr><ntp><b>1</b></ntp><snmp><c>1</c></snmp></config>'
+        configs = {
+            'switch{}'.format(i): '<config><vr><vrId>1</vrId><a>{0}</a></vr><ntp><b>{0}</b></ntp>'
+                                  '<snmp><c>{0}</c></snmp></config>'.format(i)
+            for i in range(20)
+        }
+        mock_ocnos.side_effect = running_configs(configs)
+        sessions = []
+
+        def create_session(*args, **kwargs):
+            sessions.append(DiffSession(*args, max_cached=3, max_results=3, **kwargs))
+            return sessions[-1]
+
+        with mock.patch('pyocnos.audit.DiffSession', side_effect=create_session):
+            results = list(audit(sorted(configs), template, 'username', 'password', workers=4))
+
+        self.assertEqual([build_xml_diff(configs[result.hostname], template) for result in results],
+                         [result.diff for result in results])
+        self.assertLessEqual(len(sessions[0].cache), 3)
+        self.assertLessEqual(len(sessions[0].results), 3)
+
+
+class TestRenderReport(TestCase):
+
+    def test_success(self):
+        lines = list(render_report([
+            AuditResult('switch1', '', None),
+            AuditResult('switch2', '[config]\n...', None),
+            AuditResult('switch3', None, OCNOSConnectionError('Unable to open ssh connection.')),
+        ]))
+        self.assertEqual([
+            'switch1: compliant',
+            'switch2: not compliant',
+            '[config]\n...',
+            'switch3: error: Unable to open ssh connection.',
+            '1 of 3 devices compliant',
+        ], lines)
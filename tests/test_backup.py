@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sys
+import tarfile
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from pyocnos.backup import archive_compression
+from pyocnos.backup import backup
+from pyocnos.backup import BackupEntry
+from pyocnos.backup import MANIFEST_NAME
+from pyocnos.backup import render_report
+from pyocnos.exceptions import OCNOSConnectionError
+from pyocnos.metrics import Metrics
+
+ocnos_class_path = 'pyocnos.audit.OCNOS'
+
+CONFIGS = {
+    'switch1': '<config><vr><vrId>1</vrId></vr></config>',
+    'switch2': '<config><vr><vrId>2</vrId></vr></config>',
+    'switch3': OCNOSConnectionError('Unable to open ssh connection.'),
+}
+
+
+def running_configs(configs):
+    """ Mock OCNOS instances returning the running config of their hostname """
+    def create(hostname, **_):
+        device = mock.Mock()
+        if isinstance(configs[hostname], Exception):
+            device.open.side_effect = configs[hostname]
+        device.get_config.return_value = {'running': configs[hostname]}
+        return device
+    return create
+
+
+class TestBackup(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    @mock.patch(ocnos_class_path)
+    def test_success_gzip(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs(CONFIGS)
+        metrics = Metrics()
+        path = self.path('backup.tar.gz')
+        entries = backup(sorted(CONFIGS), path, 'username', 'password', workers=2, metrics=metrics)
+
+        self.assertEqual(['switch1', 'switch2', 'switch3'], sorted(entry.hostname for entry in entries))
+        with tarfile.open(path, 'r:gz') as archive:
+            names = archive.getnames()
+            self.assertEqual(MANIFEST_NAME, names[-1])
+            self.assertEqual(['switch1-running.xml', 'switch2-running.xml'], sorted(names[:-1]))
+            self.assertEqual(CONFIGS['switch1'].encode(), archive.extractfile('switch1-running.xml').read())
+            manifest = json.loads(archive.extractfile(MANIFEST_NAME).read().decode())
+        self.assertEqual(
+            {'hostname': 'switch2', 'name': 'switch2-running.xml', 'size': len(CONFIGS['switch2']),
+             'sha256': hashlib.sha256(CONFIGS['switch2'].encode()).hexdigest()},
+            [device for device in manifest['devices'] if device['hostname'] == 'switch2'][0]
+        )
+        self.assertEqual([{'hostname': 'switch3', 'error': 'Unable to open ssh connection.'}], manifest['failed'])
+        self.assertEqual(1, metrics.exceptions.get(host='switch3', exception='OCNOSConnectionError'))
+        self.assertEqual(['backup.tar.gz'], os.listdir(self.directory.name))
+
+    @mock.patch(ocnos_class_path)
+    def test_success_uncompressed(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs(CONFIGS)
+        path = self.path('backup.tar')
+        backup(['switch1'], path, 'username', 'password')
+        with tarfile.open(path, 'r:') as archive:
+            self.assertEqual(['switch1-running.xml', MANIFEST_NAME], archive.getnames())
+
+    @mock.patch(ocnos_class_path)
+    def test_success_when_device_fails_unexpectedly(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs(dict(CONFIGS, switch2=RuntimeError('Unexpected reply')))
+        metrics = Metrics()
+        path = self.path('backup.tar')
+        entries = backup(sorted(CONFIGS), path, 'username', 'password', metrics=metrics)
+
+        self.assertEqual(['switch2', 'switch3'], sorted(entry.hostname for entry in entries if entry.error))
+        with tarfile.open(path, 'r:') as archive:
+            self.assertEqual(['switch1-running.xml', MANIFEST_NAME], archive.getnames())
+        self.assertEqual(1, metrics.exceptions.get(host='switch2', exception='RuntimeError'))
+
+    @mock.patch(ocnos_class_path)
+    def test_success_archive_mode(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs(CONFIGS)
+        path = self.path('backup.tar')
+        umask = os.umask(0o027)
+        try:
+            backup(['switch1'], path, 'username', 'password')
+        finally:
+            os.umask(umask)
+        self.assertEqual(0o640, os.stat(path).st_mode & 0o777)
+
+    def test_success_render_report(self):
+        self.assertEqual(
+            ['switch3: failed', 'Unable to open ssh connection.', 'Running configs of 1 of 2 devices stored in b.tgz'],
+            list(render_report([
+                BackupEntry('switch1', 'switch1-running.xml', 10, 'abc', None),
+                BackupEntry('switch3', None, None, None, 'Unable to open ssh connection.'),
+            ], 'b.tgz'))
+        )
+
+    def test_success_archive_compression(self):
+        self.assertEqual(
+            ['gz', 'gz', 'zst', ''],
+            [archive_compression(path) for path in ['a.tar.gz', 'a.tgz', 'a.tar.zst', 'a.tar']]
+        )
+
+    def test_fail_when_suffix_unknown(self):
+        self.assertRaises(ValueError, archive_compression, 'backup.zip')
+
+    @mock.patch(ocnos_class_path)
+    def test_fail_zstd_without_zstandard(self, mock_ocnos):
+        mock_ocnos.side_effect = running_configs(CONFIGS)
+        with mock.patch.dict(sys.modules, {'zstandard': None}):
+            self.assertRaises(ValueError, backup, ['switch1'], self.path('backup.tar.zst'), 'username', 'password')
+        self.assertEqual([], os.listdir(self.directory.name))
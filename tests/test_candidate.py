@@ -0,0 +1,80 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from lxml import etree
+import mock
+
+from pyocnos.candidate import CandidateCache
+from pyocnos.candidate import CandidateConfig
+from pyocnos.candidate import parse_candidate_config
+from pyocnos.exceptions import OCNOSLoadCandidateConfigFileReadError
+from pyocnos.exceptions import OCNOSNoCandidateConfigError
+
+
+class TestParseCandidateConfig(TestCase):
+
+    def test_success_string(self):
+        tree = parse_candidate_config(config='<data>\n  <vr>1</vr>\n</data>')
+        self.assertEqual('<config><vr>1</vr></config>', etree.tostring(tree).decode())
+
+    def test_fail_when_nothing_given(self):
+        self.assertRaises(OCNOSNoCandidateConfigError, parse_candidate_config)
+
+
+class TestCandidateCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = CandidateCache(max_size=2)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as candidate_file:
+            candidate_file.write(content)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+        return path
+
+    def test_success_loaded_once(self):
+        path = self.write('candidate.xml', '<data><vr>1</vr></data>')
+        candidate = self.cache.load(path)
+        self.assertEqual(b'<config><vr>1</vr></config>', candidate.xml)
+
+        with mock.patch('pyocnos.candidate.open') as mock_open:
+            self.assertIs(candidate, self.cache.load(path))
+        mock_open.assert_not_called()
+
+    def test_success_changed_file_loaded_again(self):
+        path = self.write('candidate.xml', '<data><vr>1</vr></data>', mtime=1000000000)
+        candidate = self.cache.load(path)
+        self.write('candidate.xml', '<data><vr>2</vr></data>', mtime=2000000000)
+        self.assertEqual(b'<config><vr>2</vr></config>', self.cache.load(path).xml)
+
+        # The same content as before is not parsed again
+        self.write('candidate.xml', '<data><vr>1</vr></data>', mtime=3000000000)
+        self.assertIs(candidate, self.cache.load(path))
+        self.assertIs(candidate, self.cache.load(self.write('copy.xml', '<data><vr>1</vr></data>')))
+
+    def test_success_least_recently_loaded_dropped(self):
+        paths = [self.write('{}.xml'.format(vr), '<data><vr>{}</vr></data>'.format(vr)) for vr in range(3)]
+        first = self.cache.load(paths[0])
+        self.cache.load(paths[1])
+        self.cache.load(paths[2])
+        self.assertEqual(2, len(self.cache.candidates))
+        self.assertIsNot(first, self.cache.load(paths[0]))
+
+    def test_fail_when_file_does_not_exist(self):
+        self.assertRaises(OCNOSLoadCandidateConfigFileReadError, self.cache.load, 'foo.xml')
+
+
+class TestCandidateConfig(TestCase):
+
+    def test_success_copy_and_prepared(self):
+        candidate = CandidateConfig(parse_candidate_config(config='<config><vr>1</vr></config>'))
+        copy = candidate.copy()
+        self.assertIsNot(candidate.tree, copy)
+        self.assertEqual(candidate.xml, etree.tostring(copy, encoding='UTF-8'))
+        self.assertIs(candidate.prepared, candidate.prepared)
+        self.assertEqual('config', candidate.prepared.tree.tag)
@@ -1,14 +1,23 @@
 from __future__ import unicode_literals
 
+import json
 import os
 import sys
+import tempfile
 from unittest import TestCase
 
 import mock
 
+from pyocnos.audit import AuditResult
+from pyocnos.backup import BackupEntry
 from pyocnos.command_line import main
 from pyocnos.command_line import parse_and_get_args
+from pyocnos.command_line import parse_and_get_diff_files_args
 from pyocnos.command_line import process
+from pyocnos.command_line import process_diff_files
+from pyocnos.diff import build_xml_diff
+from pyocnos.exceptions import OCNOSConnectionError
+from pyocnos.retry import OPERATIONS
 
 current_path = os.path.dirname(os.path.realpath(__file__))
 ocnos_class_path = 'pyocnos.command_line.OCNOS'
@@ -117,6 +126,42 @@ class TestParseAndGetArgsFunction(TestCase):
 
             self.assertEqual('can-new-file', args.candidate_file_path)
 
+    def test_success_optional_metrics_file_path_argument(self):
+        arguments = ['prog', 'test.ini', 'foo.com', 'running', '-m', 'foo.prom']
+        with mock.patch.object(sys, 'argv', arguments):
+            args = parse_and_get_args()
+
+            self.assertEqual('foo.prom', args.metrics_file_path)
+
+    def test_success_audit_action_with_workers(self):
+        arguments = ['prog', 'test.ini', 'foo.com,bar.com', 'audit', '-c', 'golden.xml', '-w', '4']
+        with mock.patch.object(sys, 'argv', arguments):
+            args = parse_and_get_args()
+
+            self.assertEqual(['audit'], args.actions)
+            self.assertEqual(4, args.workers)
+
+    def test_fail_when_audit_action_combined_with_other_actions(self):
+        arguments = ['prog', 'test.ini', 'foo.com,bar.com', 'audit', 'diff', '-c', 'golden.xml']
+        with mock.patch.object(sys, 'argv', arguments):
+            self.assertRaises(SystemExit, parse_and_get_args)
+
+    def test_fail_when_backup_action_combined_with_other_actions(self):
+        arguments = ['prog', 'test.ini', 'foo.com,bar.com', 'backup', 'running']
+        with mock.patch.object(sys, 'argv', arguments):
+            self.assertRaises(SystemExit, parse_and_get_args)
+
+    def test_fail_when_agent_with_options_of_the_agent(self):
+        for options in [['-p', 'never'], ['--retries', '3'], ['--retry-deadline', '10'], ['-k', 'keys.yml']]:
+            arguments = ['prog', 'test.ini', 'foo.com', 'running', '--agent'] + options
+            with mock.patch.object(sys, 'argv', arguments):
+                self.assertRaises(SystemExit, parse_and_get_args)
+
+    def test_fail_when_max_workers_lower_than_workers(self):
+        arguments = ['prog', 'test.ini', 'foo.com', 'audit', '-c', 'golden.xml', '-w', '8', '--max-workers', '4']
+        with mock.patch.object(sys, 'argv', arguments):
+            self.assertRaises(SystemExit, parse_and_get_args)
+
 
 class TestProcessFunction(TestCase):
 
@@ -137,9 +182,14 @@ class TestProcessFunction(TestCase):
             hostname='foobar.com',
             actions=[],
             save_config_file_path=None,
-            candidate_file_path=None
+            candidate_file_path=None,
+            retries=3
         )
-        mock_ocnos.assert_called_once_with(hostname='foobar.com', username='username', password='password', timeout=30)
+        mock_ocnos.assert_called_once_with(hostname='foobar.com', username='username', password='password', timeout=30,
+                                           persist='immediate', retry=mock.ANY, metrics=mock.ANY, keys=None)
+        retry = mock_ocnos.call_args[1]['retry']
+        self.assertEqual([3, 3, 3, 3], [retry[operation].attempts for operation in OPERATIONS])
+        self.assertIsNone(retry['connect'].deadline)
 
     @mock.patch(ocnos_class_path, autospec=True)
     def test_success_connection_action(self, mock_ocnos):
@@ -197,7 +247,9 @@ class TestProcessFunction(TestCase):
             candidate_file_path='candidate.xml'
         )
         ocnos_instance.load_candidate_config.assert_called_once_with(filename='candidate.xml')
-        ocnos_instance.compare_config.assert_called_once()
+        ocnos_instance.get_config.assert_called_once_with('running')
+        ocnos_instance.compare_config.assert_called_once_with(
+            running=ocnos_instance.get_config.return_value.__getitem__.return_value)
 
     @mock.patch(ocnos_class_path, autospec=True)
     def test_success_replace_action(self, mock_ocnos):
@@ -243,6 +295,90 @@ class TestProcessFunction(TestCase):
         )
         ocnos_instance.commit_config.assert_called_once()
 
+    @mock.patch(ocnos_class_path, autospec=True)
+    def test_success_metrics_file_written(self, mock_ocnos):
+        ocnos_instance = mock_ocnos.return_value.__enter__.return_value
+        ocnos_instance.get_config.return_value = {'running': 'Running config'}
+        file_path = os.path.join(current_path, 'running.xml')
+        metrics_file_path = os.path.join(current_path, 'foobar.prom')
+        process(
+            config_file_path=os.path.join(current_path, 'user-details.yml.example'),
+            hostname='foobar.com',
+            actions=['running', 'diff'],
+            save_config_file_path=file_path,
+            candidate_file_path='candidate.xml',
+            metrics_file_path=metrics_file_path
+        )
+        with open(metrics_file_path, encoding='utf-8') as metrics_file:
+            metrics = metrics_file.read()
+        os.remove(file_path)
+        os.remove(metrics_file_path)
+        # The running config is fetched for the diff too, and the diff timed without it
+        for operation, count in [('connect', 1), ('fetch', 2), ('diff', 1)]:
+            self.assertIn(
+                'pyocnos_operation_duration_seconds_count{host="foobar.com",operation="%s"} %d' % (operation, count),
+                metrics
+            )
+        ocnos_instance.compare_config.assert_called_once_with(running='Running config')
+        self.assertIn('pyocnos_config_bytes{host="foobar.com",source="running"} 14', metrics)
+
+    @mock.patch(ocnos_class_path, autospec=True)
+    def test_success_metrics_file_written_when_action_fails(self, mock_ocnos):
+        mock_ocnos.return_value.__enter__.side_effect = OCNOSConnectionError('Unable to open ssh connection.')
+        metrics_file_path = os.path.join(current_path, 'foobar.prom')
+        with self.assertRaises(OCNOSConnectionError):
+            process(
+                config_file_path=os.path.join(current_path, 'user-details.yml.example'),
+                hostname='foobar.com',
+                actions=['connection'],
+                save_config_file_path=None,
+                candidate_file_path=None,
+                metrics_file_path=metrics_file_path
+            )
+        with open(metrics_file_path, encoding='utf-8') as metrics_file:
+            metrics = metrics_file.read()
+        os.remove(metrics_file_path)
+        self.assertIn('pyocnos_exceptions_total{host="foobar.com",exception="OCNOSConnectionError"} 1', metrics)
+        self.assertIn('pyocnos_operation_duration_seconds_count{host="foobar.com",operation="connect"} 1', metrics)
+
+    @mock.patch('pyocnos.command_line.load_template')
+    @mock.patch('pyocnos.command_line.audit')
+    def test_success_audit_action(self, mock_audit, mock_load_template):
+        mock_audit.return_value = iter([AuditResult('foo.com', '', None), AuditResult('bar.com', '[config]', None)])
+        output = process(
+            config_file_path=os.path.join(current_path, 'user-details.yml.example'),
+            hostname='foo.com,bar.com',
+            actions=['audit'],
+            save_config_file_path=None,
+            candidate_file_path='golden.xml',
+            workers=4,
+            max_workers=16
+        )
+        mock_load_template.assert_called_once_with('golden.xml')
+        mock_audit.assert_called_once_with(['foo.com', 'bar.com'], mock_load_template.return_value, 'username',
+                                           'password', 30, workers=4, keys=None, metrics=mock.ANY, retry=mock.ANY,
+                                           limiter=mock.ANY)
+        limiter = mock_audit.call_args[1]['limiter']
+        self.assertEqual((4, 16), (limiter.limit, limiter.max_limit))
+        self.assertEqual(
+            ['foo.com: compliant', 'bar.com: not compliant', '[config]', '1 of 2 devices compliant'],
+            output
+        )
+
+    @mock.patch('pyocnos.command_line.backup')
+    def test_success_backup_action(self, mock_backup):
+        mock_backup.return_value = [BackupEntry('foo.com', 'foo.com-running.xml', 10, 'abc', None)]
+        output = process(
+            config_file_path=os.path.join(current_path, 'user-details.yml.example'),
+            hostname='foo.com,bar.com',
+            actions=['backup'],
+            save_config_file_path='backup.tar.zst',
+            candidate_file_path=None,
+        )
+        mock_backup.assert_called_once_with(['foo.com', 'bar.com'], 'backup.tar.zst', 'username', 'password', 30,
+                                            workers=8, metrics=mock.ANY, retry=mock.ANY, limiter=mock.ANY)
+        self.assertEqual(['Running configs of 1 of 1 devices stored in backup.tar.zst'], output)
+
 
 class TestMainFunction(TestCase):
     @mock.patch(ocnos_class_path, autospec=True)
@@ -252,3 +388,167 @@ class TestMainFunction(TestCase):
             ocnos_instance = mock_ocnos.return_value.__enter__.return_value
             main()
             ocnos_instance.is_alive.assert_called_once()
+
+    @mock.patch('pyocnos.command_line.AgentDevice')
+    @mock.patch(ocnos_class_path)
+    def test_success_actions_in_agent(self, mock_ocnos, mock_agent_device):
+        config_file = os.path.join(current_path, 'user-details.yml.example')
+        arguments = ['prog', config_file, 'foo.com', 'diff', '-c', 'candidate.xml', '--agent', 'agent.sock']
+        with mock.patch.object(sys, 'argv', arguments):
+            main()
+        mock_ocnos.assert_not_called()
+        mock_agent_device.assert_called_once_with('foo.com', 'agent.sock')
+        device = mock_agent_device.return_value
+        device.load_candidate_config.assert_called_once_with(filename='candidate.xml')
+        device.get_config.assert_called_once_with('running')
+        device.compare_config.assert_called_once_with(running=device.get_config.return_value['running'])
+
+    @mock.patch('pyocnos.command_line.load_keys')
+    @mock.patch('pyocnos.command_line.AgentServer')
+    @mock.patch('pyocnos.command_line.SessionPool')
+    def test_success_agent(self, mock_session_pool, mock_agent_server, mock_load_keys):
+        config_file = os.path.join(current_path, 'user-details.yml.example')
+        arguments = ['prog', 'agent', config_file, '-s', 'agent.sock', '--idle-timeout', '30', '-k', 'keys.yml',
+                     '--platform', 'AS7712-32X']
+        with mock.patch.object(sys, 'argv', arguments), mock.patch(ocnos_class_path) as mock_ocnos:
+            main()
+            create_device = mock_session_pool.call_args[0][0]
+            create_device('foo.com')
+        mock_session_pool.assert_called_once_with(mock.ANY, idle_timeout=30)
+        mock_agent_server.assert_called_once_with('agent.sock', mock_session_pool.return_value)
+        mock_agent_server.return_value.serve_forever.assert_called_once_with()
+        mock_agent_server.return_value.server_close.assert_called_once_with()
+        mock_ocnos.assert_called_once_with(hostname='foo.com', username='username', password='password', timeout=30,
+                                           persist='immediate', retry=mock.ANY, keys=mock_load_keys.return_value)
+        mock_load_keys.assert_called_once_with('keys.yml', platform='AS7712-32X', version=None)
+
+
+class TestDiffFiles(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, path, content):
+        path = os.path.join(self.directory.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as xml_file:
+            xml_file.write(content)
+        return path
+
+    def test_success_parse_args(self):
+        args = parse_and_get_diff_files_args([current_path, current_path, '-j', '4'])
+        self.assertEqual(current_path, args.left_path)
+        self.assertEqual(4, args.jobs)
+
+    def test_fail_parse_args_when_file_and_directory_given(self):
+        self.assertRaises(SystemExit, parse_and_get_diff_files_args, [current_path, __file__])
+
+    @mock.patch(ocnos_class_path)
+    def test_success_files(self, mock_ocnos):
+        left = self.write('foo-running.xml', '<config><vr><vrId>1</vrId></vr></config>')
+        right = self.write('candidate.xml', '<config><vr><vrId>2</vrId></vr></config>')
+        self.assertEqual(
+            ['[config]', '  [vr]', '-   <vrId>1</vrId>', '+   <vrId>2</vrId>'],
+            list(process_diff_files(left, right))
+        )
+        self.assertEqual([], list(process_diff_files(left, left)))
+        mock_ocnos.assert_not_called()
+
+    def test_success_files_same_as_build_xml_diff(self):
+        left_xml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<data>\n  <vr><vrId>1</vrId><vrHostname>foo</vrHostname></vr>\n</data>')
+        right_xml = '<data><vr><vrId>1</vrId><vrHostname>bar</vrHostname></vr><snmp/></data>'
+        left = self.write('left.xml', left_xml)
+        right = self.write('right.xml', right_xml)
+        self.assertEqual(build_xml_diff(left_xml, right_xml), os.linesep.join(process_diff_files(left, right)))
+        other = self.write('other.xml', '<config><vr><vrId>1</vrId></vr></config>')
+        self.assertRaises(ValueError, list, process_diff_files(left, other))
+
+    def test_success_files_formats(self):
+        left = self.write('left.xml', '<config><vr><vrId>1</vrId></vr></config>')
+        right = self.write('right.xml', '<config><vr><vrId>2</vrId></vr></config>')
+        self.assertEqual([
+            '{"change": "removed", "path": "/config/vr/vrId", "xml": "<vrId>1</vrId>"}',
+            '{"change": "added", "path": "/config/vr/vrId", "xml": "<vrId>2</vrId>"}',
+        ], list(process_diff_files(left, right, output_format='jsonl')))
+        self.assertEqual([
+            '--- {}'.format(left),
+            '+++ {}'.format(right),
+            '@@ /config/vr @@',
+            '- <vrId>1</vrId>',
+            '+ <vrId>2</vrId>',
+        ], list(process_diff_files(left, right, output_format='unified')))
+
+    def test_success_directories(self):
+        for name, vr_id in [('a.xml', 1), ('b.xml', 1), ('c.xml', 1)]:
+            self.write(os.path.join('left', name), '<config><vr><vrId>{}</vrId></vr></config>'.format(vr_id))
+        for name, vr_id in [('a.xml', 2), ('b.xml', 1), ('d.xml', 1)]:
+            self.write(os.path.join('right', name), '<config><vr><vrId>{}</vrId></vr></config>'.format(vr_id))
+        left = os.path.join(self.directory.name, 'left')
+        right = os.path.join(self.directory.name, 'right')
+
+        output = list(process_diff_files(left, right))
+        self.assertEqual([
+            'Only in {}: c.xml'.format(left),
+            'Only in {}: d.xml'.format(right),
+            'diff {} {}'.format(os.path.join(left, 'a.xml'), os.path.join(right, 'a.xml')),
+            '[config]', '  [vr]', '-   <vrId>1</vrId>', '+   <vrId>2</vrId>',
+        ], output)
+        self.assertEqual(output, list(process_diff_files(left, right, jobs=2)))
+
+        records = [json.loads(line) for line in process_diff_files(left, right, jobs=2, output_format='jsonl')]
+        self.assertEqual([
+            {'only_in': left, 'name': 'c.xml'},
+            {'only_in': right, 'name': 'd.xml'},
+            {'left': os.path.join(left, 'a.xml'), 'right': os.path.join(right, 'a.xml')},
+            {'change': 'removed', 'path': '/config/vr/vrId', 'xml': '<vrId>1</vrId>'},
+            {'change': 'added', 'path': '/config/vr/vrId', 'xml': '<vrId>2</vrId>'},
+        ], records)
+
+    def test_success_main(self):
+        left = self.write('left.xml', '<config><vr><vrId>1</vrId></vr></config>')
+        right = self.write('right.xml', '<config><vr><vrId>2</vrId></vr></config>')
+        with mock.patch.object(sys, 'argv', ['prog', 'diff-files', left, right]), \
+                mock.patch('pyocnos.command_line.print') as mock_print:
+            main()
+        self.assertEqual(
+            [mock.call(line) for line in ['[config]', '  [vr]', '-   <vrId>1</vrId>', '+   <vrId>2</vrId>']],
+            mock_print.call_args_list
+        )
+
+    def test_success_main_traced(self):
+        left = self.write('left.xml', '<config><vr><vrId>1</vrId></vr></config>')
+        right = self.write('right.xml', '<config><vr><vrId>2</vrId></vr></config>')
+        trace_file_path = os.path.join(self.directory.name, 'trace.jsonl')
+        with mock.patch.object(sys, 'argv', ['prog', 'diff-files', left, right, '--trace-file', trace_file_path]), \
+                mock.patch('pyocnos.command_line.print'):
+            main()
+        with open(trace_file_path, encoding='utf-8') as trace_file:
+            names = [json.loads(line)['name'] for line in trace_file]
+        self.assertEqual(['diff.normalize_tree', 'diff.normalize_tree', 'diff.rdiff', 'diff.build_diff_tree'], names)
+
+    def test_success_main_stats(self):
+        left = self.write('left.xml', '<config><vr><vrId>1</vrId></vr></config>')
+        right = self.write('right.xml', '<config><vr><vrId>2</vrId></vr></config>')
+        with mock.patch.object(sys, 'argv', ['prog', 'diff-files', left, right, '--stats']), \
+                mock.patch('pyocnos.command_line.print') as mock_print:
+            main()
+        stderr_lines = [call[0][0] for call in mock_print.call_args_list if call[1].get('file') is sys.stderr]
+        self.assertIn('Ordering intersections: 2', stderr_lines)
+        self.assertEqual(4, len(mock_print.call_args_list) - len(stderr_lines))
+
+    def test_success_main_keys_file(self):
+        left = self.write('left.xml', '<config><vlan><vlanId>2</vlanId><name>web</name></vlan>'
+                                      '<vlan><vlanId>3</vlanId><name>db</name></vlan></config>')
+        right = self.write('right.xml', '<config><vlan><vlanId>3</vlanId><name>web</name></vlan>'
+                                        '<vlan><vlanId>2</vlanId><name>db</name></vlan></config>')
+        keys_file = self.write('keys.json', json.dumps({'platforms': [
+            {'platform': 'AS7712-32X', 'version': '6', 'keys': {'vlan': [['vlanId']]}},
+        ]}))
+        argv = ['prog', 'diff-files', left, right, '-k', keys_file, '--platform', 'AS7712-32X',
+                '--ocnos-version', '6.4.1']
+        with mock.patch.object(sys, 'argv', argv), mock.patch('pyocnos.command_line.print') as mock_print:
+            main()
+        lines = [call[0][0] for call in mock_print.call_args_list]
+        self.assertEqual(['    <vlanId>2</vlanId>', '-   <name>web</name>', '+   <name>db</name>'], lines[2:5])
@@ -0,0 +1,132 @@
+"""
+This test module covers tests cases for pyocnos.compact.CompactTree
+"""
+# pylint: disable=invalid-name
+
+import pickle
+
+from lxml import etree
+from pyocnos.compact import common_symbols, CompactTree, NO_TEXT, Symbols
+from pyocnos.diff import normalize_tree
+
+
+def test_compact_tree_breadth_first_layout():
+    """
+    Nodes are numbered breadth first, so the children of each node are a contiguous range.
+    """
+    tree = CompactTree([normalize_tree("<data><foo><bar>1</bar><tar/></foo><loo>2</loo></data>")])
+
+    assert len(tree) == 5
+    assert [tree.tag(node) for node in range(len(tree))] == ['data', 'foo', 'loo', 'bar', 'tar']
+    assert list(tree.children(0)) == [1, 2]
+    assert list(tree.children(1)) == [3, 4]
+    assert list(tree.parents) == [-1, 0, 0, 1, 1]
+    assert [tree.position(node) for node in range(len(tree))] == [0, 0, 1, 0, 1]
+    assert tree.is_leaf(2) and not tree.is_leaf(1)
+    assert tree.text(3) == '1'
+    assert tree.texts[4] == NO_TEXT
+
+
+def test_compact_tree_shared_symbols():
+    """
+    Trees sharing a symbol table have the same ids for the same tags and texts.
+    """
+    left, right = CompactTree.pair([etree.XML('<data><foo>1</foo></data>')],
+                                   [etree.XML('<data><bar>2</bar><foo>1</foo></data>')])
+
+    assert left.symbols is right.symbols
+    assert left.tags[1] == right.tags[2]
+    assert left.texts[1] == right.texts[2]
+    assert left.tags[1] != right.tags[1]
+
+
+def test_compact_tree_hashes():
+    """
+    Identical subtrees have the same hash, no matter in which tree or at which position they are. Tag, text,
+    attributes and the structure all count in the hash, but not white spaces around texts.
+    """
+    left, right = CompactTree.pair([etree.XML('<data><foo><bar>1</bar></foo><loo>2</loo></data>')],
+                                   [etree.XML('<data><loo> 2 </loo><foo><bar>1</bar></foo></data>')])
+    assert left.hashes[1] == right.hashes[2]
+    assert left.hashes[2] == right.hashes[1]
+    assert left.hashes[3] == right.hashes[3]
+    assert left.hashes[0] != right.hashes[0]
+
+    xmlstrings = [
+        "<data><foo>100</foo></data>",
+        "<data><bar>100</bar></data>",
+        "<data><foo>200</foo></data>",
+        "<data><foo/></data>",
+        "<data><foo a='1'>100</foo></data>",
+        "<data><foo><foo>100</foo></foo></data>",
+        "<data><foo>100</foo><foo>100</foo></data>",
+        "<data><!--100--></data>",
+    ]
+    hashes = {CompactTree([etree.XML(xmlstring)], Symbols()).hashes[0] for xmlstring in xmlstrings}
+    assert len(hashes) == len(xmlstrings)
+
+
+def test_compact_tree_elements():
+    """
+    The lxml elements of nodes are looked up by traversing the tree in the same order.
+    """
+    root = etree.XML('<data><foo><bar>1</bar><tar/></foo><loo>2</loo></data>')
+    tree = CompactTree([root])
+
+    assert tree.elements([]) == {}
+    assert tree.elements([4, 2, 0]) == {0: root, 2: root[1], 4: root[0][1]}
+
+
+def test_compact_tree_pickle():
+    """
+    A pickled tree, e.g. sent to a worker process, keeps the arrays but not the lxml elements.
+    """
+    left, right = CompactTree.pair([etree.XML('<data><foo>1</foo></data>')], [etree.XML('<data><foo>2</foo></data>')])
+    copy = pickle.loads(pickle.dumps(left))
+
+    assert copy.roots == []
+    assert copy.symbols.names == right.symbols.names
+    for name in ('tags', 'texts', 'hashes', 'child_start', 'child_end', 'parents'):
+        assert getattr(copy, name) == getattr(left, name)
+
+
+def test_compact_tree_with_symbols():
+    """
+    Trees built with different symbol tables are compared after moving one to the table of the other.
+    """
+    left = CompactTree([etree.XML('<data><foo>1</foo></data>')])
+    right = CompactTree([etree.XML('<data><bar>2</bar><foo>1</foo></data>')])
+    assert left.tags[1] == right.tags[1]
+
+    moved = right.with_symbols(left.symbols)
+    assert moved.symbols is left.symbols
+    assert moved.hashes is right.hashes
+    assert [moved.tag(node) for node in range(len(moved))] == ['data', 'bar', 'foo']
+    assert moved.tags[2] == left.tags[1] and moved.texts[2] == left.texts[1]
+    assert moved.tags[1] != left.tags[1]
+
+    extended = left.symbols.copy()
+    assert left.with_symbols(extended).tags is left.tags
+    assert left.with_symbols(left.symbols) is left
+
+
+def test_common_symbols():
+    """
+    Trees get the table extending the other one, or a copy of the left one, without changing the tables they have.
+    """
+    left = CompactTree([etree.XML('<data><foo>1</foo></data>')])
+    right = CompactTree([etree.XML('<data><foo>1</foo><bar>2</bar></data>')], left.symbols.copy())
+    names = list(left.symbols.names)
+
+    common_left, common_right = common_symbols(left, right)
+    assert common_right is right and common_left.symbols is right.symbols
+    assert common_left.tags is left.tags
+    common_left, common_right = common_symbols(right, left)
+    assert common_left is right and common_right.symbols is right.symbols
+
+    other = CompactTree([etree.XML('<data><baz>3</baz></data>')])
+    common_left, common_right = common_symbols(left, other)
+    assert common_left.symbols is common_right.symbols
+    assert common_left.symbols is not left.symbols and common_left.tags is left.tags
+    assert [common_right.tag(node) for node in range(len(common_right))] == ['data', 'baz']
+    assert left.symbols.names == names and other.symbols.names == ['data', 'baz', '3']
@@ -0,0 +1,99 @@
+import threading
+from unittest import TestCase
+
+import mock
+
+from pyocnos.concurrency import ConcurrencyLimiter
+from pyocnos.concurrency import parse_sites
+
+
+class TestConcurrencyLimiter(TestCase):
+
+    def test_success_limit_grows_additively(self):
+        limiter = ConcurrencyLimiter(2, max_limit=4)
+        for _ in range(3):
+            limiter.observe('connect', 1.0)
+        self.assertEqual(3, int(limiter.limit))
+        for _ in range(10):
+            limiter.observe('connect', 1.0)
+        self.assertEqual(4, limiter.limit)
+
+    def test_success_limit_cut_once_per_window(self):
+        limiter = ConcurrencyLimiter(8, max_limit=8)
+        limiter.observe('connect', 1.0)
+        # The sessions open when the limit was cut fail without cutting it again
+        for _ in range(9):
+            limiter.observe('connect', 1.0, failed=True)
+        self.assertEqual(4, limiter.limit)
+        limiter.observe('connect', 1.0, failed=True)
+        self.assertEqual(2, limiter.limit)
+
+    def test_success_limit_cut_after_slow_operation(self):
+        limiter = ConcurrencyLimiter(8, min_limit=3)
+        limiter.observe('connect', 1.0)
+        limiter.observe('fetch', 5.0)
+        limiter.observe('connect', 1.5)
+        self.assertEqual(8, limiter.limit)
+        limiter.observe('connect', 2.5)
+        self.assertEqual(4, limiter.limit)
+        for _ in range(9):
+            limiter.observe('fetch', 20.0)
+        self.assertEqual(3, limiter.limit)
+
+    def test_success_limit_not_cut_after_operation_of_larger_size(self):
+        limiter = ConcurrencyLimiter(8)
+        limiter.observe('fetch', 0.5, size=1000)
+        limiter.observe('fetch', 2.0, size=10 ** 6)
+        limiter.observe('fetch', 0.8, size=2000)
+        limiter.observe('fetch', 3.5, size=2 * 10 ** 6)
+        self.assertEqual(8, limiter.limit)
+        self.assertEqual(({'fetch': 0.5}, {'fetch': 1.75 / 10 ** 6}), (limiter.baselines, limiter.rates))
+        limiter.observe('fetch', 5.0, size=10 ** 6)
+        self.assertEqual(4, limiter.limit)
+
+    @mock.patch('pyocnos.concurrency.time.monotonic', side_effect=[0, 1, 2, 10])
+    def test_success_time(self, _):
+        limiter = ConcurrencyLimiter(4)
+        with limiter.time('connect') as operation:
+            operation['size'] = 100
+        with self.assertRaises(RuntimeError):
+            with limiter.time('connect'):
+                raise RuntimeError
+        self.assertEqual(({'connect': 1}, {'connect': 0.01}), (limiter.baselines, limiter.rates))
+        self.assertEqual(2, limiter.limit)
+
+    def test_success_slot_waits_for_site(self):
+        limiter = ConcurrencyLimiter(4, sites={'switch1': 'fra1', 'switch2': 'fra1'}, site_limits={'fra1': 1})
+        limiter.acquire('switch1')
+        acquired = threading.Event()
+
+        def acquire():
+            with limiter.slot('switch2'):
+                acquired.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        # Devices of other sites are not held up
+        with limiter.slot('switch3'):
+            self.assertFalse(acquired.wait(0.05))
+        limiter.release('switch1')
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        self.assertEqual((0, {'fra1': 0}), (limiter.in_flight, limiter.site_in_flight))
+
+    def test_fail_limits_invalid(self):
+        self.assertRaises(ValueError, ConcurrencyLimiter, 4, max_limit=2)
+        self.assertRaises(ValueError, ConcurrencyLimiter, 4, min_limit=0)
+        self.assertRaises(ValueError, ConcurrencyLimiter, 4, backoff=1)
+        self.assertRaises(ValueError, ConcurrencyLimiter, 4, sites={'switch1': 'fra1'}, site_limits={'fra1': 0})
+
+
+class TestParseSites(TestCase):
+
+    def test_success(self):
+        config = {'sites': {'fra1': {'limit': 2, 'hosts': ['switch1', 'switch2']}, 'lon1': {'hosts': ['switch3']}}}
+        self.assertEqual(
+            ({'switch1': 'fra1', 'switch2': 'fra1', 'switch3': 'lon1'}, {'fra1': 2}),
+            parse_sites(config)
+        )
+        self.assertEqual(({}, {}), parse_sites({'config': {}}))
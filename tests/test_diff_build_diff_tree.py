@@ -47,6 +47,30 @@ def test_build_diff_tree_empty_reference_tree():
     assert etree.tostring(build_diff_tree(tree_left, diffs)).decode('utf-8') == expected
 
 
+def test_build_diff_tree_with_ref_paths():
+    """
+    The paths to add the added elements to are given apart from them, which are not changed.
+    """
+    tree_left = normalize_tree('<data><foo><baz>1</baz></foo></data>')
+    tree_right = normalize_tree('<data><foo><qux>2</qux></foo><bar>200</bar></data>')
+    right_before = etree.tostring(tree_right)
+    diffs = {
+        REMOVED: [],
+        ADDED: [tree_right[0][0], tree_right[1]],
+        MOVED: [],
+    }
+
+    expected = compact("""
+        <data>
+          <foo><baz>1</baz><qux change='added'>2</qux></foo>
+          <bar change='added'>200</bar>
+        </data>
+    """)
+
+    assert etree.tostring(build_diff_tree(tree_left, diffs, ['/data/foo', '/data'])).decode('utf-8') == expected
+    assert etree.tostring(tree_right) == right_before
+
+
 def test_build_diff_tree_empty_diff():
     """
     Edge case: the change set is empty, applying which should not contain any side effects.
@@ -6,7 +6,8 @@ all tests are built with pyocnos.diff.build_xml_diff() which is the only entry o
 
 import os
 import pytest
-from pyocnos.diff import build_xml_diff
+from pyocnos.diff import build_xml_diff, DiffSession, PreparedTree
+from pyocnos.diffstats import DiffStats
 
 
 def test_diff_cannot_compare_simple_xml():
@@ -627,3 +628,173 @@ def test_diff_fixes_keys():
         '+ </interface>',
     ])
     assert build_xml_diff(xmlstring_left, xmlstring_right) == expected
+
+
+def test_diff_given_keys():
+    """
+    Keys given to the diff, e.g. discovered from the YANG modules of a device, are used to pair list elements.
+    Without the keys the entries would be paired by similarity and the changed key displayed as a value change.
+    """
+    xmlstring_left = """
+        <data>
+          <vlan>
+            <vlan-id>10</vlan-id>
+            <name>foo</name>
+          </vlan>
+        </data>
+    """
+    xmlstring_right = """
+        <data>
+          <vlan>
+            <vlan-id>20</vlan-id>
+            <name>foo</name>
+          </vlan>
+          <vlan>
+            <vlan-id>10</vlan-id>
+            <name>bar</name>
+          </vlan>
+        </data>
+    """
+    expected = os.linesep.join([
+        '[data]',
+        '  [vlan]',
+        '    <vlan-id>10</vlan-id>',
+        '-   <name>foo</name>',
+        '+   <name>bar</name>',
+        '+ <vlan>',
+        '+   <vlan-id>20</vlan-id>',
+        '+   <name>foo</name>',
+        '+ </vlan>',
+    ])
+    assert build_xml_diff(xmlstring_left, xmlstring_right, keys={'vlan': [('vlan-id',)]}) == expected
+
+
+def test_diff_parallel():
+    """
+    Diffing the top level containers in worker processes gives the same diff as diffing them one after another.
+    """
+    xmlstring_left = """
+        <data>
+          <snmp>
+            <snmphost><host>10.1.1.1</host><version>1</version></snmphost>
+            <snmphost><host>10.1.1.2</host><version>2c</version></snmphost>
+          </snmp>
+          <interface><ifName>eth0</ifName><mtu>1500</mtu></interface>
+          <interface><ifName>eth1</ifName><mtu>1500</mtu></interface>
+          <vxlan><id>1</id></vxlan>
+          <ntp>10.0.0.1</ntp>
+        </data>
+    """
+    xmlstring_right = """
+        <data>
+          <interface><ifName>eth1</ifName><mtu>9000</mtu></interface>
+          <interface><ifName>eth0</ifName><mtu>1500</mtu></interface>
+          <snmp>
+            <snmphost><host>10.1.1.2</host><version>2c</version></snmphost>
+            <snmphost><host>10.1.1.3</host><version>1</version></snmphost>
+          </snmp>
+          <vxlan><id>2</id></vxlan>
+          <ntp>10.0.0.2</ntp>
+        </data>
+    """
+    expected = build_xml_diff(xmlstring_left, xmlstring_right)
+    assert '[snmp]' in expected and '[interface]' in expected and '[vxlan]' in expected
+    assert build_xml_diff(xmlstring_left, xmlstring_right, workers=2) == expected
+
+
+def test_diff_session():
+    """
+    A session diffs one prepared tree against many others, the same as build_xml_diff() for each of them.
+    """
+    running = "<data><foo><bar>1</bar></foo><snmp><host>10.1.1.1</host></snmp></data>"
+    candidates = [
+        "<data><foo><baz>0</baz></foo><snmp><host>10.1.1.1</host></snmp></data>",
+        "<data><qux>1</qux></data>",
+        "<data><foo><bar>1</bar></foo><snmp><host>10.1.1.1</host></snmp></data>",
+        "<data><foo><bar>2</bar></foo><snmp><host>10.1.1.2</host></snmp><ntp>10.0.0.1</ntp></data>",
+    ]
+
+    session = DiffSession(left=running)
+    assert [session.diff(candidate) for candidate in candidates] == \
+        [build_xml_diff(running, candidate) for candidate in candidates]
+
+    # The right tree is fixed and its elements added to the left trees over and over again
+    session = DiffSession(right=PreparedTree(running))
+    assert [session.diff(candidate) for candidate in candidates] == \
+        [build_xml_diff(candidate, running) for candidate in candidates]
+    assert 'ref_path' not in session.diff(candidates[1])
+
+    # Trees prepared on their own are diffed too
+    assert session.diff(PreparedTree(candidates[3])) == build_xml_diff(candidates[3], running)
+
+
+def test_diff_session_keeps_symbols_of_fixed_tree():
+    """
+    The strings of the other trees are interned to copies of the symbols of the fixed tree, which does not grow
+    however many trees it is diffed against.
+    """
+    running = "<data><foo><bar>1</bar></foo><snmp><host>10.1.1.1</host></snmp></data>"
+    candidates = ["<data><foo><bar>{0}</bar></foo><vlan{0}>{0}</vlan{0}></data>".format(number)
+                  for number in range(50)]
+    session = DiffSession(left=running)
+    names = list(session.left.compact.symbols.names)
+    assert [session.diff(candidate) for candidate in candidates] == \
+        [build_xml_diff(running, candidate) for candidate in candidates]
+    assert session.left.compact.symbols.names == names
+
+    session = DiffSession(right=running)
+    assert [session.diff(candidate) for candidate in candidates] == \
+        [build_xml_diff(candidate, running) for candidate in candidates]
+    assert session.right.compact.symbols.names == names
+
+
+def test_diff_session_keeps_max_results():
+    """
+    The least recently used diffs of subtrees are dropped beyond max_results, the diffs are the same.
+    """
+    running = "<data><vr><vrId>1</vrId><a>1</a></vr><ntp><b>1</b><c>1</c></ntp><snmp><d>1</d><e>1</e></snmp></data>"
+    candidates = [
+        "<data><vr><vrId>1</vrId><a>{}</a></vr><ntp><b>{}</b><c>1</c></ntp><snmp><d>{}</d><e>1</e></snmp></data>"
+        .format(number % 3, number % 4, number % 5) for number in range(30)
+    ]
+
+    session = DiffSession(left=running, max_results=5)
+    for candidate in candidates + candidates[::-1]:
+        assert session.diff(candidate) == build_xml_diff(running, candidate)
+        assert len(session.results) <= 5
+
+    # The diffs of the last candidate are the most recently used
+    session.diff(candidates[2])
+    hits = DiffStats()
+    session.diff(candidates[2], stats=hits)
+    assert hits.stored_hits == 1
+
+
+def test_diff_session_needs_one_tree():
+    with pytest.raises(ValueError):
+        DiffSession()
+
+    with pytest.raises(ValueError):
+        DiffSession(left="<data><foo>1</foo></data>", right="<data><foo>1</foo></data>")
+
+
+def test_diff_session_rediff_edited_candidate():
+    """
+    The diffs of subtrees are kept by the session, so diffing an edited candidate again only diffs the subtrees
+    changed by the edit, whilst the diff is the same as build_xml_diff().
+    """
+    running = "<data><vr><vrId>1</vrId><a>1</a></vr><ntp><b>1</b><c>1</c></ntp><snmp><d>1</d><e>1</e></snmp></data>"
+    candidate = "<data><vr><vrId>1</vrId><a>2</a></vr><ntp><b>2</b><c>1</c></ntp><snmp><d>2</d><e>1</e></snmp></data>"
+    edited = "<data><vr><vrId>1</vrId><a>2</a></vr><ntp><b>2</b><c>1</c></ntp><snmp><d>2</d><e>2</e></snmp></data>"
+
+    session = DiffSession(left=running)
+    assert session.diff(candidate) == build_xml_diff(running, candidate)
+    # The roots and the three containers
+    assert len(session.results) == 4
+
+    assert session.diff(edited) == build_xml_diff(running, edited)
+    # Only the roots and the snmp containers
+    assert len(session.results) == 6
+
+    assert session.diff(candidate) == build_xml_diff(running, candidate)
+    assert len(session.results) == 6
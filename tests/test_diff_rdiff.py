@@ -312,8 +312,8 @@ def test_rdiff_unique_tags():
             '<T><U>15</U><V>16</V><W><W_>17</W_></W><X/></T>'
         ],
         'moved': [
-            '<D><D_>4</D_></D>',
             '<C>3</C>',
+            '<D><D_>4</D_></D>',
             '<H>7</H>',
             '<I><I_>8</I_></I>',
             '<O>10</O>'
@@ -410,3 +410,48 @@ def test_rdiff_same_tag_same_content():
     }
 
     assert text_repr(rdiff(build_hashelement(left_tree), build_hashelement(right_tree))) == expected
+
+
+def test_rdiff_leaf_list():
+    """
+    In a list of leaves, leaves found on both sides are moved or same, the others are removed or added, never paired.
+    """
+    left_tree = """
+        <data>
+          <vlan>
+            <id>1</id>
+            <member>1</member>
+            <member>2</member>
+            <member>3</member>
+            <member>3</member>
+            <member>5</member>
+          </vlan>
+        </data>
+    """
+    right_tree = """
+        <data>
+          <vlan>
+            <id>1</id>
+            <member>2</member>
+            <member>1</member>
+            <member>3</member>
+            <member>4</member>
+          </vlan>
+        </data>
+    """
+
+    expected = {
+        'removed': [
+            '<member>3</member>',
+            '<member>5</member>',
+        ],
+        'added': [
+            '<member>4</member>',
+        ],
+        'moved': [
+            '<member>1</member>',
+            '<member>2</member>',
+        ],
+    }
+
+    assert text_repr(rdiff(build_hashelement(left_tree), build_hashelement(right_tree))) == expected
@@ -0,0 +1,145 @@
+"""
+Statistics of the work of a diff, see pyocnos.diffstats.
+"""
+# pylint: disable=invalid-name
+
+import logging
+
+from pyocnos import LOGGER_NAME
+from pyocnos.diff import DiffSession, build_xml_diff, build_xml_diff_with_stats
+from pyocnos.diffstats import DiffStats
+
+INTERFACES_LEFT = """
+<config>
+  <interface><name>eth1</name><mtu>1500</mtu></interface>
+  <interface><name>eth2</name><mtu>1500</mtu></interface>
+  <interface><name>eth3</name><mtu>1500</mtu></interface>
+</config>
+"""
+
+INTERFACES_RIGHT = """
+<config>
+  <interface><name>eth3</name><mtu>9216</mtu></interface>
+  <interface><name>eth2</name><mtu>9216</mtu></interface>
+  <interface><name>eth1</name><mtu>1500</mtu></interface>
+</config>
+"""
+
+# Keys of the interfaces, given to the diffs rather than relying on pyocnos.diff.ELEMENTS_WITH_FIXED_KEYS
+INTERFACE_KEYS = {'interface': [('name',)]}
+
+SNMP_LEFT = """
+<config>
+  <snmp>
+    <snmphost><host>10.1.1.1</host><version>1</version></snmphost>
+    <snmphost><host>10.2.2.2</host><version>2c</version></snmphost>
+  </snmp>
+</config>
+"""
+
+SNMP_RIGHT = """
+<config>
+  <snmp>
+    <snmphost><host>10.1.1.1</host><version>2c</version></snmphost>
+    <snmphost><host>10.2.2.2</host><version>1</version></snmphost>
+  </snmp>
+</config>
+"""
+
+
+def test_stats_keyed_lists():
+    """
+    Lists of a tag with keys are matched by their keys.
+    """
+    stats = DiffStats()
+    build_xml_diff(INTERFACES_LEFT, INTERFACES_RIGHT, INTERFACE_KEYS, stats=stats)
+    assert stats.keyed_lists == {'interface': 1}
+    assert not stats.key_fallbacks
+    assert not stats.similarity_lists
+    assert stats.hungarian_calls == 0
+    assert stats.hashed_nodes == 20
+    assert stats.rdiff_calls == 3
+    assert stats.identical_pairs == 3
+    assert list(stats.stage_times) == ['normalize', 'rdiff', 'build_diff_tree', 'render']
+
+
+def test_stats_returned_with_diff():
+    """
+    The statistics of a diff can be returned with it rather than counted in a DiffStats given.
+    """
+    diff, stats = build_xml_diff_with_stats(INTERFACES_LEFT, INTERFACES_RIGHT, INTERFACE_KEYS)
+    assert diff == build_xml_diff(INTERFACES_LEFT, INTERFACES_RIGHT, INTERFACE_KEYS)
+    assert stats.keyed_lists == {'interface': 1}
+    assert stats.rdiff_calls == 3
+
+
+def test_stats_key_fallbacks():
+    """
+    Lists of a tag with keys, where some elements miss them, are matched by similarity.
+    """
+    stats = DiffStats()
+    build_xml_diff(INTERFACES_LEFT.replace('<name>eth1</name>', ''), INTERFACES_RIGHT, INTERFACE_KEYS,
+                   stats=stats)
+    assert stats.key_fallbacks == {'interface': 1}
+    assert stats.hungarian_calls == 1
+    assert stats.hungarian_largest == (3, 3)
+
+
+def test_stats_similarity_lists():
+    """
+    Lists of a tag without keys are matched by similarity, the similarities of nodes with children are cached.
+    """
+    stats = DiffStats()
+    build_xml_diff(SNMP_LEFT, SNMP_RIGHT, stats=stats)
+    assert stats.similarity_lists == {'snmphost': 1}
+    assert stats.hungarian_calls == 1
+    assert stats.hungarian_cells == 4
+    assert stats.similarity_cache_misses == 4
+    assert stats.ordering_intersections == 4
+
+    lines = list(stats.report())
+    assert 'Tags without keys: snmphost (1)' in lines
+    assert 'Hungarian algorithm runs: 1, cells: 4, largest matrix: 2x2' in lines
+
+
+def test_stats_leaf_lists():
+    """
+    Lists of leaves are not matched by similarity.
+    """
+    stats = DiffStats()
+    build_xml_diff(
+        '<config><vlan><member>1</member><member>2</member><member>3</member></vlan></config>',
+        '<config><vlan><member>2</member><member>4</member><member>5</member></vlan></config>',
+        stats=stats,
+    )
+    assert stats.leaf_lists == {'member': 1}
+    assert not stats.similarity_lists
+    assert stats.hungarian_calls == 0
+
+
+def test_stats_session_reuses_stored_diffs():
+    """
+    A session diffing a tree again finds the diffs of its subtrees stored.
+    """
+    session = DiffSession(left=SNMP_LEFT)
+    session.diff(SNMP_RIGHT)
+    stats = DiffStats()
+    session.diff(SNMP_RIGHT, stats=stats)
+    assert stats.stored_hits == 1
+    assert stats.rdiff_calls == 0
+    assert stats.hungarian_calls == 0
+    assert stats.hashed_nodes == 8
+
+
+def test_stats_logged_at_debug_level(caplog):
+    """
+    The statistics are logged at debug level without asking for them.
+    """
+    with caplog.at_level(logging.DEBUG, logger=LOGGER_NAME):
+        build_xml_diff(SNMP_LEFT, SNMP_RIGHT)
+    assert "'similarity_lists': {'snmphost': 1}" in caplog.text
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger=LOGGER_NAME):
+        build_xml_diff(SNMP_LEFT, SNMP_RIGHT)
+    assert 'Diff statistics' not in caplog.text
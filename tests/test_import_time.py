@@ -0,0 +1,53 @@
+import os
+import re
+import subprocess
+import sys
+from unittest import TestCase
+
+# Modules only needed once a connection is opened or a config file read
+HEAVY_MODULES = ('ncclient', 'paramiko', 'cryptography', 'yaml', 'multiprocessing')
+
+# Seconds the import of the command line module may take, several times what
+# it takes without the modules above
+IMPORT_TIME_BUDGET = 1.0
+
+package_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def run_python(code, *options):
+    return subprocess.run(
+        [sys.executable] + list(options) + ['-c', code],
+        cwd=package_path, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    )
+
+
+class TestImportTime(TestCase):
+
+    def assert_no_heavy_modules(self, module):
+        code = 'import sys, {}; print(" ".join(sorted(sys.modules)))'.format(module)
+        imported = run_python(code).stdout.split()
+        self.assertEqual(
+            [], [name for name in imported if name.split('.')[0] in HEAVY_MODULES]
+        )
+
+    def test_success_diff_without_heavy_modules(self):
+        self.assert_no_heavy_modules('pyocnos.diff')
+
+    def test_success_ocnos_without_heavy_modules(self):
+        self.assert_no_heavy_modules('pyocnos.ocnos')
+
+    def test_success_command_line_without_heavy_modules(self):
+        self.assert_no_heavy_modules('pyocnos.command_line')
+
+    def test_success_command_line_within_budget(self):
+        stderr = run_python('import pyocnos.command_line', '-X', 'importtime').stderr
+        cumulative = re.search(r'\|\s*(\d+)\s*\|\s*pyocnos\.command_line$', stderr, re.MULTILINE)
+        self.assertLess(int(cumulative.group(1)) / 1e6, IMPORT_TIME_BUDGET)
+
+    def test_success_ncclient_imported_on_first_use(self):
+        code = 'import sys, pyocnos.ocnos; pyocnos.ocnos.NCClientError; print("ncclient" in sys.modules)'
+        self.assertEqual('True', run_python(code).stdout.strip())
+
+    def test_success_parsing_imported_alone(self):
+        code = 'import pyocnos.parsing; print(pyocnos.parsing.parse_xml("<config/>").tag)'
+        self.assertEqual('config', run_python(code).stdout.strip())
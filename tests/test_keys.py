@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from pyocnos.compact import CompactTree
+from pyocnos.diff import build_xml_diff
+from pyocnos.diff import normalize_tree
+from pyocnos.exceptions import OCNOSCDuplicateKeyError
+from pyocnos.exceptions import OCNOSKeysFileError
+from pyocnos.keys import ELEMENTS_WITH_FIXED_KEYS
+from pyocnos.keys import KeyExtractor
+from pyocnos.keys import load_keys
+from pyocnos.keys import register_keys
+
+KEYS_FILE = {
+    'keys': {
+        'vlan': [['vlanId']],
+    },
+    'platforms': [
+        {'platform': 'AS7712-32X', 'version': '6.4', 'keys': {'vlan': [['vlanName']], 'mac-acl': [['name']]}},
+        {'platform': 'AS5812-54X', 'keys': {'bridge': [['bridgeId']]}},
+        {'version': '6', 'keys': {'prefix-list': [['name', 'seq']]}},
+    ],
+}
+
+KEYS_YAML = """
+keys:
+  vlan:
+    - [vlanId]
+platforms:
+  - platform: AS7712-32X
+    keys:
+      mac-acl:
+        - [name]
+"""
+
+
+class TestKeyExtractor(TestCase):
+
+    def test_success_key_dict(self):
+        tree = CompactTree([normalize_tree(
+            '<data><interface><mtu>1500</mtu><name>eth1</name></interface>'
+            '<interface><ifName>eth2</ifName><name>eth3</name></interface><interface><name/></interface></data>'
+        )])
+        extractor = KeyExtractor(ELEMENTS_WITH_FIXED_KEYS['interface'], tree.symbols)
+        self.assertEqual({('eth1',): 1, ('eth2',): 2, ('None',): 3}, extractor.key_dict(tree, [1, 2, 3]))
+
+    def test_success_key_dict_with_missing_key_elements(self):
+        tree = CompactTree([normalize_tree(
+            '<data><route><prefix>10.0.0.0/8</prefix></route><route><mtu>1500</mtu></route></data>'
+        )])
+        extractor = KeyExtractor([('prefix', 'vrf', 'unknown')], tree.symbols)
+        self.assertEqual({('10.0.0.0/8', None, None): 1}, extractor.key_dict(tree, [1]))
+        self.assertIsNone(extractor.key_dict(tree, [1, 2]))
+
+    def test_fail_key_dict_when_duplicate_keys(self):
+        tree = CompactTree([normalize_tree(
+            '<data><interface><name>eth1</name></interface><interface><name>eth1</name></interface></data>'
+        )])
+        extractor = KeyExtractor(ELEMENTS_WITH_FIXED_KEYS['interface'], tree.symbols)
+        self.assertRaises(OCNOSCDuplicateKeyError, extractor.key_dict, tree, [1, 2])
+
+
+class TestLoadKeys(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as keys_file:
+            keys_file.write(content)
+        return path
+
+    def test_success_load_keys_of_platform_and_version(self):
+        path = self.write('keys.json', json.dumps(KEYS_FILE))
+        keys = load_keys(path, platform='AS7712-32X', version='6.4.1', fixed=False)
+        self.assertEqual({
+            'vlan': [('vlanName',), ('vlanId',)],
+            'mac-acl': [('name',)],
+            'prefix-list': [('name', 'seq')],
+        }, keys)
+        self.assertEqual({'vlan': [('vlanId',)]}, load_keys(path, platform='AS7712-32X', version='5.1', fixed=False))
+        self.assertEqual({'vlan': [('vlanId',)]}, load_keys(path, fixed=False))
+
+    def test_success_load_keys_merged_with_fixed_keys(self):
+        path = self.write('keys.json', json.dumps({'keys': {'interface': [['port']], 'vlan': [['vlanId']]}}))
+        keys = load_keys(path)
+        self.assertEqual([('port',)] + ELEMENTS_WITH_FIXED_KEYS['interface'], keys['interface'])
+        self.assertEqual([('vlanId',)], keys['vlan'])
+        self.assertNotIn('vlan', ELEMENTS_WITH_FIXED_KEYS)
+
+    def test_success_load_keys_from_yaml(self):
+        path = self.write('keys.yml', KEYS_YAML)
+        self.assertEqual({'vlan': [('vlanId',)], 'mac-acl': [('name',)]},
+                         load_keys(path, platform='AS7712-32X', fixed=False))
+
+    def test_fail_load_keys_when_invalid(self):
+        for name, content in (('keys.json', '{"keys": '), ('keys.yml', 'keys: [vlan'),
+                              ('keys.json', '{"keys": {"vlan": "vlanId"}}'), ('keys.json', '[]'),
+                              ('keys.json', '{"platforms": [{"platform": "AS7712-32X"}]}')):
+            with self.subTest(content=content):
+                self.assertRaises(OCNOSKeysFileError, load_keys, self.write(name, content))
+
+    def test_fail_load_keys_when_no_file(self):
+        self.assertRaises(OCNOSKeysFileError, load_keys, os.path.join(self.directory.name, 'keys.yml'))
+
+    def test_success_diff_by_loaded_keys(self):
+        path = self.write('keys.json', json.dumps({'keys': {'vlan': [['vlanId']]}}))
+        left = ('<config><vlan><vlanId>2</vlanId><name>web</name></vlan>'
+                '<vlan><vlanId>3</vlanId><name>db</name></vlan></config>')
+        right = ('<config><vlan><vlanId>2</vlanId><name>db</name></vlan>'
+                 '<vlan><vlanId>3</vlanId><name>web</name></vlan></config>')
+        self.assertEqual([
+            '[config]',
+            '  [vlan]',
+            '    <vlanId>2</vlanId>',
+            '-   <name>web</name>',
+            '+   <name>db</name>',
+            '  [vlan]',
+            '    <vlanId>3</vlanId>',
+            '-   <name>db</name>',
+            '+   <name>web</name>',
+        ], build_xml_diff(left, right, keys=load_keys(path)).splitlines())
+
+
+class TestRegisterKeys(TestCase):
+
+    def test_success_register_keys(self):
+        keys = {'vlan': [('vlanId',)]}
+        register_keys(keys, 'vlan', [('vlanName',), ('vlanId',)])
+        register_keys(keys, 'bridge', [['bridgeId']])
+        self.assertEqual({'vlan': [('vlanId',), ('vlanName',)], 'bridge': [('bridgeId',)]}, keys)
@@ -0,0 +1,113 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import mock
+
+from pyocnos.metrics import Counter
+from pyocnos.metrics import Gauge
+from pyocnos.metrics import Histogram
+from pyocnos.metrics import Metrics
+from pyocnos.metrics import MetricsRegistry
+
+
+class TestCounter(TestCase):
+
+    def test_success_inc(self):
+        counter = Counter('foo_total', 'Foo.', labelnames=('host',))
+        counter.inc(host='a')
+        counter.inc(2, host='a')
+        counter.inc(host='b')
+        self.assertEqual(3, counter.get(host='a'))
+        self.assertEqual(1, counter.get(host='b'))
+        self.assertEqual(0, counter.get(host='c'))
+
+    def test_fail_inc_with_negative_amount(self):
+        counter = Counter('foo_total', 'Foo.')
+        self.assertRaises(ValueError, counter.inc, -1)
+
+    def test_fail_inc_with_missing_label(self):
+        counter = Counter('foo_total', 'Foo.', labelnames=('host',))
+        self.assertRaises(KeyError, counter.inc)
+
+    def test_success_gauge_set(self):
+        gauge = Gauge('foo_bytes', 'Foo.', labelnames=('host',))
+        gauge.set(10, host='a')
+        gauge.set(5, host='a')
+        self.assertEqual(5, gauge.get(host='a'))
+
+
+class TestHistogram(TestCase):
+
+    def test_success_observe(self):
+        histogram = Histogram('foo_seconds', 'Foo.', labelnames=('host',), buckets=(1, 5))
+        histogram.observe(0.5, host='a')
+        histogram.observe(3, host='a')
+        histogram.observe(10, host='a')
+        self.assertEqual(3, histogram.count(host='a'))
+        self.assertEqual([
+            ('foo_seconds_bucket', [('host', 'a'), ('le', '1')], 1),
+            ('foo_seconds_bucket', [('host', 'a'), ('le', '5')], 2),
+            ('foo_seconds_bucket', [('host', 'a'), ('le', '+Inf')], 3),
+            ('foo_seconds_sum', [('host', 'a')], 13.5),
+            ('foo_seconds_count', [('host', 'a')], 3),
+        ], histogram.samples())
+
+
+class TestMetricsRegistry(TestCase):
+
+    def test_fail_register_same_name_twice(self):
+        registry = MetricsRegistry()
+        registry.register(Counter('foo_total', 'Foo.'))
+        self.assertRaises(ValueError, registry.register, Counter('foo_total', 'Foo.'))
+
+    def test_success_render(self):
+        registry = MetricsRegistry()
+        counter = registry.register(Counter('foo_total', 'Foo.', labelnames=('host',)))
+        counter.inc(host='sw"1')
+        self.assertEqual(
+            '# HELP foo_total Foo.\n'
+            '# TYPE foo_total counter\n'
+            'foo_total{host="sw\\"1"} 1\n',
+            registry.render()
+        )
+
+    def test_success_write_textfile(self):
+        registry = MetricsRegistry()
+        registry.register(Counter('foo_total', 'Foo.')).inc()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'pyocnos.prom')
+            registry.write_textfile(path)
+            self.assertEqual(['pyocnos.prom'], os.listdir(directory))
+            with open(path, encoding='utf-8') as prom_file:
+                self.assertEqual(registry.render(), prom_file.read())
+
+
+class TestMetrics(TestCase):
+
+    @mock.patch('pyocnos.metrics.time.monotonic', side_effect=[10, 12.5])
+    def test_success_time(self, _):
+        metrics = Metrics()
+        with metrics.time('connect', 'foo.com'):
+            pass
+        self.assertIn(
+            'pyocnos_operation_duration_seconds_sum{host="foo.com",operation="connect"} 2.5',
+            metrics.render()
+        )
+
+    def test_success_time_when_body_raises(self):
+        metrics = Metrics()
+        with self.assertRaises(RuntimeError):
+            with metrics.time('commit', 'foo.com'):
+                raise RuntimeError
+        self.assertEqual(1, metrics.durations.count(host='foo.com', operation='commit'))
+
+    def test_success_record_exception(self):
+        metrics = Metrics()
+        metrics.record_exception('foo.com', ValueError())
+        self.assertIn('pyocnos_exceptions_total{host="foo.com",exception="ValueError"} 1', metrics.render())
+
+    def test_success_record_retry(self):
+        metrics = Metrics()
+        metrics.record_retry('foo.com', 'commit')
+        self.assertIn('pyocnos_retries_total{host="foo.com",operation="commit"} 1', metrics.render())
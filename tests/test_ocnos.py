@@ -1,23 +1,38 @@
+import logging
 import os
 import tempfile
+import threading
 import unittest
 
-import lxml
+from lxml import etree
 import mock
 from ncclient import NCClientError
-
+from ncclient.operations.rpc import RPCError
+from ncclient.transport.errors import AuthenticationError
+from ncclient.transport.errors import SessionCloseError
+from ncclient.transport.errors import SSHError
+from ncclient.xml_ import to_ele
+
+from pyocnos import LOGGER_NAME
+from pyocnos import ocnos as ocnos_module
 from pyocnos.exceptions import OCNOSCandidateConfigInvalidError
 from pyocnos.exceptions import OCNOSCandidateConfigNotInServerCapabilitiesError
 from pyocnos.exceptions import OCNOSCandidateConfigNotLoadedError
 from pyocnos.exceptions import OCNOSConnectionError
 from pyocnos.exceptions import OCNOSLoadCandidateConfigFileReadError
 from pyocnos.exceptions import OCNOSNoCandidateConfigError
+from pyocnos.exceptions import OCNOSSaveConfigError
 from pyocnos.exceptions import OCNOSUnOpenedConnectionError
 from pyocnos.exceptions import OCNOSUnableToRetrieveConfigError
+from pyocnos.metrics import Metrics
 from pyocnos.ocnos import OCNOS
+from pyocnos.ocnos import TRANSPORT_NAMES
+from pyocnos.retry import RetryPolicy
 
 connect_path = 'pyocnos.ocnos.manager.connect'
 manager_path = 'pyocnos.ocnos.DefaultManager'
+sleep_path = 'pyocnos.ocnos.sleep'
+retry_sleep_path = 'pyocnos.retry.sleep'
 
 
 class TestOCNOS(unittest.TestCase):
@@ -72,6 +87,23 @@ class TestOCNOS(unittest.TestCase):
         self.device._connection.close_session.side_effect = NCClientError
         self.assertRaises(OCNOSConnectionError, self.device.close)
 
+    def test_fail_close_when_ncclient_not_imported_by_module(self):
+        # e.g. a connection opened elsewhere, so import_transport has not run
+        with mock.patch.dict(ocnos_module.__dict__):
+            for name in TRANSPORT_NAMES:
+                ocnos_module.__dict__.pop(name, None)
+            self.device._connection = mock.MagicMock()
+            self.device._connection.close_session.side_effect = NCClientError
+            self.assertRaises(OCNOSConnectionError, self.device.close)
+
+    def test_success_transport_error_while_names_being_imported(self):
+        # e.g. another thread has bound manager but not the other names yet
+        with mock.patch.dict(ocnos_module.__dict__):
+            for name in TRANSPORT_NAMES[1:]:
+                ocnos_module.__dict__.pop(name, None)
+            self.assertIs(NCClientError, ocnos_module.transport_error())
+            self.assertIn('DefaultManager', ocnos_module.__dict__)
+
     def test_is_alive_when_open_not_called(self):
         self.assertFalse(self.device.is_alive())
 
@@ -89,6 +121,15 @@ class TestOCNOS(unittest.TestCase):
             self.device.open()
             self.assertIsNotNone(self.device.get_config('running'))
 
+    def test_success_get_config_with_subtree(self):
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect:
+            get_config_mock = mock_manager_connect.return_value.get_config
+            get_config_mock.return_value.data_xml = '<data><vr>1</vr></data>'
+            self.device.open()
+            self.device.get_config('running', subtree='<vr/>')
+            get_config_mock.assert_called_once_with(source='running', with_defaults='trim',
+                                                    filter=('subtree', '<vr/>'))
+
     def test_fail_get_config_when_no_connection(self):
         self.assertRaises(OCNOSUnOpenedConnectionError, self.device.get_config)
 
@@ -114,14 +155,26 @@ class TestOCNOS(unittest.TestCase):
             self.device.load_candidate_config(filename=config_file.name)
         self.assertEqual(
             '<config>foo</config>',
-            lxml.etree.tostring(self.device._candidate_config).decode()
+            etree.tostring(self.device._candidate_config).decode()
         )
 
+    def test_success_load_candidate_config_file_shared_by_devices(self):
+        other_device = OCNOS(hostname='hostname', username='username', password='password')
+        with tempfile.NamedTemporaryFile() as config_file:
+            config_file.write(b'<config>foo</config>')
+            config_file.flush()
+            self.device.load_candidate_config(filename=config_file.name)
+            other_device.load_candidate_config(filename=config_file.name)
+        self.assertIs(self.device._candidate, other_device._candidate)
+        # Each device sends its own copy of the tree
+        self.assertIsNot(self.device._candidate_config, other_device._candidate_config)
+        self.assertIs(self.device._candidate_config, self.device._candidate_config)
+
     def test_success_load_candidate_config_a_string(self):
         self.device.load_candidate_config(config='<config>foo</config>')
         self.assertEqual(
             '<config>foo</config>',
-            lxml.etree.tostring(self.device._candidate_config).decode()
+            etree.tostring(self.device._candidate_config).decode()
         )
 
     def test_fail_commit_config_when_no_candidate_config_loaded(self):
@@ -210,6 +263,117 @@ class TestOCNOS(unittest.TestCase):
             source='running'
         )
 
+    def commit_twice(self, device):
+        device.open()
+        device.load_candidate_config(config='<config></config>')
+        device._connection.server_capabilities = [':candidate']
+        device.commit_config()
+        device.commit_config(replace_config=True)
+
+    def test_success_commit_config_persist_deferred(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', persist='deferred')
+        with mock.patch(connect_path), mock.patch(sleep_path), mock.patch(manager_path) as mock_manager_connect:
+            instance = mock_manager_connect.return_value
+            self.commit_twice(device)
+            instance.copy_config.assert_not_called()
+
+            self.assertTrue(device.save())
+            self.assertFalse(device.save())
+            device.close()
+        instance.copy_config.assert_called_once_with(target='startup', source='running')
+
+    def test_success_commit_config_persist_deferred_saved_on_close(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', persist='deferred')
+        with mock.patch(connect_path), mock.patch(sleep_path), mock.patch(manager_path) as mock_manager_connect:
+            instance = mock_manager_connect.return_value
+            self.commit_twice(device)
+            device.close()
+        instance.copy_config.assert_called_once_with(target='startup', source='running')
+        instance.close_session.assert_called_once_with()
+
+    def test_success_commit_config_persist_deferred_in_background(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', persist='deferred',
+                       persist_delay=0.01)
+        saved = threading.Event()
+        with mock.patch(connect_path), mock.patch(sleep_path), mock.patch(manager_path) as mock_manager_connect:
+            instance = mock_manager_connect.return_value
+            instance.copy_config.side_effect = lambda **_: saved.set()
+            self.commit_twice(device)
+            self.assertTrue(saved.wait(5))
+            device.close()
+        instance.copy_config.assert_called_once_with(target='startup', source='running')
+
+    def test_success_commit_config_persist_never(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', persist='never')
+        with mock.patch(connect_path), mock.patch(sleep_path), mock.patch(manager_path) as mock_manager_connect:
+            instance = mock_manager_connect.return_value
+            self.commit_twice(device)
+            self.assertFalse(device.save())
+            device.close()
+        instance.copy_config.assert_not_called()
+
+    def test_fail_close_when_deferred_save_fails(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', persist='deferred')
+        with mock.patch(connect_path), mock.patch(sleep_path), mock.patch(manager_path) as mock_manager_connect:
+            instance = mock_manager_connect.return_value
+            instance.copy_config.side_effect = NCClientError
+            self.commit_twice(device)
+            self.assertRaises(OCNOSSaveConfigError, device.close)
+        # The connection is closed all the same
+        instance.close_session.assert_called_once_with()
+        self.assertFalse(device.is_alive())
+
+    def test_success_open_retried(self):
+        metrics = Metrics()
+        device = OCNOS(hostname='hostname', username='username', password='password',
+                       retry=RetryPolicy(attempts=3), metrics=metrics)
+        with mock.patch(manager_path), mock.patch(retry_sleep_path), mock.patch(connect_path) as mock_manager_connect:
+            mock_manager_connect.side_effect = [SSHError, SSHError, mock.MagicMock()]
+            device.open()
+        self.assertEqual(3, mock_manager_connect.call_count)
+        self.assertEqual(2, metrics.retries.get(host='hostname', operation='connect'))
+
+    def test_fail_open_not_retried_when_authentication_fails(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', retry=RetryPolicy(attempts=3))
+        with mock.patch(manager_path), mock.patch(retry_sleep_path), mock.patch(connect_path) as mock_manager_connect:
+            mock_manager_connect.side_effect = AuthenticationError
+            self.assertRaises(OCNOSConnectionError, device.open)
+        mock_manager_connect.assert_called_once()
+
+    def test_success_commit_config_retried_when_candidate_locked(self):
+        lock_denied = RPCError(to_ele(
+            '<rpc-error xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><error-type>protocol</error-type>'
+            '<error-tag>lock-denied</error-tag><error-severity>error</error-severity></rpc-error>'
+        ))
+        device = OCNOS(hostname='hostname', username='username', password='password',
+                       retry={'commit': RetryPolicy(attempts=2)})
+        with mock.patch(connect_path), mock.patch(retry_sleep_path), mock.patch(manager_path) as mock_manager_connect:
+            instance = mock_manager_connect.return_value
+            instance.locked.return_value.__enter__.side_effect = [lock_denied, None]
+            device.open()
+            device.load_candidate_config(config='<config></config>')
+            device._connection.server_capabilities = [':candidate']
+            device.commit_config()
+            device.close()
+        self.assertEqual(2, instance.locked.call_count)
+        instance.commit.assert_called_once_with()
+
+    def test_fail_get_config_not_retried_when_session_closed(self):
+        device = OCNOS(hostname='hostname', username='username', password='password',
+                       retry=RetryPolicy(attempts=3))
+        with mock.patch(connect_path), mock.patch(retry_sleep_path) as mock_sleep, \
+                mock.patch(manager_path) as mock_manager_connect:
+            get_config_mock = mock_manager_connect.return_value.get_config
+            get_config_mock.side_effect = SessionCloseError('Unexpected session close')
+            device.open()
+            self.assertRaises(OCNOSUnableToRetrieveConfigError, device.get_config, 'running')
+        get_config_mock.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    def test_fail_persist_mode_unknown(self):
+        self.assertRaises(ValueError, OCNOS, hostname='hostname', username='username', password='password',
+                          persist='later')
+
     def test_fail_compare_config_when_no_candidate_config_loaded(self):
         self.assertRaises(OCNOSCandidateConfigNotLoadedError, self.device.compare_config)
 
@@ -230,15 +394,69 @@ class TestOCNOS(unittest.TestCase):
                 '+   <vrf>2</vrf>']
             self.assertEqual('{}'.format(os.linesep).join(expected), self.device.compare_config())
 
+    def test_success_compare_config_with_given_running_config(self):
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect:
+            self.device.open()
+            self.device.load_candidate_config(config='<config><vr><vrf>2</vrf></vr></config>')
+            running = '<?xml version="1.0" encoding="UTF-8"?>\n<data><vr><vrf>1</vrf></vr></data>\n'
+            expected = [
+                '[config]',
+                '  [vr]',
+                '-   <vrf>1</vrf>',
+                '+   <vrf>2</vrf>']
+            self.assertEqual('{}'.format(os.linesep).join(expected), self.device.compare_config(running=running))
+            mock_manager_connect.return_value.get_config.assert_not_called()
+
+    def test_success_compare_config_concurrently_with_one_candidate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            candidate_path = os.path.join(directory, 'candidate.xml')
+            with open(candidate_path, 'w', encoding='utf-8') as candidate_file:
+                candidate_file.write('<config><vr><vrId>1</vrId></vr>{}</config>'.format(
+                    ''.join('<vlan><id>{0}</id><name>v{0}</name></vlan>'.format(i) for i in range(20))))
+            devices = []
+            for _ in range(16):
+                device = OCNOS(hostname='hostname', username='username', password='password')
+                device._connection = mock.MagicMock()
+                device.load_candidate_config(filename=candidate_path)
+                devices.append(device)
+        # The devices share the candidate prepared once
+        self.assertEqual(1, len({id(device._candidate.prepared) for device in devices}))
+        running = '<data><vr><vrId>1</vrId></vr><vlan><id>0</id><name>v0</name></vlan></data>'
+        expected = devices[0].compare_config(running=running)
+        self.assertIn('+ <vlan>', expected)
+        results = []
+
+        def compare(device):
+            results.extend(device.compare_config(running=running) for _ in range(80))
+
+        threads = [threading.Thread(target=compare, args=(device,)) for device in devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(16 * 80, results.count(expected))
+
+    def test_success_compare_config_huge_tree(self):
+        deep = '<a>' * 300 + '</a>' * 300
+        device = OCNOS(hostname='hostname', username='username', password='password', huge_tree=True)
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect:
+            get_config_mock = mock_manager_connect.return_value.get_config.return_value = mock.MagicMock()
+            get_config_mock.data_xml = '<data>{}</data>'.format(deep)
+            device.open()
+            device.load_candidate_config(config='<config>{}</config>'.format(deep))
+            self.assertEqual('', device.compare_config())
+            self.assertRaises(etree.XMLSyntaxError, self.device.load_candidate_config,
+                              config='<config>{}</config>'.format(deep))
+
     def test_success_get_config_for_startup(self):
         with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect:
             get_config_mock = mock_manager_connect.return_value.get_config.return_value = mock.MagicMock()
             get_config_mock.data_xml = '<vr>1</vr>'
             self.device.open()
 
-            config_element = lxml.etree.Element('config')
+            config_element = etree.Element('config')
             config_element.text = '1'
-            expected = lxml.etree.tostring(config_element, encoding='UTF-8', pretty_print=True).decode()
+            expected = etree.tostring(config_element, encoding='UTF-8', pretty_print=True).decode()
             self.assertEqual(expected, self.device.get_config('startup')['startup'])
 
     def test_success_get_config_for_all_option(self):
@@ -246,10 +464,10 @@ class TestOCNOS(unittest.TestCase):
             get_config_mock = mock_manager_connect.return_value.get_config.return_value = mock.MagicMock()
             get_config_mock.data_xml = '<data><vr>1</vr></data>'
             self.device.open()
-            config_element = lxml.etree.Element('config')
-            vr = lxml.etree.SubElement(config_element, 'vr')
+            config_element = etree.Element('config')
+            vr = etree.SubElement(config_element, 'vr')
             vr.text = '1'
-            config_str = lxml.etree.tostring(config_element, encoding='UTF-8', pretty_print=True).decode()
+            config_str = etree.tostring(config_element, encoding='UTF-8', pretty_print=True).decode()
             expected = {
                 'running': config_str,
                 'startup': config_str,
@@ -265,10 +483,10 @@ class TestOCNOS(unittest.TestCase):
             get_config_mock = mock_manager_connect.return_value.get_config.return_value = mock.MagicMock()
             get_config_mock.data_xml = '<data><vr>1</vr></data>'
             self.device.open()
-            config_element = lxml.etree.Element('config')
-            vr = lxml.etree.SubElement(config_element, 'vr')
+            config_element = etree.Element('config')
+            vr = etree.SubElement(config_element, 'vr')
             vr.text = '1'
-            config_str = lxml.etree.tostring(config_element, encoding='UTF-8', pretty_print=True).decode()
+            config_str = etree.tostring(config_element, encoding='UTF-8', pretty_print=True).decode()
             expected = {
                 'running': config_str,
                 'startup': '',
@@ -281,7 +499,78 @@ class TestOCNOS(unittest.TestCase):
 
     def test_success_discard_config(self):
         self.device.load_candidate_config(config='<config>foo</config>')
-        self.assertEqual('<config>foo</config>', lxml.etree.tostring(self.device._candidate_config).decode())
+        self.assertEqual('<config>foo</config>', etree.tostring(self.device._candidate_config).decode())
 
         self.device.discard_config()
         self.assertIsNone(self.device._candidate_config)
+
+    def test_fail_load_list_keys_when_no_connection(self):
+        self.assertRaises(OCNOSUnOpenedConnectionError, self.device.load_list_keys)
+
+    def test_success_load_list_keys(self):
+        schemas = {
+            'ipi-vlan': 'module ipi-vlan { include ipi-vlan-types; list vlan { key "vlan-id"; } '
+                        'list entry { key "id"; } }',
+            'ipi-vlan-types': 'submodule ipi-vlan-types { list range { key "from to"; } list entry { key "name"; } }',
+        }
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect, \
+                tempfile.TemporaryDirectory() as cache_dir:
+            instance = mock_manager_connect.return_value
+            instance.server_capabilities = [
+                'urn:ietf:params:netconf:base:1.0',
+                'http://www.ipinfusion.com/yang/ocnos/ipi-vlan?module=ipi-vlan&revision=2019-09-01',
+                'urn:ietf:params:xml:ns:yang:ietf-inet-types?module=ietf-inet-types',
+            ]
+
+            def get_schema(identifier, version=None):
+                if identifier not in schemas:
+                    raise NCClientError
+                return mock.MagicMock(data=schemas[identifier])
+
+            instance.get_schema.side_effect = get_schema
+            self.device.open()
+            with self.assertLogs(LOGGER_NAME, logging.WARNING) as logs:
+                keys = self.device.load_list_keys(cache_dir=cache_dir)
+            self.assertIn('different keys, paired by similarity: entry', logs.output[-1])
+            self.assertNotIn('entry', keys)
+            self.assertEqual(3, instance.get_schema.call_count)
+            self.assertEqual([('vlan-id',)], keys['vlan'])
+            self.assertEqual([('from', 'to')], keys['range'])
+            self.assertEqual([('ifName',), ('name',), ('interface-name',)], keys['interface'])
+            self.assertIs(keys, self.device.list_keys)
+
+            # The second time the keys are read from cache
+            self.device.list_keys = None
+            self.assertEqual(keys, self.device.load_list_keys(cache_dir=cache_dir))
+            self.assertEqual(3, instance.get_schema.call_count)
+
+    def test_success_compare_config_with_discovered_list_keys(self):
+        device = OCNOS(hostname='hostname', username='username', password='password', discover_list_keys=True)
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect, \
+                mock.patch.object(OCNOS, 'load_list_keys') as mock_load_list_keys, \
+                mock.patch('pyocnos.ocnos.diff_prepared') as mock_diff_prepared:
+            get_config_mock = mock_manager_connect.return_value.get_config.return_value = mock.MagicMock()
+            get_config_mock.data_xml = '<data><vr><vrf>1</vrf></vr></data>'
+            device.open()
+            device.load_candidate_config(config='<config><vr><vrf>2</vrf></vr></config>')
+            device.compare_config()
+        mock_load_list_keys.assert_called_once_with()
+        self.assertIsNone(mock_diff_prepared.call_args[1]['keys'])
+
+    def test_success_compare_config_with_given_keys(self):
+        keys = {'vlan': [('vlanId',)]}
+        device = OCNOS(hostname='hostname', username='username', password='password', keys=keys)
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager_connect, \
+                mock.patch('pyocnos.ocnos.diff_prepared') as mock_diff_prepared, \
+                tempfile.TemporaryDirectory() as cache_dir:
+            instance = mock_manager_connect.return_value
+            instance.get_config.return_value.data_xml = '<data><vr><vrf>1</vrf></vr></data>'
+            instance.server_capabilities = ['http://www.ipinfusion.com/yang/ocnos/ipi-vlan?module=ipi-vlan']
+            instance.get_schema.return_value = mock.MagicMock(data='module ipi-vlan { list vlan { key "vlan-id"; } }')
+            device.open()
+            device.load_candidate_config(config='<config><vr><vrf>2</vrf></vr></config>')
+            device.compare_config()
+            self.assertIs(keys, mock_diff_prepared.call_args[1]['keys'])
+
+            # Discovered keys are tried after the given ones, which replace the fixed keys
+            self.assertEqual({'vlan': [('vlanId',), ('vlan-id',)]}, device.load_list_keys(cache_dir=cache_dir))
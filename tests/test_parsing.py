@@ -0,0 +1,101 @@
+import io
+import logging
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from lxml import etree
+import mock
+
+from pyocnos import LOGGER_NAME
+from pyocnos import parsing
+from pyocnos.candidate import parse_candidate_config
+from pyocnos.parsing import enable_huge_tree
+from pyocnos.parsing import log_parsed
+from pyocnos.parsing import parse_xml
+from pyocnos.parsing import xml_parser
+
+
+def write_config(file, interfaces):
+    """ Write a config with many interfaces, as a device of a large fabric has """
+    file.write(b'<data xmlns="http://www.ipinfusion.com/yang/ocnos/ipi-interface">')
+    for index in range(interfaces):
+        file.write(
+            '<interface><name>eth{0}</name><config><name>eth{0}</name><description>uplink {0} of the fabric'
+            '</description><mtu>9216</mtu></config></interface>'.format(index).encode()
+        )
+    file.write(b'</data>')
+
+
+class TestParsing(TestCase):
+
+    def setUp(self):
+        self.addCleanup(enable_huge_tree, parsing.HUGE_TREE)
+        enable_huge_tree(False)
+
+    def test_success_parser_reused_per_thread(self):
+        parser = xml_parser()
+        self.assertIs(parser, xml_parser())
+        self.assertIsNot(parser, xml_parser(huge_tree=True))
+        other = []
+        thread = threading.Thread(target=lambda: other.append(xml_parser()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(parser, other[0])
+
+    def test_success_parse_sources(self):
+        xml = '<?xml version="1.0" encoding="UTF-8"?>\n<config>\n  <vr><vrId>0</vrId></vr>\n</config>'
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.xml')
+            with open(path, 'w') as file:
+                file.write(xml)
+            with open(path, 'rb') as file:
+                from_file = parse_xml(file)
+            sources = [xml, xml.encode(), io.BytesIO(xml.encode()), from_file]
+            for root in [parse_xml(source) for source in sources[:3]] + [from_file]:
+                self.assertEqual(b'<config><vr><vrId>0</vrId></vr></config>', etree.tostring(root))
+
+    def test_success_huge_tree(self):
+        deep = '<config>{}</config>'.format('<a>' * 300 + '</a>' * 300)
+        self.assertRaises(etree.XMLSyntaxError, parse_xml, deep)
+        self.assertEqual(301, sum(1 for _ in parse_xml(deep, huge_tree=True).iter()))
+        enable_huge_tree()
+        self.assertEqual(301, sum(1 for _ in parse_xml(deep).iter()))
+        self.assertRaises(etree.XMLSyntaxError, parse_xml, deep, huge_tree=False)
+
+    def test_success_log_parsed(self):
+        root = parse_xml('<config><vr><vrId>0</vrId></vr></config>')
+        with self.assertLogs(LOGGER_NAME, logging.DEBUG) as logs:
+            log_parsed('running config of switch1', 42, root)
+        self.assertRegex(logs.output[0], r'Parsed running config of switch1: 42 bytes, 3 elements, peak memory \d+ MB')
+
+    def test_success_log_parsed_skipped_unless_debug(self):
+        root = mock.Mock()
+        logging.getLogger(LOGGER_NAME).setLevel(logging.INFO)
+        self.addCleanup(logging.getLogger(LOGGER_NAME).setLevel, logging.NOTSET)
+        log_parsed('running config of switch1', 42, root)
+        root.iter.assert_not_called()
+
+
+class TestParsingLargeConfig(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'candidate.xml')
+        cls.interfaces = 720000
+        with open(cls.path, 'wb') as file:
+            write_config(file, cls.interfaces)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_success_large_candidate_streamed(self):
+        self.assertGreater(os.path.getsize(self.path), 100 * 2 ** 20)
+        candidate = parse_candidate_config(filename=self.path, huge_tree=True)
+        self.assertEqual('config', candidate.tag)
+        self.assertEqual(self.interfaces, len(candidate))
+
+        self.assertEqual('eth{}'.format(self.interfaces - 1), candidate[-1][0].text)
@@ -0,0 +1,117 @@
+"""
+This test module covers tests cases for pyocnos.render
+"""
+# pylint: disable=invalid-name
+
+import json
+import os
+
+from lxml import etree
+import pytest
+
+from pyocnos.diff import build_xml_diff
+from pyocnos.render import iter_xml_diff, left_path, left_steps, register_renderer, RENDERERS
+
+LEFT = """
+<data>
+  <vr>
+    <vrId>1</vrId>
+    <vrHostname>foo</vrHostname>
+  </vr>
+  <vr>
+    <vrId>2</vrId>
+    <vrHostname>bar</vrHostname>
+  </vr>
+</data>
+"""
+
+RIGHT = """
+<data>
+  <vr>
+    <vrId>1</vrId>
+    <vrHostname>foo</vrHostname>
+  </vr>
+  <vr>
+    <vrId>2</vrId>
+    <vrHostname>tar</vrHostname>
+    <snmp><enabled/></snmp>
+  </vr>
+</data>
+"""
+
+
+def test_render_text_same_as_build_xml_diff():
+    """
+    The lines of the text format are the lines of build_xml_diff, and are rendered one by one.
+    """
+    lines = iter_xml_diff(LEFT, RIGHT)
+    assert not isinstance(lines, list)
+    assert os.linesep.join(lines) == build_xml_diff(LEFT, RIGHT)
+
+
+def test_render_no_differences():
+    """
+    Nothing is rendered in any format if the trees are the same.
+    """
+    for output_format in ('text', 'jsonl', 'unified'):
+        assert not list(iter_xml_diff(LEFT, LEFT, output_format=output_format))
+
+
+def test_render_jsonl():
+    """
+    Every changed element is a JSON object with its change type, its path in the left tree and its xml.
+    """
+    records = [json.loads(line) for line in iter_xml_diff(LEFT, RIGHT, output_format='jsonl')]
+    assert records == [
+        {'change': 'removed', 'path': '/data/vr[2]/vrHostname', 'xml': '<vrHostname>bar</vrHostname>'},
+        {'change': 'added', 'path': '/data/vr[2]/vrHostname', 'xml': '<vrHostname>tar</vrHostname>'},
+        {'change': 'added', 'path': '/data/vr[2]/snmp', 'xml': '<snmp><enabled/></snmp>'},
+    ]
+
+
+def test_render_unified():
+    """
+    The changed elements are grouped by their parent, with the key elements of the parent as context.
+    """
+    keys = {'vr': [('vrId',)]}
+    assert list(iter_xml_diff(LEFT, RIGHT, keys=keys, output_format='unified', labels=('a.xml', 'b.xml'))) == [
+        '--- a.xml',
+        '+++ b.xml',
+        '@@ /data/vr[2] @@',
+        '  <vrId>2</vrId>',
+        '- <vrHostname>bar</vrHostname>',
+        '+ <vrHostname>tar</vrHostname>',
+        '+ <snmp>',
+        '+   <enabled/>',
+        '+ </snmp>',
+    ]
+
+
+def test_render_left_path():
+    """
+    Added elements are not counted in the positions of their siblings, which are counted once per parent.
+    """
+    tree_diff = etree.fromstring(
+        '<data><vr change="added"/><vr/><vr><vrId change="removed"/></vr><vr change="removed"/><snmp/></data>'
+    )
+    steps = {}
+    paths = [left_path(elem, steps) for elem in tree_diff.iter()]
+    assert paths == ['/data', '/data/vr', '/data/vr[1]', '/data/vr[2]', '/data/vr[2]/vrId', '/data/vr[3]',
+                     '/data/snmp']
+    assert paths == [left_path(elem) for elem in tree_diff.iter()]
+    assert list(steps) == [tree_diff, tree_diff[2]]
+    assert sorted(left_steps(tree_diff).values()) == ['snmp', 'vr[1]', 'vr[2]', 'vr[3]']
+
+
+def test_render_register_renderer():
+    """
+    More output formats can be added, unknown ones are refused before diffing.
+    """
+    with pytest.raises(ValueError):
+        iter_xml_diff(LEFT, RIGHT, output_format='count')
+
+    register_renderer('count', lambda tree_diff, keys, labels: [str(len(tree_diff.xpath('//*[@change]')))])
+    try:
+        assert list(iter_xml_diff(LEFT, RIGHT, output_format='count')) == ['3']
+    finally:
+        del RENDERERS['count']
@@ -0,0 +1,96 @@
+from unittest import TestCase
+
+import mock
+from ncclient.operations.rpc import RPCError
+from ncclient.operations.rpc import RPCReply
+from ncclient.transport.errors import AuthenticationError
+from ncclient.transport.errors import SessionCloseError
+from ncclient.transport.errors import SSHError
+from ncclient.xml_ import to_ele
+
+from pyocnos.exceptions import OCNOSCandidateConfigInvalidError
+from pyocnos.retry import retry_policies
+from pyocnos.retry import RetryPolicy
+
+sleep_path = 'pyocnos.retry.sleep'
+
+
+def rpc_error(*tags):
+    errors = ''.join(
+        '<rpc-error><error-type>protocol</error-type><error-tag>{}</error-tag>'
+        '<error-severity>error</error-severity></rpc-error>'.format(tag) for tag in tags
+    )
+    reply = RPCReply(
+        '<rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0" message-id="1">{}</rpc-reply>'.format(errors)
+    )
+    reply.parse()
+    if len(reply.errors) == 1:
+        return reply.errors[0]
+    return RPCError(to_ele(reply.xml), errs=reply.errors)
+
+
+class TestRetryPolicy(TestCase):
+
+    def test_success_is_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable(SSHError()))
+        self.assertFalse(policy.is_retryable(AuthenticationError()))
+        self.assertTrue(policy.is_retryable(rpc_error('lock-denied')))
+        self.assertFalse(policy.is_retryable(rpc_error('invalid-value')))
+        self.assertFalse(policy.is_retryable(rpc_error('in-use', 'invalid-value')))
+        self.assertTrue(policy.is_retryable(OCNOSCandidateConfigInvalidError('', rpc_error('lock-denied'))))
+
+    def test_success_delay(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        with mock.patch('pyocnos.retry.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([1, 2, 4, 5], [policy.delay(attempt) for attempt in range(1, 5)])
+
+    @mock.patch(sleep_path)
+    def test_success_call_after_retries(self, mock_sleep):
+        func = mock.Mock(side_effect=[SSHError(), rpc_error('lock-denied'), 'reply'])
+        on_retry = mock.Mock()
+        self.assertEqual('reply', RetryPolicy(attempts=3).call(func, on_retry))
+        self.assertEqual(3, func.call_count)
+        self.assertEqual([1, 2], [call[0][0] for call in on_retry.call_args_list])
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @mock.patch(sleep_path)
+    def test_fail_call_when_attempts_exhausted(self, mock_sleep):
+        func = mock.Mock(side_effect=SSHError)
+        self.assertRaises(SSHError, RetryPolicy(attempts=3).call, func)
+        self.assertEqual(3, func.call_count)
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @mock.patch(sleep_path)
+    def test_fail_call_when_not_retryable(self, mock_sleep):
+        func = mock.Mock(side_effect=AuthenticationError)
+        self.assertRaises(AuthenticationError, RetryPolicy(attempts=3).call, func)
+        func.assert_called_once_with()
+        mock_sleep.assert_not_called()
+
+    @mock.patch(sleep_path)
+    def test_fail_call_in_session_when_session_lost(self, mock_sleep):
+        func = mock.Mock(side_effect=[rpc_error('in-use'), SessionCloseError('Unexpected session close'), 'reply'])
+        self.assertRaises(SessionCloseError, RetryPolicy(attempts=3).call, func, in_session=True)
+        self.assertEqual(2, func.call_count)
+        mock_sleep.assert_called_once()
+
+    @mock.patch(sleep_path)
+    @mock.patch('pyocnos.retry.monotonic', side_effect=[0, 5, 12])
+    def test_fail_call_when_deadline_reached(self, _, mock_sleep):
+        func = mock.Mock(side_effect=SSHError)
+        policy = RetryPolicy(attempts=10, base_delay=1, max_delay=1, deadline=10)
+        with mock.patch('pyocnos.retry.random.uniform', return_value=1):
+            self.assertRaises(SSHError, policy.call, func)
+        self.assertEqual(2, func.call_count)
+        mock_sleep.assert_called_once_with(1)
+
+    def test_fail_no_attempt(self):
+        self.assertRaises(ValueError, RetryPolicy, attempts=0)
+
+    def test_success_retry_policies(self):
+        policies = retry_policies(3, deadline=60)
+        self.assertEqual({'connect', 'fetch', 'commit', 'save'}, set(policies))
+        self.assertIn('TimeoutExpiredError', policies['fetch'].retryable_errors)
+        self.assertNotIn('TimeoutExpiredError', policies['commit'].retryable_errors)
+        self.assertEqual(60, policies['save'].deadline)
@@ -0,0 +1,115 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from pyocnos.schema import capability_modules
+from pyocnos.schema import load_cached_keys
+from pyocnos.schema import merge_keys
+from pyocnos.schema import parse_yang
+from pyocnos.schema import save_cached_keys
+from pyocnos.schema import schema_version
+from pyocnos.schema import tokenize_yang
+from pyocnos.schema import unambiguous_keys
+
+YANG_MODULE = """
+module ipi-interface {
+  namespace "http://www.ipinfusion.com/yang/ocnos/ipi-interface";
+  prefix ipi-if;
+  include ipi-interface-types;
+
+  // list of interfaces { key "bogus"; }
+  grouping interface-grouping {
+    list interface {
+      key "name";
+      description
+        "List of interfaces, " +
+        'the key is "name"; not anything else';
+      leaf name { type string; }
+      container ipv4 {
+        list address {
+          key "ip ipi-if:prefix-length";
+          leaf ip { type string; }
+        }
+      }
+    }
+  }
+  /* list vlan {
+       key "vlan-id";
+     } */
+  list interface {
+    key name;
+  }
+  container vlans {
+    key "not-a-list";
+  }
+}
+"""
+
+
+class TestParseYang(TestCase):
+
+    def test_success_tokenize_concatenated_strings(self):
+        tokens = list(tokenize_yang('description "foo " + \'bar\';'))
+        self.assertEqual([(False, 'description'), (False, 'foo bar'), (True, ';')], tokens)
+
+    def test_success_tokenize_escaped_strings(self):
+        tokens = list(tokenize_yang(r'pattern "a\"b\\c";'))
+        self.assertEqual([(False, 'pattern'), (False, 'a"b\\c'), (True, ';')], tokens)
+
+    def test_success_parse_yang(self):
+        keys, includes = parse_yang(YANG_MODULE)
+        self.assertEqual({
+            'interface': [('name',)],
+            'address': [('ip', 'prefix-length')],
+        }, keys)
+        self.assertEqual(['ipi-interface-types'], includes)
+
+
+class TestMergeKeys(TestCase):
+
+    def test_success_merge_keys_in_order_without_duplicates(self):
+        merged = merge_keys(
+            {'interface': [('ifName',), ('name',)]},
+            {'interface': [('name',), ('interface-name',)], 'address': [['ip']]},
+        )
+        self.assertEqual({
+            'interface': [('ifName',), ('name',), ('interface-name',)],
+            'address': [('ip',)],
+        }, merged)
+
+
+    def test_success_unambiguous_keys(self):
+        keys = merge_keys({'vlan': [('vlan-id',)], 'entry': [('id',)]}, {'entry': [('name',)], 'vlan': [('vlan-id',)]})
+        self.assertEqual(({'vlan': [('vlan-id',)]}, ['entry']), unambiguous_keys(keys))
+
+
+class TestSchemaVersion(TestCase):
+
+    def test_success_capability_modules(self):
+        capabilities = [
+            'urn:ietf:params:netconf:base:1.0',
+            'urn:ietf:params:netconf:capability:candidate:1.0',
+            'http://www.ipinfusion.com/yang/ocnos/ipi-vlan?module=ipi-vlan&revision=2019-09-01',
+            'urn:ietf:params:xml:ns:yang:ietf-inet-types?module=ietf-inet-types',
+        ]
+        self.assertEqual(
+            [('ietf-inet-types', None), ('ipi-vlan', '2019-09-01')],
+            capability_modules(capabilities)
+        )
+
+    def test_success_schema_version_depends_on_revisions(self):
+        version = schema_version([('ipi-vlan', '2019-09-01')])
+        self.assertEqual(version, schema_version([('ipi-vlan', '2019-09-01')]))
+        self.assertNotEqual(version, schema_version([('ipi-vlan', '2020-09-01')]))
+
+
+class TestCachedKeys(TestCase):
+
+    def test_success_save_and_load_cached_keys(self):
+        keys = {'address': [('ip', 'prefix-length')]}
+        with tempfile.TemporaryDirectory() as directory:
+            cache_dir = os.path.join(directory, 'pyocnos')
+            self.assertIsNone(load_cached_keys(cache_dir, 'abc'))
+            save_cached_keys(cache_dir, 'abc', keys)
+            self.assertEqual(keys, load_cached_keys(cache_dir, 'abc'))
+            self.assertIsNone(load_cached_keys(cache_dir, 'xyz'))
@@ -1,6 +1,8 @@
 from lxml import etree
+import mock
 from pytest import approx
 
+from pyocnos.compact import CompactTree
 from pyocnos.similarity import *
 
 
@@ -113,3 +115,122 @@ def test_similarity_recursion():
               (1, 0),
               (2, 3)
     ]
+
+
+def test_similarity_nodes_identical_subtrees():
+    tree_a, tree_b = CompactTree.pair(
+        [etree.XML('<data><foo><tar>100</tar></foo></data>')],
+        [etree.XML('<data><foo><tar>100</tar></foo></data>')]
+    )
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    with mock.patch.object(NodeSimilarity, 'array') as mock_array:
+        assert similarity.element(0, 0) == 1
+    mock_array.assert_not_called()
+    assert not similarity.cache
+
+
+def test_similarity_nodes_cached_by_hashes():
+    tree_a, tree_b = CompactTree.pair(
+        [etree.XML('<data><foo><tar>100</tar><kil>1</kil></foo></data>')],
+        [etree.XML('<data><foo><tar>100</tar><kil>2</kil></foo></data>')]
+    )
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    assert similarity.element(0, 0) == approx(0.5, 0.01)
+    assert similarity.cache == {
+        (tree_a.hashes[0], tree_b.hashes[0]): approx(0.5, 0.01),
+        (tree_a.hashes[1], tree_b.hashes[1]): approx(0.5, 0.01),
+    }
+    with mock.patch.object(NodeSimilarity, 'array') as mock_array:
+        assert similarity.element(0, 0) == approx(0.5, 0.01)
+    mock_array.assert_not_called()
+
+
+def snmp_hosts(hosts):
+    return etree.XML('<snmp>{}</snmp>'.format(''.join(
+        '<snmphost><host>{}</host><version>2c</version><community>{}</community></snmphost>'.format(host, community)
+        for host, community in hosts
+    )))
+
+
+def test_similarity_indexes_blocked():
+    hosts = [('10.0.0.{}'.format(i), 'c{}'.format(i)) for i in range(30)]
+    changed = [(host, community + 'x') if i % 3 == 0 else (host, community) for i, (host, community) in enumerate(hosts)]
+    elem_a = snmp_hosts(hosts)
+    elem_b = snmp_hosts(list(reversed(changed)))
+    tree_a, tree_b = CompactTree.pair([elem_a], [elem_b])
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    sizes = []
+    hungarian = NodeSimilarity.hungarian
+
+    def record_hungarian(self, nodes_a, nodes_b):
+        sizes.append((len(nodes_a), len(nodes_b)))
+        return hungarian(self, nodes_a, nodes_b)
+
+    with mock.patch.object(NodeSimilarity, 'hungarian', record_hungarian):
+        pairs = list(similarity.indexes(list(tree_a.children(0)), list(tree_b.children(0))))
+
+    assert pairs == [(i, 29 - i) for i in range(30)]
+    # Neither a matrix of all hosts nor of the children of a host, which are
+    # all leaves, see NodeSimilarity.bounds
+    assert max(sizes) == (1, 1)
+
+
+def test_similarity_indexes_blocked_leftovers():
+    hosts = [('10.0.0.{}'.format(i), 'c{}'.format(i)) for i in range(25)]
+    elem_a = snmp_hosts(hosts)
+    # Only the version shared by all hosts in common with the first host of
+    # elem_a, so it is in no block
+    elem_b = snmp_hosts(hosts[1:] + [('10.1.1.1', 'other'), ('10.1.1.2', 'other')])
+    elem_b[-1].find('version').text = '1'
+    tree_a, tree_b = CompactTree.pair([elem_a], [elem_b])
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    pairs = list(similarity.indexes(list(tree_a.children(0)), list(tree_b.children(0))))
+
+    assert pairs == [(0, 24)] + [(i, i - 1) for i in range(1, 25)]
+
+
+def test_similarity_bounds_exact_for_leaves():
+    tree_a, tree_b = CompactTree.pair(
+        [etree.XML('<data><foo>1</foo><foo>2</foo><bar>3</bar></data>')],
+        [etree.XML('<data><foo>2</foo><foo>4</foo><tar>3</tar></data>')]
+    )
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    lower, upper = similarity.bounds(tree_a.children(0), tree_b.children(0))
+    assert lower == upper == approx((1 + A_INFINITESIMAL_SIMILARITY) / 3)
+    with mock.patch.object(NodeSimilarity, 'hungarian') as mock_hungarian:
+        assert similarity.element(0, 0) == upper
+    mock_hungarian.assert_not_called()
+
+
+def test_similarity_bounds_with_children():
+    tree_a, tree_b = CompactTree.pair(
+        [etree.XML('<data><foo><tar>1</tar></foo><foo><tar>2</tar></foo><kil>1</kil></data>')],
+        [etree.XML('<data><foo><tar>2</tar></foo><foo><tar>3</tar></foo><kil>2</kil></data>')]
+    )
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    lower, upper = similarity.bounds(tree_a.children(0), tree_b.children(0))
+    assert lower == approx((1 + A_INFINITESIMAL_SIMILARITY) / 3)
+    assert upper == approx((2 + A_INFINITESIMAL_SIMILARITY) / 3)
+    assert lower <= similarity.element(0, 0) <= upper
+
+
+def test_similarity_threshold_returns_upper_bound():
+    tree_a, tree_b = CompactTree.pair(
+        [etree.XML('<data><foo><tar>1</tar></foo><kil>1</kil><zab>1</zab></data>')],
+        [etree.XML('<data><foo><tar>2</tar></foo><kil>2</kil><zab>2</zab></data>')]
+    )
+    similarity = NodeSimilarity(tree_a, tree_b)
+
+    with mock.patch.object(NodeSimilarity, 'hungarian') as mock_hungarian:
+        assert similarity.element(0, 0, threshold=0.5) == approx((1 + 2 * A_INFINITESIMAL_SIMILARITY) / 3)
+        assert not similarity.exceeds(0, 0, 0.5)
+    mock_hungarian.assert_not_called()
+    # Not exact, so not cached
+    assert not similarity.cache
+    assert similarity.element(0, 0) == approx(3 * A_INFINITESIMAL_SIMILARITY / 3)
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+import mock
+
+from pyocnos import tracing
+from pyocnos.diff import build_xml_diff
+from pyocnos.ocnos import OCNOS
+from pyocnos.tracing import FileExporter
+from pyocnos.tracing import MemoryExporter
+from pyocnos.tracing import NOOP_SPAN
+from pyocnos.tracing import NoopTracer
+from pyocnos.tracing import Tracer
+
+connect_path = 'pyocnos.ocnos.manager.connect'
+manager_path = 'pyocnos.ocnos.DefaultManager'
+sleep_path = 'pyocnos.ocnos.sleep'
+
+
+class TestTracer(TestCase):
+
+    def setUp(self):
+        self.exporter = MemoryExporter()
+        self.tracer = Tracer(self.exporter)
+
+    def test_success_spans_nested(self):
+        with self.tracer.span('outer', {'device.hostname': 'switch1'}) as outer:
+            with self.tracer.span('inner') as inner:
+                inner.set_attribute('config.bytes', 42)
+            self.assertIs(outer, self.tracer.current())
+        self.assertIsNone(self.tracer.current())
+
+        self.assertEqual([inner, outer], self.exporter.spans)
+        self.assertEqual(outer.trace_id, inner.trace_id)
+        self.assertEqual(outer.span_id, inner.parent_id)
+        self.assertIsNone(outer.parent_id)
+        self.assertEqual({'config.bytes': 42}, inner.attributes)
+        self.assertGreaterEqual(outer.duration, inner.duration)
+
+    def test_success_spans_of_threads_apart(self):
+        def run():
+            with self.tracer.span('thread'):
+                pass
+
+        with self.tracer.span('outer') as outer:
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+        span = self.exporter.find('thread')[0]
+        self.assertIsNone(span.parent_id)
+        self.assertNotEqual(outer.trace_id, span.trace_id)
+
+    def test_success_error_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span('failing'):
+                raise ValueError('boom')
+        span = self.exporter.find('failing')[0]
+        self.assertEqual('ValueError: boom', span.error)
+        self.assertEqual({'code': 'ERROR', 'message': 'ValueError: boom'}, span.to_dict()['status'])
+
+    def test_success_noop_tracer(self):
+        with NoopTracer().span('noop', {'device.hostname': 'switch1'}) as span:
+            span.set_attribute('config.bytes', 42)
+        self.assertIs(NOOP_SPAN, span)
+        self.assertFalse(span.recording)
+
+    def test_success_file_exporter(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.jsonl')
+            exporter = FileExporter(path)
+            tracer = Tracer(exporter)
+            with tracer.span('outer', {'device.hostname': 'switch1'}):
+                with tracer.span('inner'):
+                    pass
+            exporter.close()
+            with open(path) as trace_file:
+                records = [json.loads(line) for line in trace_file]
+        self.assertEqual(['inner', 'outer'], [record['name'] for record in records])
+        self.assertEqual(records[1]['span_id'], records[0]['parent_span_id'])
+        self.assertEqual({'device.hostname': 'switch1'}, records[1]['attributes'])
+        self.assertEqual({'code': 'OK'}, records[1]['status'])
+        self.assertLessEqual(records[1]['start_time_unix_nano'], records[0]['start_time_unix_nano'])
+        self.assertLessEqual(records[0]['end_time_unix_nano'], records[1]['end_time_unix_nano'])
+
+
+class TestTracing(TestCase):
+
+    def setUp(self):
+        self.exporter = MemoryExporter()
+        tracing.set_tracer(Tracer(self.exporter))
+        self.addCleanup(tracing.set_tracer, NoopTracer())
+
+    def test_success_diff_stages_traced(self):
+        build_xml_diff('<config><vr><vrId>1</vrId></vr></config>', '<config><vr><vrId>2</vrId></vr></config>')
+        self.assertEqual(
+            ['diff.normalize_tree', 'diff.normalize_tree', 'diff.rdiff', 'diff.build_diff_tree', 'diff.rrender'],
+            [span.name for span in self.exporter.spans]
+        )
+        normalize = self.exporter.spans[0]
+        self.assertEqual({'config.bytes': 40, 'config.elements': 3}, normalize.attributes)
+        self.assertEqual({'diff.nodes.left': 3, 'diff.nodes.right': 3, 'diff.workers': 1},
+                         self.exporter.find('diff.rdiff')[0].attributes)
+        self.assertEqual({'diff.added': 1, 'diff.moved': 0, 'diff.removed': 1},
+                         self.exporter.find('diff.build_diff_tree')[0].attributes)
+        self.assertEqual({'diff.lines': 4}, self.exporter.find('diff.rrender')[0].attributes)
+
+    @mock.patch(sleep_path)
+    def test_success_device_operations_traced(self, _):
+        device = OCNOS(hostname='switch1', username='username', password='password')
+        with mock.patch(connect_path), mock.patch(manager_path) as mock_manager:
+            mock_manager.return_value.get_config.return_value.data_xml = '<data><vr><vrId>1</vrId></vr></data>'
+            mock_manager.return_value.server_capabilities = [':candidate']
+            device.open()
+            device.get_config('running')
+            device.load_candidate_config(config='<config><vr><vrId>2</vrId></vr></config>')
+            device.commit_config()
+
+        self.assertEqual([
+            'ocnos.basic_mode', 'ocnos.open',
+            'netconf.get_config', 'ocnos.get_config',
+            'netconf.discard_changes', 'netconf.edit_config', 'netconf.commit', 'netconf.lock', 'ocnos.save',
+            'ocnos.commit',
+        ], [span.name for span in self.exporter.spans])
+        get_config = self.exporter.find('ocnos.get_config')[0]
+        self.assertEqual({'device.hostname': 'switch1', 'config.source': 'running', 'config.bytes': 36,
+                          'config.elements': 3}, get_config.attributes)
+        self.assertEqual(get_config.span_id, self.exporter.find('netconf.get_config')[0].parent_id)
+        commit = self.exporter.find('ocnos.commit')[0]
+        self.assertEqual({'device.hostname': 'switch1', 'commit.operation': 'merge'}, commit.attributes)
+        self.assertEqual({'device.hostname': 'switch1', 'config.elements': 3},
+                         self.exporter.find('netconf.edit_config')[0].attributes)
@@ -0,0 +1,103 @@
+import os
+from unittest import TestCase
+
+from lxml import etree
+
+from pyocnos.watch import ChangeEvent
+from pyocnos.watch import ConfigWatcher
+from pyocnos.watch import split_containers
+from pyocnos.watch import subtree_filter
+
+VR_NS = 'http://www.ipinfusion.com/yang/ocnos/ipi-vr'
+NTP_NS = 'http://www.ipinfusion.com/yang/ocnos/ipi-ntp'
+
+
+class Device:
+    """ Device returning its running config, or the part of it selected by a subtree filter """
+
+    def __init__(self, config):
+        self.hostname = 'switch1'
+        self.config = config
+        self.subtrees = []
+
+    def get_config(self, retrieve, subtree=None):
+        self.subtrees.append(subtree)
+        root = etree.fromstring(self.config.encode())
+        if subtree is not None:
+            tag = etree.fromstring(subtree.encode()).tag
+            for container in list(root):
+                if container.tag != tag:
+                    root.remove(container)
+        return {retrieve: etree.tostring(root).decode()}
+
+
+def running_config(vr_id, ntp=None):
+    ntp = '' if ntp is None else '<ntp xmlns="{}"><server>{}</server></ntp>'.format(NTP_NS, ntp)
+    return '<config><vr xmlns="{}"><vrId>{}</vrId></vr>{}</config>'.format(VR_NS, vr_id, ntp)
+
+
+class TestSplitContainers(TestCase):
+
+    def test_success(self):
+        containers = split_containers(running_config(1, '10.0.0.1'))
+        self.assertEqual(['{%s}vr' % VR_NS, '{%s}ntp' % NTP_NS], list(containers))
+        self.assertEqual('<config><vr><vrId>1</vrId></vr></config>',
+                         etree.tostring(containers['{%s}vr' % VR_NS].tree).decode())
+
+    def test_success_subtree_filter(self):
+        self.assertEqual('<vr xmlns="{}"/>'.format(VR_NS), subtree_filter('{%s}vr' % VR_NS))
+        self.assertEqual('<vr/>', subtree_filter('vr'))
+
+
+class TestConfigWatcher(TestCase):
+
+    def setUp(self):
+        self.device = Device(running_config(1, '10.0.0.1'))
+        self.watcher = ConfigWatcher(self.device, full_fetch_every=3)
+
+    def test_success_first_poll_knows_config(self):
+        self.assertEqual([], list(self.watcher.poll()))
+        self.assertEqual([None], self.device.subtrees)
+        self.assertEqual(2, len(self.watcher.containers))
+
+    def test_success_poll_by_container(self):
+        list(self.watcher.poll())
+        self.assertEqual([], list(self.watcher.poll()))
+        self.assertEqual([None, '<vr xmlns="{}"/>'.format(VR_NS), '<ntp xmlns="{}"/>'.format(NTP_NS)],
+                         self.device.subtrees)
+
+        self.device.config = running_config(2, '10.0.0.1')
+        self.assertEqual([
+            ChangeEvent('switch1', 'vr', 'changed', os.linesep.join(
+                ['[config]', '  [vr]', '-   <vrId>1</vrId>', '+   <vrId>2</vrId>']
+            )),
+        ], list(self.watcher.poll()))
+        # The change is known from then on
+        self.assertEqual([], list(self.watcher.poll()))
+
+    def test_success_cache_cleared_after_poll(self):
+        vrfs = '<config><vr xmlns="{}"><vrf><id>1</id><a>{}</a></vrf><vrf><id>2</id><a>{}</a></vrf></vr></config>'
+        self.device.config = vrfs.format(VR_NS, 1, 2)
+        list(self.watcher.poll())
+        self.device.config = vrfs.format(VR_NS, 3, 4)
+        events = self.watcher.poll()
+        self.assertEqual('vr', next(events).container)
+        self.assertTrue(self.watcher.cache)
+        self.assertEqual([], list(events))
+        self.assertFalse(self.watcher.cache)
+
+    def test_success_poll_removed_and_added_containers(self):
+        list(self.watcher.poll())
+        self.device.config = running_config(1)
+        self.assertEqual([
+            ChangeEvent('switch1', 'ntp', 'removed', os.linesep.join(
+                ['[config]', '- <ntp>', '-   <server>10.0.0.1</server>', '- </ntp>']
+            )),
+        ], list(self.watcher.poll()))
+
+        # Added containers are found by retrieving the whole config
+        self.device.config = running_config(1, '10.0.0.2')
+        self.assertEqual([], list(self.watcher.poll()))
+        events = list(self.watcher.poll())
+        self.assertEqual([('ntp', 'added')], [(event.container, event.change) for event in events])
+        self.assertIsNone(self.device.subtrees[-1])